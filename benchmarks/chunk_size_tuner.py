@@ -0,0 +1,122 @@
+"""
+Benchmark a data chunk store with a range of chunk sizes, and recommend the size giving the best throughput.
+Each trial writes and then reads back sample content using the standard chunk writer and reader, and cleans up
+after itself. Sizes the store rejects (e.g.: Items over the DynamoDB 400KB limit) are reported as failed.
+
+Usage: python benchmarks/chunk_size_tuner.py [--store data_chunk] [--sample-mb 16]
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+from uuid import uuid4
+
+from persisty.attr.attr_filter import attr_eq
+from persisty.finder.store_meta_finder_abc import find_store_meta_by_name
+from persisty.store.store_abc import StoreABC
+
+from persisty_data.persisty_store.content_chunk_refs import delete_data_chunks
+from persisty_data.persisty_store.data_chunk import DataChunk
+from persisty_data.persisty_store.data_chunk_reader import DataChunkReader
+from persisty_data.persisty_store.data_chunk_writer import DataChunkWriter
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+DEFAULT_CHUNK_SIZES = tuple(2**n * 1024 for n in range(6, 13))  # 64KB - 4MB
+
+
+@dataclass
+class ChunkSizeTrial:
+    chunk_size: int
+    num_bytes: int
+    write_seconds: Optional[float] = None
+    read_seconds: Optional[float] = None
+    error: Optional[str] = None
+
+    def get_throughput(self) -> Optional[float]:
+        """Bytes per second to write the sample and then read it back"""
+        if self.error:
+            return None
+        return self.num_bytes / max(self.write_seconds + self.read_seconds, 1e-9)
+
+
+def run_trial(
+    data_chunk_store: StoreABC[DataChunk], chunk_size: int, content: bytes
+) -> ChunkSizeTrial:
+    trial = ChunkSizeTrial(chunk_size=chunk_size, num_bytes=len(content))
+    upload_id = str(uuid4())
+    try:
+        start = time.perf_counter()
+        with DataChunkWriter(
+            PersistyUploadPart(upload_id=upload_id, part_number=0),
+            data_chunk_store=data_chunk_store,
+            chunk_size=chunk_size,
+        ) as writer:
+            writer.write(content)
+        trial.write_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with DataChunkReader(
+            upload_id=upload_id,
+            size_in_bytes=len(content),
+            data_chunk_store=data_chunk_store,
+            chunk_size=chunk_size,
+        ) as reader:
+            if reader.read() != content:
+                trial.error = "content_mismatch"
+        trial.read_seconds = time.perf_counter() - start
+    # pylint: disable=W0718
+    except Exception as exc:
+        trial.error = str(exc) or type(exc).__name__
+    finally:
+        delete_data_chunks(data_chunk_store, attr_eq("upload_id", upload_id))
+    return trial
+
+
+def tune_chunk_size(
+    data_chunk_store: StoreABC[DataChunk],
+    chunk_sizes: Iterable[int] = DEFAULT_CHUNK_SIZES,
+    num_bytes: int = 16 * 1024 * 1024,
+) -> List[ChunkSizeTrial]:
+    """Run a trial for each chunk size. Random content is used so results are not skewed by compression"""
+    content = os.urandom(num_bytes)
+    return [run_trial(data_chunk_store, s, content) for s in chunk_sizes]
+
+
+def recommend_chunk_size(trials: Iterable[ChunkSizeTrial]) -> Optional[int]:
+    trials = [t for t in trials if not t.error]
+    if trials:
+        return max(trials, key=ChunkSizeTrial.get_throughput).chunk_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--store", default="data_chunk")
+    parser.add_argument("--sample-mb", type=float, default=16)
+    parser.add_argument("--chunk-kb", type=int, nargs="*")
+    args = parser.parse_args()
+
+    data_chunk_store = find_store_meta_by_name(args.store).create_store()
+    chunk_sizes = DEFAULT_CHUNK_SIZES
+    if args.chunk_kb:
+        chunk_sizes = [n * 1024 for n in args.chunk_kb]
+    trials = tune_chunk_size(
+        data_chunk_store, chunk_sizes, int(args.sample_mb * 1024 * 1024)
+    )
+    for trial in trials:
+        if trial.error:
+            print(f"{trial.chunk_size // 1024}KB: failed ({trial.error})")
+        else:
+            print(
+                f"{trial.chunk_size // 1024}KB: write {trial.write_seconds:.3f}s, "
+                f"read {trial.read_seconds:.3f}s, "
+                f"{trial.get_throughput() / 1024 / 1024:.1f}MB/s"
+            )
+    chunk_size = recommend_chunk_size(trials)
+    if chunk_size:
+        print(f"Recommended: FileStoreMeta(chunk_size={chunk_size})")
+    else:
+        print("No chunk size succeeded")
+
+
+if __name__ == "__main__":
+    main()
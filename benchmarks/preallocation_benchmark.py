@@ -0,0 +1,159 @@
+"""
+Benchmark the effect of preallocation on directory file store uploads. Each run writes the parts of an upload
+concurrently (interleaving writes, as parallel uploaders do), finishes the upload and reads it back, reporting
+throughput and the number of extents (fragments) in the part files and the finished file. Extents are counted
+using FIEMAP, so are only reported on filesystems supporting it (e.g.: ext4, xfs, btrfs - not tmpfs).
+
+Usage: python benchmarks/preallocation_benchmark.py [--dir .] [--parts 4] [--part-mb 64]
+"""
+import argparse
+import os
+import shutil
+import struct
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+from uuid import uuid4
+
+from persisty.impl.mem.mem_store import MemStore
+from persisty.store_meta import get_meta
+
+from persisty_data.directory.directory_file_store import DirectoryFileStore, ioctl
+from persisty_data.file_store_meta import FileStoreMeta
+from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
+from persisty_data.persisty_store.persisty_upload_handle import PersistyUploadHandle
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+FS_IOC_FIEMAP = 0xC020660B  # From linux/fs.h
+FIEMAP_FORMAT = "=QQLLLL"  # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved
+FIEMAP_FLAG_SYNC = 0x1
+
+
+@dataclass
+class PreallocationTrial:
+    preallocate: bool
+    num_bytes: int
+    write_seconds: float
+    finish_seconds: float
+    read_seconds: float
+    part_extents: Optional[int] = None
+    file_extents: Optional[int] = None
+
+    def get_write_throughput(self) -> float:
+        return self.num_bytes / max(self.write_seconds, 1e-9)
+
+    def get_read_throughput(self) -> float:
+        return self.num_bytes / max(self.read_seconds, 1e-9)
+
+
+def count_extents(path: Path) -> Optional[int]:
+    """Count the extents of a file, or None if the filesystem does not support FIEMAP"""
+    if ioctl is None:
+        return None
+    request = bytearray(
+        struct.pack(FIEMAP_FORMAT, 0, 2**64 - 1, FIEMAP_FLAG_SYNC, 0, 0, 0)
+    )
+    with open(path, "rb") as file:
+        try:
+            ioctl(file.fileno(), FS_IOC_FIEMAP, request)
+        except OSError:
+            return None
+    return struct.unpack(FIEMAP_FORMAT, request)[3]
+
+
+def sum_extents(paths: Iterable[Path]) -> Optional[int]:
+    extents = [count_extents(p) for p in paths]
+    if None not in extents:
+        return sum(extents)
+
+
+# pylint: disable=R0914
+def run_trial(
+    directory: Path,
+    preallocate: bool,
+    num_parts: int,
+    part_size: int,
+    write_size: int,
+) -> PreallocationTrial:
+    directory = Path(directory, f"preallocation_benchmark_{uuid4().hex}")
+    file_store = DirectoryFileStore(
+        meta=FileStoreMeta(
+            name="benchmark",
+            max_part_size=part_size,
+            max_file_size=num_parts * part_size,
+        ),
+        file_handle_store=MemStore(get_meta(PersistyFileHandle)),
+        upload_handle_store=MemStore(get_meta(PersistyUploadHandle)),
+        upload_part_store=MemStore(get_meta(PersistyUploadPart)),
+        store_dir=directory / "store",
+        upload_dir=directory / "upload",
+        preallocate=preallocate,
+    )
+    try:
+        num_bytes = num_parts * part_size
+        upload_handle = file_store.upload_create("benchmark.bin", None, num_bytes)
+        upload_parts = file_store.upload_part_search(upload_handle.id).results
+        data = os.urandom(write_size)
+        start = time.perf_counter()
+        writers = [file_store.upload_write(p.id) for p in upload_parts]
+        for _ in range(part_size // write_size):
+            for writer in writers:
+                writer.write(data)
+        for writer in writers:
+            writer.flush()
+            # Force allocation, which may otherwise be delayed until writeback
+            os.fsync(writer.writer.fileno())
+            writer.__exit__(None, None, None)
+        write_seconds = time.perf_counter() - start
+        part_extents = sum_extents(
+            p for p in Path(directory, "upload").rglob("*") if p.is_file()
+        )
+        start = time.perf_counter()
+        file_store.upload_finish(upload_handle.id)
+        finish_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with file_store.content_read("benchmark.bin") as reader:
+            while reader.read(write_size):
+                pass
+        read_seconds = time.perf_counter() - start
+        return PreallocationTrial(
+            preallocate=preallocate,
+            num_bytes=num_bytes,
+            write_seconds=write_seconds,
+            finish_seconds=finish_seconds,
+            read_seconds=read_seconds,
+            part_extents=part_extents,
+            file_extents=count_extents(Path(directory, "store", "benchmark.bin")),
+        )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dir", default=".")
+    parser.add_argument("--parts", type=int, default=4)
+    parser.add_argument("--part-mb", type=int, default=64)
+    parser.add_argument("--write-kb", type=int, default=256)
+    args = parser.parse_args()
+
+    for preallocate in (False, True):
+        trial = run_trial(
+            Path(args.dir),
+            preallocate,
+            args.parts,
+            args.part_mb * 1024 * 1024,
+            args.write_kb * 1024,
+        )
+        print(
+            f"preallocate={preallocate}: "
+            f"write {trial.get_write_throughput() / 1024 / 1024:.1f}MB/s, "
+            f"finish {trial.finish_seconds:.3f}s, "
+            f"read {trial.get_read_throughput() / 1024 / 1024:.1f}MB/s, "
+            f"part extents {trial.part_extents}, file extents {trial.file_extents}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare download times for a PersistyFileStore style reader with read-ahead prefetching on and off. The data chunk
+store is an in memory store with latency injected on every page, and the consumer simulates a fixed bandwidth.
+
+Usage: python benchmarks/prefetch_benchmark.py [--size-mb 16] [--page-latency 0.02] [--bandwidth-mb 64]
+"""
+import argparse
+import time
+from itertools import islice
+
+from persisty.impl.mem.mem_store import MemStore
+from persisty.search_filter.include_all import INCLUDE_ALL
+from persisty.store_meta import get_meta
+
+from persisty_data.persisty_store.data_chunk import DataChunk
+from persisty_data.persisty_store.data_chunk_reader import DataChunkReader
+from persisty_data.persisty_store.data_chunk_writer import DataChunkWriter
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+CHUNK_SIZE = 256 * 1024
+PAGE_SIZE = 4
+
+
+class LatencyMemStore(MemStore):
+    """Mem store which returns search results in pages, sleeping before each page as a remote store would"""
+
+    page_latency: float = 0
+
+    def search_all(self, search_filter=INCLUDE_ALL, search_order=None):
+        items = super().search_all(search_filter, search_order)
+        while True:
+            time.sleep(self.page_latency)
+            page = list(islice(items, PAGE_SIZE))
+            yield from page
+            if len(page) < PAGE_SIZE:
+                return
+
+
+def run(store: LatencyMemStore, size: int, bandwidth: int, prefetch_bytes):
+    reader = DataChunkReader(
+        upload_id="benchmark",
+        size_in_bytes=size,
+        data_chunk_store=store,
+        chunk_size=CHUNK_SIZE,
+        prefetch_bytes=prefetch_bytes,
+    )
+    start = time.perf_counter()
+    with reader:
+        while True:
+            data = reader.read(64 * 1024)
+            if not data:
+                break
+            time.sleep(len(data) / bandwidth)  # Time taken to send to the client
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--page-latency", type=float, default=0.02)
+    parser.add_argument("--bandwidth-mb", type=float, default=64)
+    parser.add_argument("--prefetch-mb", type=float, default=4)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    store = LatencyMemStore(get_meta(DataChunk))
+    upload_part = PersistyUploadPart(upload_id="benchmark", part_number=0)
+    with DataChunkWriter(
+        upload_part, data_chunk_store=store, chunk_size=CHUNK_SIZE
+    ) as writer:
+        writer.write(bytes(size))
+    store.page_latency = args.page_latency
+    bandwidth = args.bandwidth_mb * 1024 * 1024
+
+    num_pages = size // CHUNK_SIZE // PAGE_SIZE
+    print(f"{args.size_mb}MB, {num_pages} pages @ {args.page_latency}s latency")
+    print(f"Transfer alone: {size / bandwidth:.3f}s")
+    print(f"Store latency alone: {num_pages * args.page_latency:.3f}s")
+    off = run(store, size, bandwidth, None)
+    print(f"Prefetch off: {off:.3f}s")
+    on = run(store, size, bandwidth, int(args.prefetch_mb * 1024 * 1024))
+    print(f"Prefetch on ({args.prefetch_mb}MB): {on:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
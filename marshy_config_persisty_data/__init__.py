@@ -31,6 +31,13 @@ def configure(context: MarshallerContext):
 
     register_impl(AttrValueGeneratorABC, FileHandleIdGenerator, context)
 
+    from persisty_data.codec.chunk_codec_abc import ChunkCodecABC
+    from persisty_data.codec.lzma_chunk_codec import LzmaChunkCodec
+    from persisty_data.codec.zlib_chunk_codec import ZlibChunkCodec
+
+    register_impl(ChunkCodecABC, ZlibChunkCodec, context)
+    register_impl(ChunkCodecABC, LzmaChunkCodec, context)
+
     configure_serverless(context)
 
 
@@ -0,0 +1,46 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Iterator
+
+from marshy.factory.impl_marshaller_factory import get_impls
+from persisty.errors import PersistyError
+
+_DataChunk = "persisty_data.persisty_store.data_chunk.DataChunk"
+
+
+class ChunkCodecABC(ABC):
+    """
+    Codec for compressing chunk data at rest. The name of the codec is stored with each chunk so that it can be
+    decoded, so implementations should be registered with marshy and names should not change.
+    """
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Name recorded against chunks encoded with this codec"""
+
+    @abstractmethod
+    def encode(self, data: bytes) -> bytes:
+        """Encode the data given"""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> bytes:
+        """Decode the data given"""
+
+
+@lru_cache
+def get_chunk_codec(name: str) -> ChunkCodecABC:
+    for impl in get_impls(ChunkCodecABC):
+        codec = impl()
+        if codec.name == name:
+            return codec
+    raise PersistyError(f"unknown_chunk_codec:{name}")
+
+
+def decode_chunks(data_chunks: Iterator[_DataChunk]) -> Iterator[_DataChunk]:
+    """Decode the data of any encoded chunks"""
+    for data_chunk in data_chunks:
+        if data_chunk.codec:
+            data_chunk.data = get_chunk_codec(data_chunk.codec).decode(data_chunk.data)
+            data_chunk.codec = None
+        yield data_chunk
@@ -0,0 +1,19 @@
+import lzma
+from dataclasses import dataclass
+
+from persisty_data.codec.chunk_codec_abc import ChunkCodecABC
+
+
+@dataclass
+class LzmaChunkCodec(ChunkCodecABC):
+    preset: int = 6
+
+    @property
+    def name(self) -> str:
+        return "lzma"
+
+    def encode(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.preset)
+
+    def decode(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
@@ -0,0 +1,19 @@
+import zlib
+from dataclasses import dataclass
+
+from persisty_data.codec.chunk_codec_abc import ChunkCodecABC
+
+
+@dataclass
+class ZlibChunkCodec(ChunkCodecABC):
+    level: int = 6
+
+    @property
+    def name(self) -> str:
+        return "zlib"
+
+    def encode(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decode(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
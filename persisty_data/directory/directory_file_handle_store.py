@@ -0,0 +1,333 @@
+"""
+Store for the file handles of a DirectoryFileStore which keeps them with the files rather than in a database, for
+single node deployments. Size and updated_at come from os.stat. The etag, content type and upload id are kept in
+an extended attribute on the file (or a hidden sidecar file on filesystems without them), along with the stats
+they were recorded against - a file changed by another process is rehashed when next read.
+"""
+import errno
+import json
+import mimetypes
+import os
+import stat as stat_
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, Optional, Tuple
+from uuid import UUID
+
+from persisty.attr.attr_filter import AttrFilter
+from persisty.attr.attr_filter_op import AttrFilterOp
+from persisty.result_set import ResultSet
+from persisty.search_filter.and_filter import And
+from persisty.search_filter.include_all import INCLUDE_ALL
+from persisty.search_filter.search_filter_abc import SearchFilterABC
+from persisty.search_order.search_order import SearchOrder
+from persisty.store.store_abc import StoreABC
+from persisty.store_meta import StoreMeta, get_meta
+from persisty.util import UNDEFINED
+
+from persisty_data.directory.directory_sync import (
+    get_meta_path,
+    get_shard,
+    get_stat_key,
+    walk_prefix,
+    walk_sharded_files,
+)
+from persisty_data.directory.durability import get_temp_path
+from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
+
+META_XATTR = "user.persisty"
+
+# (size, mtime_ns, inode) - an atomic replacement changes the inode even if the size and mtime are preserved
+StatKey = Tuple[int, int, int]
+
+
+# pylint: disable=R0902
+@dataclass
+class DirectoryFileHandleStore(StoreABC[PersistyFileHandle]):
+    """
+    Handles are cached (up to max_cached of them), keyed by file name and checked against a fresh stat on each
+    read, so a hit costs a single stat rather than reading metadata, and changes by other processes are never
+    missed. Searches walk the directory, only visiting directories which may hold files with a file_name prefix
+    from the filter (in a flat layout).
+    """
+
+    store_name: str
+    store_dir: Path
+    shard_depth: int = 0
+    use_xattrs: bool = hasattr(os, "setxattr")
+    max_cached: int = 10_000
+    meta: StoreMeta = field(default_factory=lambda: get_meta(PersistyFileHandle))
+    cache: "OrderedDict[str, Tuple[StatKey, PersistyFileHandle]]" = field(
+        default_factory=OrderedDict
+    )
+    lock: Lock = field(default_factory=Lock)
+
+    def get_meta(self) -> StoreMeta:
+        return self.meta
+
+    def create(self, item: PersistyFileHandle) -> Optional[PersistyFileHandle]:
+        """The content is the item - this records metadata for the file which must already be in place"""
+        return self._write(item, None)
+
+    def read(self, key: str) -> Optional[PersistyFileHandle]:
+        file_name = self._to_file_name(key)
+        if file_name:
+            return self._load(file_name)
+
+    def _update(
+        self, key: str, item: PersistyFileHandle, updates: PersistyFileHandle
+    ) -> Optional[PersistyFileHandle]:
+        return self._write(updates, item)
+
+    def _delete(self, key: str, item: PersistyFileHandle) -> bool:
+        file_name = self._to_file_name(key)
+        if not file_name:
+            return False
+        path = self._to_path(file_name)
+        with self.lock:
+            self.cache.pop(file_name, None)
+        try:
+            get_meta_path(path).unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def search(
+        self,
+        search_filter: SearchFilterABC[PersistyFileHandle] = INCLUDE_ALL,
+        search_order: Optional[SearchOrder[PersistyFileHandle]] = None,
+        page_key: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> ResultSet[PersistyFileHandle]:
+        if not _is_file_name_order(search_order):
+            return super().search(search_filter, search_order, page_key, limit)
+        if limit is None:
+            limit = self.meta.batch_size
+        assert limit <= self.meta.batch_size
+        # Pages resume after the file name in the key, so skipped files are not loaded
+        after = self._to_file_name(page_key) if page_key else None
+        search_filter = search_filter.lock_attrs(self.meta.attrs)
+        items = list(islice(self._search(search_filter, after), limit))
+        next_page_key = None
+        if len(items) == limit:
+            next_page_key = items[-1].id
+        return ResultSet(items, next_page_key)
+
+    def search_all(
+        self,
+        search_filter: SearchFilterABC[PersistyFileHandle] = INCLUDE_ALL,
+        search_order: Optional[SearchOrder[PersistyFileHandle]] = None,
+    ) -> Iterator[PersistyFileHandle]:
+        search_filter = search_filter.lock_attrs(self.meta.attrs)
+        if search_order:
+            search_order.validate_for_attrs(self.meta.attrs)
+        items = self._search(search_filter)
+        if not _is_file_name_order(search_order):
+            items = iter(search_order.sort(list(items)))
+        return items
+
+    def count(
+        self, search_filter: SearchFilterABC[PersistyFileHandle] = INCLUDE_ALL
+    ) -> int:
+        search_filter = search_filter.lock_attrs(self.meta.attrs)
+        return sum(1 for _ in self._search(search_filter))
+
+    def _search(
+        self, search_filter: SearchFilterABC, after: Optional[str] = None
+    ) -> Iterator[PersistyFileHandle]:
+        """Yield the handles matching the filter given in file_name order, optionally only those after a name"""
+        prefix = get_file_name_prefix(search_filter)
+        if self.shard_depth:
+            # Shards are named from hashes, so the whole tree is walked
+            files = walk_sharded_files(self.store_dir, self.shard_depth)
+            prefix = prefix.lower()
+            files = sorted(f for f in files if f[0].lower().startswith(prefix))
+        else:
+            files = walk_prefix(self.store_dir, prefix)
+        for file_name, stat in files:
+            if after is not None and file_name <= after:
+                continue
+            item = self._load(file_name, stat)
+            if item and search_filter.match(item, self.meta.attrs):
+                yield item
+
+    def _to_file_name(self, key: str) -> Optional[str]:
+        store_name, sep, file_name = str(key).partition("/")
+        if sep and store_name == self.store_name:
+            return file_name
+
+    def _to_path(self, file_name: str) -> Path:
+        if self.shard_depth:
+            file_name = f"{get_shard(file_name, self.shard_depth)}/{file_name}"
+        path = Path(self.store_dir, file_name)
+        assert os.path.normpath(path) == str(path)  # Prevent ../ shenanigans
+        return path
+
+    def _load(
+        self, file_name: str, stat: Optional[os.stat_result] = None
+    ) -> Optional[PersistyFileHandle]:
+        path = self._to_path(file_name)
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+        if not stat_.S_ISREG(stat.st_mode):
+            return None
+        stat_key = _get_stat_key(stat)
+        with self.lock:
+            cached = self.cache.get(file_name)
+            if cached and cached[0] == stat_key:
+                self.cache.move_to_end(file_name)
+                return replace(cached[1])
+        meta = self._read_meta(path)
+        if not meta or tuple(meta.get("stat_key") or ()) != stat_key:
+            meta = self._rehash(path, stat, meta)
+            if meta is None:
+                return None
+        file_handle = self._to_file_handle(file_name, stat, meta)
+        self._cache(file_name, stat_key, file_handle)
+        return replace(file_handle)
+
+    def _rehash(
+        self, path: Path, stat: os.stat_result, meta: Optional[Dict]
+    ) -> Optional[Dict]:
+        """Record metadata for a file changed by another process, keeping the content type from before"""
+        # Imported here as the directory_file_store module depends on this one
+        from persisty_data.directory.directory_file_store import file_hash
+
+        try:
+            etag = file_hash(path)
+            if get_stat_key(os.stat(path)) != get_stat_key(stat):
+                return None  # Changed while hashing - treated as absent until done
+        except FileNotFoundError:
+            return None
+        meta = {
+            "etag": etag,
+            "content_type": (meta or {}).get("content_type")
+            or mimetypes.guess_type(path.name)[0],
+            "created_at": (meta or {}).get("created_at"),
+            "stat_key": _get_stat_key(stat),
+        }
+        self._write_meta(path, meta)
+        return meta
+
+    def _write(
+        self, updates: PersistyFileHandle, item: Optional[PersistyFileHandle]
+    ) -> Optional[PersistyFileHandle]:
+        file_name = updates.file_name
+        if file_name in (None, UNDEFINED):
+            file_name = item.file_name
+        path = self._to_path(file_name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        values = {}
+        for name in ("etag", "content_type", "upload_id", "created_at"):
+            value = getattr(updates, name, UNDEFINED)
+            if value is UNDEFINED and item:
+                value = getattr(item, name)
+            values[name] = None if value is UNDEFINED else value
+        created_at = values["created_at"] or datetime.now().astimezone(timezone.utc)
+        meta = {
+            "etag": values["etag"],
+            "content_type": values["content_type"]
+            or mimetypes.guess_type(file_name)[0],
+            "upload_id": str(values["upload_id"]) if values["upload_id"] else None,
+            "created_at": created_at.isoformat(),
+            "stat_key": _get_stat_key(stat),
+        }
+        self._write_meta(path, meta)
+        file_handle = self._to_file_handle(file_name, stat, meta)
+        self._cache(file_name, meta["stat_key"], file_handle)
+        return replace(file_handle)
+
+    def _to_file_handle(
+        self, file_name: str, stat: os.stat_result, meta: Dict
+    ) -> PersistyFileHandle:
+        updated_at = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        created_at = meta.get("created_at")
+        upload_id = meta.get("upload_id")
+        return PersistyFileHandle(
+            id=f"{self.store_name}/{file_name}",
+            store_name=self.store_name,
+            file_name=file_name,
+            upload_id=UUID(upload_id) if upload_id else None,
+            content_type=meta.get("content_type"),
+            etag=meta["etag"],
+            size_in_bytes=stat.st_size,
+            data=None,
+            created_at=datetime.fromisoformat(created_at) if created_at else updated_at,
+            updated_at=updated_at,
+        )
+
+    def _cache(
+        self, file_name: str, stat_key: StatKey, file_handle: PersistyFileHandle
+    ):
+        with self.lock:
+            self.cache[file_name] = (stat_key, file_handle)
+            self.cache.move_to_end(file_name)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+
+    def _read_meta(self, path: Path) -> Optional[Dict]:
+        try:
+            if self.use_xattrs:
+                data = os.getxattr(path, META_XATTR)
+            else:
+                data = get_meta_path(path).read_bytes()
+            return json.loads(data)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, path: Path, meta: Dict):
+        data = json.dumps(meta).encode("utf-8")
+        if self.use_xattrs:
+            try:
+                os.setxattr(path, META_XATTR, data)
+                return
+            except OSError as exc:
+                if exc.errno not in (errno.ENOTSUP, errno.EOPNOTSUPP):
+                    raise
+                self.use_xattrs = False  # Not supported by this filesystem
+        meta_path = get_meta_path(path)
+        temp_path = get_temp_path(meta_path)
+        temp_path.write_bytes(data)
+        os.replace(temp_path, meta_path)
+
+
+def get_file_name_prefix(search_filter: SearchFilterABC) -> str:
+    """Get the longest prefix all file names matching the filter given must start with (case insensitively)"""
+    search_filters = (search_filter,)
+    if isinstance(search_filter, And):
+        search_filters = search_filter.search_filters
+    prefix = ""
+    for f in search_filters:
+        if (
+            isinstance(f, AttrFilter)
+            and f.name == "file_name"
+            and f.op in (AttrFilterOp.eq, AttrFilterOp.startswith)
+            and len(f.value) > len(prefix)
+        ):
+            prefix = f.value
+    return prefix
+
+
+def _is_file_name_order(search_order: Optional[SearchOrder]) -> bool:
+    if not search_order or not search_order.orders:
+        return True
+    order = search_order.orders[0]
+    return order.attr in ("file_name", "id") and not order.desc
+
+
+def _get_stat_key(stat: os.stat_result) -> StatKey:
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
@@ -1,17 +1,28 @@
 import hashlib
+import os
 from dataclasses import dataclass, field
 from io import IOBase
+from pathlib import Path
 from typing import BinaryIO, Optional, Union
 
 from persisty.store.store_abc import StoreABC
 from persisty.store_meta import get_meta
 
+from persisty_data.directory.durability import Durability, GroupSync, commit_file
 from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
 
 
+# pylint: disable=R0902
 @dataclass
 class DirectoryFileHandleWriter(IOBase):
+    """
+    Writer staging content to temp_path, which is renamed to path when complete (so readers never see a partial
+    file), syncing as the durability requires
+    """
+
     writer: BinaryIO
+    temp_path: Path
+    path: Path
     store_name: str
     file_name: str
     content_type: Optional[str]
@@ -20,6 +31,8 @@ class DirectoryFileHandleWriter(IOBase):
     file_handle_store: StoreABC[PersistyFileHandle] = field(
         default_factory=get_meta(PersistyFileHandle).create_store
     )
+    durability: Durability = Durability.NONE
+    group_sync: Optional[GroupSync] = None
 
     def __enter__(self):
         self.writer.__enter__()
@@ -33,13 +46,25 @@ class DirectoryFileHandleWriter(IOBase):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         result = self.writer.__exit__(exc_type, exc_val, exc_tb)
-        self.file_handle_store.create(
-            PersistyFileHandle(
-                store_name=self.store_name,
-                file_name=self.file_name,
-                content_type=self.content_type,
-                etag=self.hash.hexdigest(),
-                size_in_bytes=self.size_in_bytes,
-            )
+        if exc_type:
+            os.remove(self.temp_path)
+            return result
+        key = f"{self.store_name}/{self.file_name}"
+        # Read before the content is replaced, as a store keeping handles with content would otherwise rehash it
+        file_handle = self.file_handle_store.read(key)
+        commit_file(self.temp_path, self.path, self.durability, self.group_sync)
+        updates = PersistyFileHandle(
+            id=key,
+            store_name=self.store_name,
+            file_name=self.file_name,
+            content_type=self.content_type,
+            etag=self.hash.hexdigest(),
+            size_in_bytes=self.size_in_bytes,
         )
+        if file_handle:
+            # pylint: disable=W0212
+            # noinspection PyProtectedMember
+            self.file_handle_store._update(key, file_handle, updates)
+        else:
+            self.file_handle_store.create(updates)
         return result
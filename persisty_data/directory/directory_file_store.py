@@ -1,11 +1,15 @@
+import dataclasses
+import errno
 import hashlib
+import mimetypes
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
 from io import IOBase
+from itertools import islice
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional, Tuple
 from uuid import UUID
 
 from persisty.attr.attr_filter import attr_eq
@@ -13,26 +17,90 @@ from persisty.batch_edit import BatchEdit
 from persisty.search_order.search_order import SearchOrder
 from persisty.search_order.search_order_attr import SearchOrderAttr
 
+from persisty_data.directory.directory_file_handle_store import (
+    DirectoryFileHandleStore,
+)
 from persisty_data.directory.directory_file_handle_writer import (
     DirectoryFileHandleWriter,
 )
+from persisty_data.directory.directory_sync import (
+    SyncDiff,
+    diff_files,
+    get_shard,
+    get_stat_key,
+    is_unchanged,
+    walk_files,
+    walk_sharded_files,
+)
+from persisty_data.directory.directory_upload_part_writer import (
+    DirectoryUploadPartWriter,
+)
+from persisty_data.directory.durability import (
+    Durability,
+    GroupSync,
+    commit_file,
+    get_temp_path,
+    move_file,
+)
 from persisty_data.file_handle import FileHandle
+from persisty_data.file_store_abc import FileStoreABC
 from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
 from persisty_data.persisty_store.persisty_file_store_abc import PersistyFileStoreABC
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None  # Not available on windows
 
 COPY_BUFFER_SIZE = 1024 * 1024
+COPY_RANGE_SIZE = 1024 * 1024 * 1024
+FICLONE = 0x40049409  # From linux/fs.h
 
 
+# pylint: disable=R0902
 @dataclass
 class DirectoryFileStore(PersistyFileStoreABC):
     store_dir: Path = None
     upload_dir: Path = None
+    scrub_threads: int = 2  # Concurrent reads beyond this mostly cause seeks
+    sync_threads: int = 4
+    sync_batch_size: int = 100
+    shard_depth: int = 0
+    durability: Durability = Durability.NONE
+    # Set to group syncs across concurrent writers
+    group_sync: Optional[GroupSync] = None
+    # Reserve space for uploads of a declared size up front
+    preallocate: bool = True
+    # Keep file handles with the files themselves rather than in the file_handle_store given
+    stat_metadata: bool = False
 
     def __post_init__(self):
         if not self.store_dir:
             self.store_dir = Path("../file_store", self.meta.name, "store")
         if not self.upload_dir:
             self.upload_dir = Path("../file_store", self.meta.name, "upload")
+        if isinstance(self.file_handle_store, DirectoryFileHandleStore):
+            self.stat_metadata = True
+        elif self.stat_metadata:
+            self.file_handle_store = DirectoryFileHandleStore(
+                store_name=self.meta.name,
+                store_dir=self.store_dir,
+                shard_depth=self.shard_depth,
+            )
+
+    def _to_path(self, file_name: str) -> Path:
+        """
+        Get the path for the content of a file. With a shard_depth, files are spread over a tree of directories
+        named from a hash of the file name (e.g.: ab/cd/file_name), so no directory holds too many entries
+        """
+        if self.shard_depth:
+            shard = get_shard(file_name, self.shard_depth)
+            return key_to_path(self.store_dir, f"{shard}/{file_name}")
+        return key_to_path(self.store_dir, file_name)
+
+    def _commit_file(self, temp_path: Path, path: Path):
+        commit_file(temp_path, path, self.durability, self.group_sync)
 
     def content_write(
         self,
@@ -40,15 +108,21 @@ class DirectoryFileStore(PersistyFileStoreABC):
         content_type: Optional[str] = None,
     ) -> IOBase:
         try:
-            path = key_to_path(self.store_dir, file_name)
+            path = self._to_path(file_name)
             path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = get_temp_path(path)
             # pylint: disable=R1732
-            writer = open(path, "wb")
+            writer = open(temp_path, "wb")
             writer = DirectoryFileHandleWriter(
                 writer=writer,
+                temp_path=temp_path,
+                path=path,
                 store_name=self.meta.name,
                 file_name=file_name,
                 content_type=content_type,
+                file_handle_store=self.file_handle_store,
+                durability=self.durability,
+                group_sync=self.group_sync,
             )
             return writer
         except FileNotFoundError:
@@ -58,24 +132,55 @@ class DirectoryFileStore(PersistyFileStoreABC):
         self,
         part_id: str,
     ) -> Optional[IOBase]:
-        upload_part = self.upload_part_store.read(part_id)
+        upload_part = self._get_upload_part_for_write(part_id)
         if not upload_part:
             return
+        if upload_part.etag is not None:
+            # Clear the recorded digest in case the rewrite does not complete
+            self.upload_part_store.update(
+                PersistyUploadPart(id=upload_part.id, size_in_bytes=None, etag=None)
+            )
         try:
             file_name = key_to_path(self.upload_dir, str(upload_part.upload_id))
             file_name.mkdir(parents=True, exist_ok=True)
             # pylint: disable=R1732
-            writer = open(key_to_path(file_name, part_id), "wb")
+            writer = open(key_to_path(file_name, str(upload_part.id)), "wb")
+            if self.preallocate:
+                preallocate(writer, self._get_expected_part_size(upload_part))
+            writer = DirectoryUploadPartWriter(
+                writer=writer,
+                part_id=str(upload_part.id),
+                upload_part_store=self.upload_part_store,
+            )
             # noinspection PyTypeChecker
             return writer
         except FileNotFoundError:
             pass
 
+    def _get_expected_part_size(self, upload_part: PersistyUploadPart) -> int:
+        """Get the size of a part if the size of the upload was declared, or 0 if it was not"""
+        upload_handle = self.upload_handle_store.read(str(upload_part.upload_id))
+        if not upload_handle or not upload_handle.size_in_bytes:
+            return 0
+        max_part_size = self.meta.max_part_size
+        remaining = (
+            upload_handle.size_in_bytes - upload_part.part_number * max_part_size
+        )
+        return max(min(remaining, max_part_size), 0)
+
     def content_read(self, file_name: str) -> Optional[IOBase]:
         file_handle = self.file_handle_store.read(self._to_key(file_name))
         if file_handle:
+            # pylint: disable=R1732
+            reader = open(self._to_path(file_name), "rb")
+            advise(reader, "POSIX_FADV_SEQUENTIAL")  # Larger readahead
             # noinspection PyTypeChecker
-            return open(key_to_path(self.store_dir, file_name), "rb")
+            return reader
+
+    def content_path(self, file_name: str) -> Optional[str]:
+        path = self._to_path(file_name)
+        if path.is_file():
+            return str(path)
 
     def file_delete(self, file_name: str) -> bool:
         key = self._to_key(file_name)
@@ -85,18 +190,81 @@ class DirectoryFileStore(PersistyFileStoreABC):
         # noinspection PyProtectedMember
         # pylint: disable=W0212
         result = self.file_handle_store._delete(key, file_handle)
-        if result:
-            os.remove(key_to_path(self.store_dir, file_name))
+        if result and not self.stat_metadata:
+            os.remove(self._to_path(file_name))
         return result
 
+    def file_copy(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        if destination_store not in (None, self):
+            return super().file_copy(
+                source_file_name, destination_file_name, destination_store
+            )
+        file_handle = self.file_handle_store.read(self._to_key(source_file_name))
+        if not file_handle:
+            return None
+        if destination_file_name != source_file_name:
+            destination = self._to_path(destination_file_name)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = get_temp_path(destination)
+            copy_file(self._to_path(source_file_name), temp_path)
+            self._commit_file(temp_path, destination)
+            file_handle = self._copy_file_handle(file_handle, destination_file_name)
+        return self._to_file_handle(file_handle)
+
+    def file_move(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        if destination_store not in (None, self):
+            return super().file_move(
+                source_file_name, destination_file_name, destination_store
+            )
+        key = self._to_key(source_file_name)
+        file_handle = self.file_handle_store.read(key)
+        if not file_handle:
+            return None
+        if destination_file_name != source_file_name:
+            destination = self._to_path(destination_file_name)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            move_file(
+                self._to_path(source_file_name),
+                destination,
+                self.durability,
+                self.group_sync,
+            )
+            new_file_handle = self._copy_file_handle(file_handle, destination_file_name)
+            # noinspection PyProtectedMember
+            # pylint: disable=W0212
+            self.file_handle_store._delete(key, file_handle)
+            file_handle = new_file_handle
+        return self._to_file_handle(file_handle)
+
+    def _copy_file_handle(
+        self, file_handle: PersistyFileHandle, file_name: str, **kwargs
+    ) -> PersistyFileHandle:
+        if not self.stat_metadata:
+            return super()._copy_file_handle(file_handle, file_name, **kwargs)
+        # The content is in place, so metadata is recorded over any existing without reading (and rehashing) it
+        return self.file_handle_store.create(
+            dataclasses.replace(
+                file_handle, id=self._to_key(file_name), file_name=file_name, **kwargs
+            )
+        )
+
     def upload_finish(self, upload_id: UUID) -> Optional[FileHandle]:
         upload_handle = self.upload_handle_store.read(str(upload_id))
         if not upload_handle or upload_handle.store_name != self.meta.name:
             return
         file_handle_id = f"{self.meta.name}/{upload_handle.file_name}"
         file_handle = self.file_handle_store.read(file_handle_id)
-        md5 = hashlib.md5()
-        size_in_bytes = 0
+        size_in_bytes, etag = self._get_upload_size_and_etag(str(upload_id))
 
         upload_parts = list(
             self.upload_part_store.search_all(
@@ -104,22 +272,27 @@ class DirectoryFileStore(PersistyFileStoreABC):
                 SearchOrder((SearchOrderAttr("part_number"),)),
             )
         )
-        path = key_to_path(self.store_dir, upload_handle.file_name)
+        part_paths = [
+            key_to_path(self.upload_dir, f"{upload_id}/{upload_part.id}")
+            for upload_part in upload_parts
+        ]
+        part_paths = [p for p in part_paths if p.exists()]  # Unwritten parts are empty
+        path = self._to_path(upload_handle.file_name)
         path.parent.mkdir(exist_ok=True, parents=True)
-        with open(path, "wb") as writer:
-            for upload_part in upload_parts:
-                file_name = key_to_path(
-                    self.upload_dir, f"{upload_id}/{upload_part.id}"
-                )
-                with open(file_name, "rb") as reader:
-                    while True:
-                        buffer = reader.read(COPY_BUFFER_SIZE)
-                        if not buffer:
-                            break
-                        writer.write(buffer)
-                        md5.update(buffer)
-                        size_in_bytes += len(buffer)
-                os.remove(file_name)
+        # Digests were recorded as parts were written, so no content passes through this process
+        if len(part_paths) != 1 or not self._move_part(part_paths[0], path):
+            temp_path = get_temp_path(path)
+            with open(temp_path, "wb") as writer:
+                if self.preallocate:
+                    preallocate(writer, size_in_bytes)
+                for part_path in part_paths:
+                    with open(part_path, "rb") as reader:
+                        advise(reader, "POSIX_FADV_SEQUENTIAL")
+                        copy_content(reader, writer)
+                writer.truncate()
+            self._commit_file(temp_path, path)
+            for part_path in part_paths:
+                os.remove(part_path)
 
         new_file_handle = PersistyFileHandle(
             id=file_handle_id,
@@ -127,7 +300,7 @@ class DirectoryFileStore(PersistyFileStoreABC):
             file_name=upload_handle.file_name,
             upload_id=upload_handle.id,
             content_type=upload_handle.content_type,
-            etag=md5.hexdigest(),
+            etag=etag,
             size_in_bytes=size_in_bytes,
         )
         self.upload_handle_store.delete(str(upload_id))
@@ -141,51 +314,143 @@ class DirectoryFileStore(PersistyFileStoreABC):
             file_handle = self.file_handle_store.create(new_file_handle)
         return self._to_file_handle(file_handle)
 
+    def _move_part(self, part_path: Path, path: Path) -> bool:
+        """Move a part into place, returning False if it is on another filesystem so must be copied instead"""
+        try:
+            self._commit_file(part_path, path)
+            return True
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            return False
+
+    def _digest_upload_part(
+        self, upload_part: PersistyUploadPart
+    ) -> Tuple[int, Optional[str]]:
+        path = key_to_path(self.upload_dir, f"{upload_part.upload_id}/{upload_part.id}")
+        if not path.exists():
+            return 0, None
+        return os.stat(path).st_size, file_hash(path)
+
     def upload_delete(self, upload_id: str) -> bool:
         result = self.upload_handle_store.delete(upload_id)
         if result:
-            self.upload_part_store.delete_all(attr_eq("upload_id", upload_id))
+            self._delete_upload_parts(upload_id)
             upload_dir = key_to_path(self.upload_dir, upload_id)
-            shutil.rmtree(upload_dir)
+            shutil.rmtree(
+                upload_dir, ignore_errors=True
+            )  # Absent if nothing was written
         return result
 
     def directory_sync(self):
-        self.file_handle_store.edit_all(self.directory_sync_iterator())
-
-    def directory_sync_iterator(self):
-        paths = self.store_dir.rglob(str(self.store_dir))
-        paths = {path for path in paths if path.is_file()}
-        for file_handle in self.file_handle_store.search_all():
-            file_path = key_to_path(self.store_dir, file_handle.file_name)
-            if file_path in paths:
-                stats = os.stat(file_path)
-                etag = file_hash(file_path)
-                updated_at = datetime.fromtimestamp(stats.st_mtime)
-                if file_handle.etag != etag or file_handle.updated_at != updated_at:
-                    file_handle.etag = etag
-                    file_handle.size_in_bytes = stats.st_size
-                    file_handle.updated_at = updated_at
-                    yield BatchEdit(update_item=file_handle)
-            else:
-                yield BatchEdit(
-                    delete_key=str(file_path)[: len(str(self.store_dir)) + 1]
-                )
-        for path in paths:
-            file_name = str(path)[: len(str(self.store_dir)) + 1]
+        """
+        Bring file handles up to date with the content of the store directory, for files written or deleted by
+        other processes. Only new files and those whose size or change time differ from their handle are hashed.
+        With stat_metadata, handles are always current so there is nothing to do.
+        """
+        if self.stat_metadata:
+            return
+        edits = self.directory_sync_iterator()
+        while True:
+            batch = list(islice(edits, self.sync_batch_size))
+            if not batch:
+                return
+            for _ in self.file_handle_store.edit_all(batch):
+                pass
+
+    def directory_sync_iterator(self) -> Iterator[BatchEdit]:
+        # hashlib releases the GIL, so threads hash in parallel
+        with ThreadPoolExecutor(self.sync_threads) as executor:
+            diffs = self._diff_directory()
+            while True:
+                batch = list(islice(diffs, self.sync_batch_size))
+                if not batch:
+                    return
+                for edit in executor.map(self._get_sync_edit, batch):
+                    if edit:
+                        yield edit
+
+    def _diff_directory(self) -> Iterator[SyncDiff]:
+        file_handles = self.file_handle_store.search_all(
+            attr_eq("store_name", self.meta.name),
+            SearchOrder((SearchOrderAttr("file_name"),)),
+        )
+        if not self.shard_depth:
+            yield from diff_files(iter(file_handles), walk_files(self.store_dir))
+            return
+        # Sharded files are not walked in file_name order, so handles are looked up rather than merge joined
+        files = walk_sharded_files(self.store_dir, self.shard_depth)
+        while True:
+            batch = list(islice(files, self.sync_batch_size))
+            if not batch:
+                break
+            keys = [self._to_key(file_name) for file_name, _ in batch]
+            batch_handles = self.file_handle_store.read_all(keys)
+            for (file_name, stat), file_handle in zip(batch, batch_handles):
+                if not file_handle or not is_unchanged(file_handle, stat):
+                    yield file_name, file_handle, stat
+        for file_handle in file_handles:
+            if not self._to_path(file_handle.file_name).is_file():
+                yield file_handle.file_name, file_handle, None
+
+    def create_directory_watcher(self, **kwargs) -> "DirectoryWatcher":
+        """Create a watcher which keeps file handles up to date as the store directory changes (Linux only)"""
+        from persisty_data.directory.directory_watcher import DirectoryWatcher
+
+        return DirectoryWatcher(file_store=self, **kwargs)
+
+    def migrate_layout(self, previous_shard_depth: int = 0) -> int:
+        """
+        Move the content of each file with a handle from where it was stored with the previous shard depth to
+        where it belongs with the current one, returning the number of files moved. Run directory_sync with the
+        previous layout first, so files without handles are included. Safe to rerun if interrupted.
+        """
+        num_moved = 0
+        for file_handle in self.file_handle_store.search_all(
+            attr_eq("store_name", self.meta.name)
+        ):
+            file_name = file_handle.file_name
+            source = key_to_path(self.store_dir, file_name)
+            if previous_shard_depth:
+                shard = get_shard(file_name, previous_shard_depth)
+                source = key_to_path(self.store_dir, f"{shard}/{file_name}")
+            destination = self._to_path(file_name)
+            if source == destination or not source.is_file():
+                continue
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, destination)
+            num_moved += 1
+            remove_empty_dirs(source.parent, self.store_dir)
+        return num_moved
+
+    def _get_sync_edit(self, diff: SyncDiff) -> Optional[BatchEdit]:
+        file_name, file_handle, stat = diff
+        if stat is None:
+            return BatchEdit(delete_key=str(file_handle.id))
+        path = self._to_path(file_name)
+        try:
             etag = file_hash(path)
-            stats = os.stat(path)
-            updated_at = datetime.fromtimestamp(stats.st_mtime)
-            yield BatchEdit(
-                create_item=PersistyFileHandle(
-                    id=f"{self.meta.name}/{file_name}",
-                    store_name=self.meta.name,
-                    file_name=file_name,
-                    etag=etag,
-                    size_in_bytes=stats.st_size,
-                    created_at=updated_at,
-                    updated_at=datetime.fromtimestamp(stats.st_mtime),
+            if get_stat_key(os.stat(path)) != get_stat_key(stat):
+                return None  # Changed while hashing - left for the next sync
+        except FileNotFoundError:
+            return None
+        if file_handle:
+            # Updated even if the etag matches, so the updated_at of a racy handle is refreshed
+            return BatchEdit(
+                update_item=dataclasses.replace(
+                    file_handle, etag=etag, size_in_bytes=stat.st_size
                 )
             )
+        return BatchEdit(
+            create_item=PersistyFileHandle(
+                id=self._to_key(file_name),
+                store_name=self.meta.name,
+                file_name=file_name,
+                content_type=mimetypes.guess_type(file_name)[0],
+                etag=etag,
+                size_in_bytes=stat.st_size,
+            )
+        )
 
 
 def key_to_path(directory: Path, key: str):
@@ -194,11 +459,81 @@ def key_to_path(directory: Path, key: str):
     return path
 
 
+def remove_empty_dirs(directory: Path, root: Path):
+    """Remove the directory given and any parents which are left empty, up to (but excluding) the root"""
+    while directory != root and root in directory.parents:
+        try:
+            directory.rmdir()
+        except OSError:
+            return  # Not empty
+        directory = directory.parent
+
+
+def copy_file(source: Path, destination: Path):
+    """
+    Copy a file without passing content through user space where possible: A reflink (copy on write clone) on
+    filesystems supporting it (e.g.: btrfs, xfs), otherwise copy_file_range. Hard links are not used - though
+    the store replaces files rather than rewriting them, linked files share an inode, and so the extended
+    attribute holding their metadata, and other processes may still write to a file in place
+    """
+    with open(source, "rb") as reader, open(destination, "wb") as writer:
+        if ioctl is not None:
+            try:
+                ioctl(writer.fileno(), FICLONE, reader.fileno())
+                return
+            except OSError:
+                pass
+        copy_content(reader, writer)
+
+
+def copy_content(reader: BinaryIO, writer: BinaryIO):
+    """
+    Copy from the current position of the reader to the current position of the writer. Content is copied within
+    the kernel using copy_file_range where supported
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        reader_start, writer_start = reader.tell(), writer.tell()
+        try:
+            while copy_file_range(reader.fileno(), writer.fileno(), COPY_RANGE_SIZE):
+                pass
+            return
+        except OSError:
+            # Not supported for this pair of files - start again
+            reader.seek(reader_start)
+            writer.seek(writer_start)
+            writer.truncate()
+    shutil.copyfileobj(reader, writer, COPY_BUFFER_SIZE)
+
+
+def preallocate(writer: BinaryIO, size_in_bytes: int):
+    """Reserve space for a file of the size given up front, reducing fragmentation where supported"""
+    posix_fallocate = getattr(os, "posix_fallocate", None)
+    if posix_fallocate is not None and size_in_bytes:
+        try:
+            posix_fallocate(writer.fileno(), 0, size_in_bytes)
+        except OSError:
+            pass  # Not supported by this filesystem
+
+
+def advise(file: BinaryIO, advice: str):
+    """Advise the kernel of how a file will be accessed, where supported"""
+    posix_fadvise = getattr(os, "posix_fadvise", None)
+    if posix_fadvise is not None:
+        posix_fadvise(file.fileno(), 0, 0, getattr(os, advice))
+
+
 def file_hash(path: Path) -> str:
+    """
+    Hash the content of a file. This is a one off scan, so the file is dropped from the page cache afterwards
+    rather than evicting content which is actually in use
+    """
     hash_ = hashlib.md5()
     with open(path, "rb") as reader:
+        advise(reader, "POSIX_FADV_SEQUENTIAL")
         while True:
             buffer = reader.read(COPY_BUFFER_SIZE)
             if not buffer:
+                advise(reader, "POSIX_FADV_DONTNEED")
                 return hash_.hexdigest()
             hash_.update(buffer)
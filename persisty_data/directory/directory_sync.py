@@ -0,0 +1,162 @@
+"""
+Helpers for synchronizing file handles with the content of a directory. In a flat layout, both sides are read in
+file_name order and merge joined, so neither is held in memory in full.
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+
+from persisty_data.directory.durability import is_temp_name
+from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
+
+# Changes within this many seconds of a handle being stored may not be reflected in it (e.g.: A write during
+# hashing on a filesystem with coarse timestamps), so such files are always hashed
+RACY_SECONDS = 2
+
+# Suffix for sidecar files holding metadata where extended attributes are not supported
+META_SUFFIX = ".persisty_meta"
+
+SyncDiff = Tuple[str, Optional[PersistyFileHandle], Optional[os.stat_result]]
+
+
+def walk_files(
+    directory: Union[str, Path], prefix: str = ""
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Yield the (relative) name and stats of each file in the directory given, in name order. Entries of each
+    directory are sorted as if directory names ended with a "/", which matches the ordering of full names.
+    """
+    try:
+        with os.scandir(directory) as scanner:
+            entries = [(_sort_name(e), e) for e in scanner if not _is_internal(e.name)]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda e: e[0])
+    for _, entry in entries:
+        file_name = prefix + entry.name
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_files(entry.path, file_name + "/")
+        elif entry.is_file(follow_symlinks=False):
+            yield file_name, entry.stat(follow_symlinks=False)
+
+
+def walk_prefix(
+    directory: Union[str, Path], prefix: str, path_prefix: str = ""
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Yield the name and stats of each file whose name starts with the prefix given, in name order. Only directories
+    which may hold matches are visited. Matching is case insensitive, as with the startswith filter.
+    """
+    head, sep, tail = prefix.partition("/")
+    head = head.lower()
+    try:
+        with os.scandir(directory) as scanner:
+            if sep:
+                entries = [e for e in scanner if e.name.lower() == head]
+            else:
+                entries = [
+                    e
+                    for e in scanner
+                    if e.name.lower().startswith(head) and not _is_internal(e.name)
+                ]
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    entries.sort(key=_sort_name)
+    for entry in entries:
+        file_name = path_prefix + entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if sep:
+                yield from walk_prefix(entry.path, tail, file_name + "/")
+            else:
+                yield from walk_files(entry.path, file_name + "/")
+        elif not sep and entry.is_file(follow_symlinks=False):
+            yield file_name, entry.stat(follow_symlinks=False)
+
+
+def walk_sharded_files(
+    directory: Union[str, Path], shard_depth: int
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """Yield the name and stats of each file in a sharded layout, skipping any not in the shard for its name"""
+    for path, stat in walk_files(directory):
+        file_name = get_sharded_file_name(path, shard_depth)
+        if file_name:
+            yield file_name, stat
+
+
+def get_sharded_file_name(path: str, shard_depth: int) -> Optional[str]:
+    """Get the file name for a path (relative to the store directory) in a sharded layout, if in the right shard"""
+    parts = path.split("/", shard_depth)
+    if len(parts) > shard_depth:
+        file_name = parts[shard_depth]
+        if "/".join(parts[:shard_depth]) == get_shard(file_name, shard_depth):
+            return file_name
+    return None
+
+
+def get_shard(file_name: str, shard_depth: int) -> str:
+    """Get the directories for a file name in a sharded layout - two hex digits of its hash per level"""
+    digest = hashlib.md5(file_name.encode("utf-8")).hexdigest()
+    return "/".join(digest[i * 2 : i * 2 + 2] for i in range(shard_depth))
+
+
+def get_meta_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}{META_SUFFIX}")
+
+
+def is_meta_name(name: str) -> bool:
+    return name.startswith(".") and name.endswith(META_SUFFIX)
+
+
+def _is_internal(name: str) -> bool:
+    return is_temp_name(name) or is_meta_name(name)
+
+
+def _sort_name(entry: os.DirEntry) -> str:
+    if entry.is_dir(follow_symlinks=False):
+        return entry.name + "/"
+    return entry.name
+
+
+def diff_files(
+    file_handles: Iterator[PersistyFileHandle],
+    files: Iterator[Tuple[str, os.stat_result]],
+) -> Iterator[SyncDiff]:
+    """
+    Merge join file handles and files (both in file_name order), yielding (file_name, file_handle, stat) for
+    each which may differ. The file handle is None for new files, and the stat is None for missing files.
+    """
+    file_handle = next(file_handles, None)
+    file = next(files, None)
+    while file_handle or file:
+        if file is None or (file_handle and file_handle.file_name < file[0]):
+            yield file_handle.file_name, file_handle, None
+            file_handle = next(file_handles, None)
+        elif file_handle is None or file[0] < file_handle.file_name:
+            yield file[0], None, file[1]
+            file = next(files, None)
+        else:
+            if not is_unchanged(file_handle, file[1]):
+                yield file[0], file_handle, file[1]
+            file_handle = next(file_handles, None)
+            file = next(files, None)
+
+
+def is_unchanged(
+    file_handle: PersistyFileHandle,
+    stat: os.stat_result,
+    racy_seconds: float = RACY_SECONDS,
+) -> bool:
+    """
+    A file is unchanged if it is the size recorded, and was last changed before its handle was stored. ctime is
+    considered as well as mtime, as unlike mtime it cannot be set back (e.g.: By cp --preserve)
+    """
+    if stat.st_size != file_handle.size_in_bytes or not file_handle.updated_at:
+        return False
+    changed_at = max(stat.st_mtime, stat.st_ctime)
+    return changed_at < file_handle.updated_at.timestamp() - racy_seconds
+
+
+def get_stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+    """Stats which change when content does, for detecting changes while a file was being hashed"""
+    return stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns
@@ -0,0 +1,49 @@
+import hashlib
+from dataclasses import dataclass, field
+from io import IOBase
+from typing import BinaryIO, Union
+
+from persisty.store.store_abc import StoreABC
+from persisty.store_meta import get_meta
+
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+
+@dataclass
+class DirectoryUploadPartWriter(IOBase):
+    """Writer for an upload part file, which records the size and md5 of the part when done"""
+
+    writer: BinaryIO
+    part_id: str
+    size_in_bytes: int = 0
+    hash: hashlib.md5 = field(default_factory=hashlib.md5)
+    upload_part_store: StoreABC[PersistyUploadPart] = field(
+        default_factory=get_meta(PersistyUploadPart).create_store
+    )
+
+    def __enter__(self):
+        self.writer.__enter__()
+        return self
+
+    def write(self, __b) -> Union[int, type(None)]:
+        self.hash.update(__b)
+        self.size_in_bytes += len(__b)
+        result = self.writer.write(__b)
+        return result
+
+    def flush(self):
+        self.writer.flush()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Release any space preallocated beyond what was written
+        self.writer.truncate(self.size_in_bytes)
+        result = self.writer.__exit__(exc_type, exc_val, exc_tb)
+        if not exc_type:
+            self.upload_part_store.update(
+                PersistyUploadPart(
+                    id=self.part_id,
+                    size_in_bytes=self.size_in_bytes,
+                    etag=self.hash.hexdigest(),
+                )
+            )
+        return result
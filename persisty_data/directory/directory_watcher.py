@@ -0,0 +1,247 @@
+"""
+Live synchronization of file handles with a store directory using Linux inotify, so files written by other
+processes become visible without waiting for a full directory_sync.
+"""
+import ctypes
+import os
+import select
+import stat as stat_
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+from threading import Thread
+from typing import Dict, List, Optional
+
+from persisty.attr.attr_filter import attr_eq, AttrFilter
+from persisty.attr.attr_filter_op import AttrFilterOp
+from persisty.errors import PersistyError
+
+from persisty_data.directory.directory_sync import (
+    get_sharded_file_name,
+    is_meta_name,
+    is_unchanged,
+    walk_files,
+)
+from persisty_data.directory.durability import is_temp_name
+
+_DirectoryFileStore = "persisty_data.directory.directory_file_store.DirectoryFileStore"
+
+# From linux/inotify.h
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+EVENT_FORMAT = "iIII"  # wd, mask, cookie, len
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+
+def _get_libc():
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise PersistyError("inotify_not_supported")
+    return libc
+
+
+# pylint: disable=R0902
+@dataclass
+class DirectoryWatcher:
+    """
+    Watches the directory of a store for files created, modified, moved or deleted, and updates file handles to
+    match. Events are debounced - a file is only processed once it has had no events for debounce seconds, so a
+    file being written is hashed once when done rather than on every write. Only the files affected are
+    examined, and a handle stored after the last change to its file is trusted without hashing (Any later
+    change raises another event). Edits are applied in batches. If the kernel queue overflows (so events were
+    lost), a full directory_sync is run instead.
+
+    Use start / stop to run in a background thread, or open and then call poll periodically. Changes made
+    before the watcher is opened are not seen - run directory_sync after opening to include them.
+    """
+
+    file_store: _DirectoryFileStore
+    debounce: float = 0.5
+    fd: Optional[int] = None
+    dirs_by_wd: Dict[int, str] = field(default_factory=dict)
+    pending: Dict[str, float] = field(default_factory=dict)
+    thread: Optional[Thread] = None
+    stopped: bool = False
+    libc: Optional[ctypes.CDLL] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def open(self):
+        if self.fd is not None:
+            return
+        self.libc = _get_libc()
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.fd = fd
+        self.file_store.store_dir.mkdir(parents=True, exist_ok=True)
+        self._watch_tree("")
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.dirs_by_wd.clear()
+
+    def start(self):
+        self.open()
+        self.stopped = False
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.close()
+
+    def _run(self):
+        while not self.stopped:
+            self.poll(min(self.debounce, 0.5) or 0.1)
+
+    def poll(self, timeout: float = 0) -> int:
+        """Read any events (waiting up to timeout seconds for some), then sync files which are due"""
+        self.open()
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if poller.poll(timeout * 1000):
+            self._read_events()
+        now = time.monotonic()
+        due = [n for n, t in self.pending.items() if t + self.debounce <= now]
+        for file_name in due:
+            del self.pending[file_name]
+        return self._sync(due)
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from(EVENT_FORMAT, data, offset)
+            name = data[offset + EVENT_SIZE : offset + EVENT_SIZE + length]
+            name = name.rstrip(b"\0").decode("utf-8", "surrogateescape")
+            offset += EVENT_SIZE + length
+            if mask & IN_Q_OVERFLOW:
+                self.pending.clear()
+                self.file_store.directory_sync()
+                continue
+            if mask & IN_IGNORED:
+                self.dirs_by_wd.pop(wd, None)
+                continue
+            directory = self.dirs_by_wd.get(wd)
+            if directory is None or is_temp_name(name) or is_meta_name(name):
+                continue
+            path = f"{directory}{name}"
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path + "/")
+                elif mask & IN_MOVED_FROM:
+                    self._unwatch_tree(path + "/")
+            else:
+                self._add_pending(path)
+
+    def _watch_tree(self, directory: str):
+        """Watch a directory and its descendants, treating any files already in them as changed"""
+        path = Path(self.file_store.store_dir, directory)
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), ctypes.c_uint32(WATCH_MASK)
+        )
+        if wd < 0:
+            return  # Removed already
+        self.dirs_by_wd[wd] = directory
+        with os.scandir(path) as entries:
+            sub_dirs = [e.name for e in entries if e.is_dir(follow_symlinks=False)]
+        for sub_dir in sub_dirs:
+            self._watch_tree(f"{directory}{sub_dir}/")
+        if directory:
+            for file_name, _ in walk_files(path, directory):
+                self._add_pending(file_name)
+
+    def _unwatch_tree(self, directory: str):
+        """Stop watching a directory moved out of its place, treating all files in it as gone"""
+        for wd, watched in list(self.dirs_by_wd.items()):
+            if watched.startswith(directory):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs_by_wd[wd]
+        file_store = self.file_store
+        prefix = directory
+        if file_store.shard_depth:
+            # The prefix holds shard directories
+            prefix = get_sharded_file_name(directory, file_store.shard_depth) or ""
+            if not prefix:
+                self.file_store.directory_sync()
+                return
+        for file_handle in file_store.file_handle_store.search_all(
+            attr_eq("store_name", file_store.meta.name)
+            & AttrFilter("file_name", AttrFilterOp.startswith, prefix)
+        ):
+            self.pending[file_handle.file_name] = time.monotonic()
+
+    def _add_pending(self, path: str):
+        file_name = path
+        if self.file_store.shard_depth:
+            file_name = get_sharded_file_name(path, self.file_store.shard_depth)
+        if file_name:
+            self.pending[file_name] = time.monotonic()
+
+    def _sync(self, file_names: List[str]) -> int:
+        """Bring the handles of the files given up to date, returning the number of edits made"""
+        # noinspection PyProtectedMember
+        # pylint: disable=W0212
+        file_store = self.file_store
+        num_edits = 0
+        file_names = iter(file_names)
+        with ThreadPoolExecutor(file_store.sync_threads) as executor:
+            while True:
+                batch = list(islice(file_names, file_store.sync_batch_size))
+                if not batch:
+                    return num_edits
+                file_handles = file_store.file_handle_store.read_all(
+                    [file_store._to_key(n) for n in batch]
+                )
+                diffs = []
+                for file_name, file_handle in zip(batch, file_handles):
+                    try:
+                        stat = os.stat(file_store._to_path(file_name))
+                        if not stat_.S_ISREG(stat.st_mode):
+                            stat = None
+                    except FileNotFoundError:
+                        stat = None
+                    if stat is None and file_handle is None:
+                        continue
+                    if stat and file_handle and is_unchanged(file_handle, stat, 0):
+                        continue
+                    diffs.append((file_name, file_handle, stat))
+                edits = [e for e in executor.map(file_store._get_sync_edit, diffs) if e]
+                for _ in file_store.file_handle_store.edit_all(edits):
+                    num_edits += 1
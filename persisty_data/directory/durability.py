@@ -0,0 +1,136 @@
+"""
+Atomic, optionally durable, replacement of files. Content is staged to a temporary file in the same directory,
+which is renamed over the destination when complete, so readers never see a partially written file.
+"""
+import os
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+TEMP_SUFFIX = ".persisty_tmp"
+
+
+class Durability(Enum):
+    """
+    NONE relies on the OS to write back content, which is lost if the machine (rather than the process) fails.
+    DATA does an fdatasync of content before it is renamed into place. DATA_AND_DIRECTORY also does an fsync of
+    the directory after the rename, so the rename itself survives a crash
+    """
+
+    NONE = "none"
+    DATA = "data"
+    DATA_AND_DIRECTORY = "data_and_directory"
+
+
+@dataclass
+class GroupSync:
+    """
+    Groups syncs requested by concurrent writers. The first writer to arrive waits for window seconds for others
+    to join, then syncs on behalf of all of them - each path once, however many writers requested it (e.g.: A
+    directory several files were renamed into). Each writer returns once a sync covering its request completes.
+    A leader syncs a single batch, then hands leadership to a writer still waiting, so under sustained load no
+    writer is kept syncing for others indefinitely.
+    """
+
+    window: float = 0.002
+    pending: List[Tuple[Path, Future]] = field(default_factory=list)
+    leading: bool = False
+    lock: Lock = field(default_factory=Lock)
+
+    def sync(self, path: Path):
+        future = Future()
+        with self.lock:
+            self.pending.append((path, future))
+            lead = not self.leading
+            self.leading = True
+        while True:
+            if lead:
+                self._lead()
+            result = future.result()
+            if not isinstance(result, Future):
+                return
+            # Leadership was handed over, with this request left for the next batch
+            future, lead = result, True
+
+    def _lead(self):
+        time.sleep(self.window)
+        with self.lock:
+            batch, self.pending = self.pending, []
+        errors = {}
+        for path, future in batch:
+            if path not in errors:
+                try:
+                    sync_path(path)
+                    errors[path] = None
+                # pylint: disable=W0718
+                except Exception as exc:
+                    errors[path] = exc
+            if errors[path]:
+                future.set_exception(errors[path])
+            else:
+                future.set_result(None)
+        with self.lock:
+            if not self.pending:
+                self.leading = False
+                return
+            path, future = self.pending[0]
+            self.pending[0] = (path, Future())
+            future.set_result(self.pending[0][1])
+
+
+def sync_path(path: Path):
+    """fsync a directory, or fdatasync a file (which skips metadata such as mtime which is not needed to read it)"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if os.path.isdir(path):
+            os.fsync(fd)
+        else:
+            getattr(os, "fdatasync", os.fsync)(fd)
+    finally:
+        os.close(fd)
+
+
+def get_temp_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{uuid4().hex}{TEMP_SUFFIX}")
+
+
+def is_temp_name(name: str) -> bool:
+    return name.startswith(".") and name.endswith(TEMP_SUFFIX)
+
+
+def move_file(
+    source: Path,
+    path: Path,
+    durability: Durability,
+    group_sync: Optional[GroupSync] = None,
+):
+    """
+    Atomically move a file which is already in place (so its content is as durable as it needs to be). With
+    DATA_AND_DIRECTORY, both directories are synced, so neither half of the rename is lost in a crash
+    """
+    os.replace(source, path)
+    if durability is Durability.DATA_AND_DIRECTORY:
+        sync = group_sync.sync if group_sync else sync_path
+        sync(path.parent)
+        if source.parent != path.parent:
+            sync(source.parent)
+
+
+def commit_file(
+    temp_path: Path,
+    path: Path,
+    durability: Durability,
+    group_sync: Optional[GroupSync] = None,
+):
+    """Atomically replace the file at path with the one at temp_path, syncing as the durability given requires"""
+    sync = group_sync.sync if group_sync else sync_path
+    if durability is not Durability.NONE:
+        sync(temp_path)
+    os.replace(temp_path, path)
+    if durability is Durability.DATA_AND_DIRECTORY:
+        sync(path.parent)
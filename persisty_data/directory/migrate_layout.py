@@ -0,0 +1,35 @@
+"""
+Move the files of a directory file store into the layout it is now configured with (See
+DirectoryFileStore.shard_depth), from the layout given. File handles are synced with the previous layout
+first, so files without handles are moved too.
+
+Usage: python -m persisty_data.directory.migrate_layout --store my_store [--from-shard-depth 0]
+"""
+import argparse
+import dataclasses
+
+from persisty_data.directory.directory_file_store import DirectoryFileStore
+from persisty_data.finder.file_store_finder_abc import find_file_store_by_name
+
+
+def migrate_layout(file_store: DirectoryFileStore, previous_shard_depth: int) -> int:
+    previous_store = dataclasses.replace(file_store, shard_depth=previous_shard_depth)
+    previous_store.directory_sync()
+    return file_store.migrate_layout(previous_shard_depth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--store", required=True)
+    parser.add_argument("--from-shard-depth", type=int, default=0)
+    args = parser.parse_args()
+
+    file_store = find_file_store_by_name(args.store)
+    if not isinstance(file_store, DirectoryFileStore):
+        parser.error(f"not_a_directory_file_store:{args.store}")
+    num_moved = migrate_layout(file_store, args.from_shard_depth)
+    print(f"Moved {num_moved} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import shutil
 from abc import ABC, abstractmethod
 from io import IOBase
 from typing import Optional, List, Iterator
@@ -85,6 +86,14 @@ class FileStoreABC(ABC):
     def content_read(self, file_name: str) -> Optional[IOBase]:
         """Create a reader from the named file within the store"""
 
+    # pylint: disable=W0613
+    def content_path(self, file_name: str) -> Optional[str]:
+        """
+        Get the path of the content of the named file if the store keeps it on the local filesystem, so it can be
+        served without passing through this process. Most stores do not, and return None
+        """
+        return None
+
     @abstractmethod
     def content_write(
         self,
@@ -128,6 +137,48 @@ class FileStoreABC(ABC):
     def file_delete(self, file_name: str) -> bool:
         """Delete a data item"""
 
+    def file_copy(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        """
+        Copy a file, returning the new file handle (or None if the source did not exist). Stores provide native
+        implementations within the same store - this default (used between stores) streams content through
+        this process
+        """
+        destination_store = destination_store or self
+        source_handle = self.file_read(source_file_name)
+        if not source_handle:
+            return None
+        if destination_store is self and destination_file_name == source_file_name:
+            return source_handle
+        with self.content_read(source_file_name) as reader:
+            with destination_store.content_write(
+                destination_file_name, source_handle.content_type
+            ) as writer:
+                shutil.copyfileobj(reader, writer, self.get_meta().stream_buffer_size)
+        return destination_store.file_read(destination_file_name)
+
+    def file_move(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        """Move / rename a file, returning the new file handle (or None if the source did not exist)"""
+        if destination_store in (None, self) and (
+            destination_file_name == source_file_name
+        ):
+            return self.file_read(source_file_name)
+        result = self.file_copy(
+            source_file_name, destination_file_name, destination_store
+        )
+        if result:
+            self.file_delete(source_file_name)
+        return result
+
     @abstractmethod
     def upload_create(
         self,
@@ -162,8 +213,13 @@ class FileStoreABC(ABC):
         """Delete an upload. Return true if item existed and was deleted"""
 
     @abstractmethod
-    def upload_part_create(self, upload_id: str) -> Optional[UploadPart]:
-        """Create a new upload part in the upload given"""
+    def upload_part_create(
+        self, upload_id: str, part_number: Optional[int] = None
+    ) -> Optional[UploadPart]:
+        """
+        Create a new upload part in the upload given. Parallel uploaders may declare the (1 based) part number,
+        in which case an existing part with that number is returned rather than a duplicate created
+        """
 
     @abstractmethod
     def upload_part_search(
@@ -233,10 +233,12 @@ def create_action_for_upload_part_create(store: FileStoreABC):
 
     @action(name=f"{store.get_meta().name}_upload_part_create", triggers=WEB_POST)
     def upload_part_create(
-        upload_id: str, authorization: Optional[Authorization] = None
+        upload_id: str,
+        part_number: Optional[int] = None,
+        authorization: Optional[Authorization] = None,
     ) -> Optional[UploadPart]:
         secured_store = store.get_secured(authorization)
-        return secured_store.upload_part_create(upload_id)
+        return secured_store.upload_part_create(upload_id, part_number)
 
     return upload_part_create
 
@@ -5,6 +5,7 @@ from persisty.security.store_access import StoreAccess, ALL_ACCESS
 from servey.cache_control.cache_control_abc import CacheControlABC
 from servey.cache_control.secure_hash_cache_control import SecureHashCacheControl
 
+from persisty_data.codec.chunk_codec_abc import ChunkCodecABC
 from persisty_data.security.file_store_security_abc import FileStoreSecurityABC
 
 
@@ -26,4 +27,8 @@ class FileStoreMeta:
     max_part_size: int = 16 * 1024 * 1024
     upload_expire_in: int = 3600
     batch_size: int = 10
+    chunk_codec: Optional[ChunkCodecABC] = None
+    chunk_size: int = 256 * 1024
+    stream_buffer_size: int = 64 * 1024
+    inline_max_size: int = 0
     description: Optional[str] = None
@@ -93,6 +93,7 @@ class ImgResizer:
         )
         with source_store.content_read(file_name) as reader:
             img = Image.open(reader)
+            img.load()  # Decode while the reader is still open
             return img
 
 
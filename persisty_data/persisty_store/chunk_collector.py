@@ -0,0 +1,144 @@
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone, timedelta
+from itertools import islice
+from typing import Optional, Set, List, Iterator
+
+from persisty.attr.attr_filter import AttrFilter
+from persisty.attr.attr_filter_op import AttrFilterOp
+from persisty.batch_edit import BatchEdit
+from persisty.store.store_abc import StoreABC
+from persisty.store_meta import get_meta
+
+from persisty_data.persisty_store.content_chunk_refs import ContentChunkRefs
+from persisty_data.persisty_store.data_chunk import (
+    DataChunk,
+    get_data_chunk_key_store,
+)
+from persisty_data.persisty_store.data_chunk_cache import DataChunkCache
+from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
+from persisty_data.persisty_store.persisty_upload_handle import PersistyUploadHandle
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+
+@dataclass
+class CollectionReport:
+    num_data_chunks: int = 0
+    num_upload_parts: int = 0
+    num_bytes: int = 0
+
+
+# pylint: disable=R0902
+@dataclass
+class ChunkCollector:
+    """
+    Mark and sweep collector for data chunks and upload parts whose upload no longer has a live file handle or
+    upload handle. Deleting a file only deletes its handle, leaving the chunks to be collected here in throttled
+    batches. This also reclaims anything leaked by a crash part way through an operation.
+
+    Every file handle and upload handle in the stores given is treated as live (not just those for a single
+    file store), so stores sharing a data chunk store must share handle stores too. Items younger than min_age
+    are never collected, as they may belong to a write still in progress, so min_age must exceed the time taken
+    by the longest write.
+
+    Chunks are found using data_chunk_key_store, which should be a view of the data chunk store that does not
+    load chunk data. If not given, one is derived from the data_chunk_store (See get_data_chunk_key_store).
+    """
+
+    file_handle_store: StoreABC[PersistyFileHandle] = field(
+        default_factory=get_meta(PersistyFileHandle).create_store
+    )
+    upload_handle_store: StoreABC[PersistyUploadHandle] = field(
+        default_factory=get_meta(PersistyUploadHandle).create_store
+    )
+    upload_part_store: StoreABC[PersistyUploadPart] = field(
+        default_factory=get_meta(PersistyUploadPart).create_store
+    )
+    data_chunk_store: StoreABC[DataChunk] = field(
+        default_factory=get_meta(DataChunk).create_store
+    )
+    data_chunk_key_store: Optional[StoreABC[DataChunk]] = None
+    content_chunk_refs: Optional[ContentChunkRefs] = None
+    chunk_cache: Optional[DataChunkCache] = None
+    min_age: int = 3600
+    batch_size: int = 100
+    batch_delay: float = 0.1
+
+    def __post_init__(self):
+        if self.data_chunk_key_store is None:
+            self.data_chunk_key_store = get_data_chunk_key_store(self.data_chunk_store)
+
+    def collect(self) -> CollectionReport:
+        report = CollectionReport()
+        created_before = datetime.now(timezone.utc) - timedelta(seconds=self.min_age)
+        # Mark
+        upload_ids = {str(h.id) for h in self.upload_handle_store.search_all()}
+        file_upload_ids = {
+            str(h.upload_id) for h in self.file_handle_store.search_all() if h.upload_id
+        }
+        # Sweep. Parts are only live while their upload is, so parts of finished uploads are collected too
+        self._sweep_data_chunks(created_before, upload_ids | file_upload_ids, report)
+        self._sweep_upload_parts(created_before, upload_ids, report)
+        return report
+
+    def _sweep_data_chunks(
+        self,
+        created_before: datetime,
+        live_upload_ids: Set[str],
+        report: CollectionReport,
+    ):
+        # Only keys are kept, and they are gathered before deleting anything so paging is not disrupted. Chunks
+        # written before stored_size was recorded do not count towards num_bytes
+        orphans = [
+            (str(c.id), c.content_hash, c.stored_size or 0, c.upload_id)
+            for c in self.data_chunk_key_store.search_all(
+                AttrFilter("created_at", AttrFilterOp.lt, created_before)
+            )
+            if c.upload_id not in live_upload_ids
+        ]
+        for batch in self._throttled_batches(orphans):
+            deleted = self._delete_batch(
+                self.data_chunk_store, [orphan[0] for orphan in batch]
+            )
+            # Chunks deleted concurrently elsewhere have already released their content
+            batch = [orphan for orphan in batch if orphan[0] in deleted]
+            report.num_data_chunks += len(batch)
+            report.num_bytes += sum(orphan[2] for orphan in batch)
+            if self.content_chunk_refs:
+                report.num_bytes += self.content_chunk_refs.release(
+                    orphan[1] for orphan in batch
+                )
+        if self.chunk_cache:
+            for upload_id in {orphan[3] for orphan in orphans}:
+                self.chunk_cache.invalidate(upload_id)
+
+    def _sweep_upload_parts(
+        self,
+        created_before: datetime,
+        live_upload_ids: Set[str],
+        report: CollectionReport,
+    ):
+        orphans = [
+            str(p.id)
+            for p in self.upload_part_store.search_all(
+                AttrFilter("created_at", AttrFilterOp.lt, created_before)
+            )
+            if str(p.upload_id) not in live_upload_ids
+        ]
+        for keys in self._throttled_batches(orphans):
+            deleted = self._delete_batch(self.upload_part_store, keys)
+            report.num_upload_parts += len(deleted)
+
+    def _throttled_batches(self, items: List) -> Iterator[List]:
+        items = iter(items)
+        while True:
+            batch = list(islice(items, self.batch_size))
+            if not batch:
+                return
+            yield batch
+            time.sleep(self.batch_delay)
+
+    @staticmethod
+    def _delete_batch(store: StoreABC, keys: List[str]) -> Set[str]:
+        results = store.edit_all(BatchEdit(delete_key=key) for key in keys)
+        return {r.edit.delete_key for r in results if r.success}
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+from persisty.attr.attr import Attr
+from persisty.security.store_security import INTERNAL_ONLY
+from persisty.stored import stored
+from schemey.schema import int_schema
+
+
+@stored(store_security=INTERNAL_ONLY)
+class ContentChunk:
+    """
+    Chunk data stored once by content hash, and shared between any data chunks with the same content
+    """
+
+    id: str = Attr(creatable=True)  # sha256 of data
+    data: bytes = Attr(updatable=False)
+    ref_count: int = Attr(schema=int_schema(minimum=0))
+    created_at: datetime
+    updated_at: datetime
@@ -0,0 +1,122 @@
+import hashlib
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from persisty.attr.attr_filter import attr_eq
+from persisty.batch_edit import BatchEdit
+from persisty.errors import PersistyError
+from persisty.search_filter.search_filter_abc import SearchFilterABC
+from persisty.store.store_abc import StoreABC
+from persisty.store_meta import get_meta
+
+from persisty_data.persisty_store.content_chunk import ContentChunk
+from persisty_data.persisty_store.data_chunk import DataChunk
+from persisty_data.persisty_store.ref_counter import RefCounterABC, get_ref_counter
+
+
+@dataclass
+class ContentChunkRefs:
+    """
+    Reference counting for content addressed chunks. When deduplicating, data chunks hold only the content_hash
+    of their data, and the data itself is stored once in the content chunk store. Counts are kept atomically
+    on SQL and DynamoDB stores (See get_ref_counter) - other stores must have a single writer.
+    """
+
+    content_chunk_store: StoreABC[ContentChunk] = field(
+        default_factory=get_meta(ContentChunk).create_store
+    )
+    ref_counter: Optional[RefCounterABC] = None
+    max_attempts: int = 10
+    resolve_batch_size: int = 8
+
+    def __post_init__(self):
+        if self.ref_counter is None:
+            self.ref_counter = get_ref_counter(self.content_chunk_store)
+
+    def acquire(self, data_chunks: List[DataChunk]):
+        """
+        Move the data from the chunks given into the content chunk store, adding a reference for each. Content
+        which already exists is not written again.
+        """
+        ref_counts = Counter()
+        data_by_hash = {}
+        for data_chunk in data_chunks:
+            content_hash = hashlib.sha256(data_chunk.data).hexdigest()
+            ref_counts[content_hash] += 1
+            data_by_hash[content_hash] = data_chunk.data
+            data_chunk.content_hash = content_hash
+            data_chunk.data = b""
+        for content_hash, num_refs in ref_counts.items():
+            self._add_refs(content_hash, num_refs, data_by_hash[content_hash])
+
+    def _add_refs(self, content_hash: str, num_refs: int, data: bytes):
+        for _ in range(self.max_attempts):
+            if self.ref_counter.add(content_hash, num_refs) is not None:
+                return
+            content_chunk = ContentChunk(id=content_hash, data=data, ref_count=num_refs)
+            results = self.content_chunk_store.edit_all(
+                [BatchEdit(create_item=content_chunk)]
+            )
+            if all(r.success for r in results):
+                return
+            # Created concurrently by another writer (and perhaps since deleted) - add to it
+        raise PersistyError(f"content_chunk_contention:{content_hash}")
+
+    def release(self, content_hashes: Iterable[str]) -> int:
+        """
+        Remove a reference for each hash given, deleting content which is no longer referenced.
+        Returns the number of bytes of content deleted
+        """
+        num_bytes = 0
+        ref_counts = Counter(h for h in content_hashes if h)
+        for content_hash, num_refs in ref_counts.items():
+            ref_count = self.ref_counter.add(content_hash, -num_refs)
+            if ref_count is None or ref_count > 0:
+                continue
+            content_chunk = self.content_chunk_store.read(content_hash)
+            # Not deleted if a concurrent writer deduplicating the same content has since added a reference
+            if content_chunk and self.ref_counter.delete_if_unreferenced(content_hash):
+                num_bytes += len(content_chunk.data)
+        return num_bytes
+
+    def resolve(self, data_chunks: Iterator[DataChunk]) -> Iterator[DataChunk]:
+        """Fill in the data for chunks which reference content, reading content in batches"""
+        batch_size = min(
+            self.resolve_batch_size, self.content_chunk_store.get_meta().batch_size
+        )
+        while True:
+            batch = list(islice(data_chunks, batch_size))
+            if not batch:
+                return
+            content_hashes = list({c.content_hash for c in batch if c.content_hash})
+            if content_hashes:
+                content_chunks = self.content_chunk_store.read_batch(content_hashes)
+                data_by_hash = {c.id: c.data for c in content_chunks if c}
+                for data_chunk in batch:
+                    if data_chunk.content_hash:
+                        data = data_by_hash.get(data_chunk.content_hash)
+                        if data is None:
+                            raise PersistyError(
+                                f"missing_content_chunk:{data_chunk.content_hash}"
+                            )
+                        data_chunk.data = data
+            yield from batch
+
+
+def delete_data_chunks(
+    data_chunk_store: StoreABC[DataChunk],
+    search_filter: SearchFilterABC[DataChunk],
+    content_chunk_refs: Optional[ContentChunkRefs] = None,
+):
+    """Delete the data chunks matching the filter given, releasing any content they reference"""
+    # Only keys are kept, and they are gathered before deleting anything so paging is not disrupted
+    keys = [
+        (str(c.id), c.content_hash) for c in data_chunk_store.search_all(search_filter)
+    ]
+    edits = (BatchEdit(delete_key=key) for key, _ in keys)
+    for _ in data_chunk_store.edit_all(edits):
+        pass
+    if content_chunk_refs:
+        content_chunk_refs.release(content_hash for _, content_hash in keys)
@@ -1,10 +1,14 @@
+import dataclasses
 from datetime import datetime
+from typing import Optional
 from uuid import UUID
 
 from persisty.attr.attr import Attr
 from persisty.impl.dynamodb.partition_sort_index import PartitionSortIndex
 from persisty.index.unique_index import UniqueIndex
 from persisty.security.store_security import INTERNAL_ONLY
+from persisty.store.store_abc import StoreABC
+from persisty.store_meta import StoreMeta, get_meta
 from persisty.stored import stored
 from schemey.schema import int_schema
 
@@ -23,9 +27,40 @@ class DataChunk:
     chunk_number: int = Attr(updatable=False, schema=int_schema(minimum=0))
     sort_key: int = Attr(updatable=False, schema=int_schema(minimum=0))
     data: bytes
+    content_hash: Optional[str] = None
+    codec: Optional[str] = None
+    chunk_size: Optional[int] = None
+    stored_size: Optional[int] = None  # len(data), so it may be read without the data
     created_at: datetime
     updated_at: datetime
 
 
 def get_sort_key(part_number: int, chunk_number: int):
     return part_number * 1024 * 1024 * 64 + chunk_number
+
+
+def get_data_chunk_key_meta() -> StoreMeta:
+    """Get meta for data chunks with the data not readable"""
+    meta = get_meta(DataChunk)
+    attrs = tuple(
+        dataclasses.replace(a, readable=False, permitted_filter_ops=tuple())
+        if a.name == "data"
+        else a
+        for a in meta.attrs
+    )
+    return dataclasses.replace(meta, attrs=attrs)
+
+
+def get_data_chunk_key_store(
+    data_chunk_store: StoreABC[DataChunk],
+) -> StoreABC[DataChunk]:
+    """
+    Get a view of the data chunk store given which does not load chunk data when searching. This relies on the
+    store only loading the readable attrs of its meta (As the mem and dynamodb stores do) - other stores are
+    returned as is.
+    """
+    if dataclasses.is_dataclass(data_chunk_store) and "meta" in {
+        f.name for f in dataclasses.fields(data_chunk_store)
+    }:
+        return dataclasses.replace(data_chunk_store, meta=get_data_chunk_key_meta())
+    return data_chunk_store
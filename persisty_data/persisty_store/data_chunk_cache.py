@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Optional, Set, Tuple
+
+from persisty_data.persisty_store.data_chunk import DataChunk
+
+
+# pylint: disable=R0902
+@dataclass
+class DataChunkCache:
+    """
+    In process LRU cache of decoded data chunks, keyed by (upload_id, sort_key) and bounded by the total bytes of
+    chunk data held. Chunks of a finished upload never change, so may be shared between readers freely - chunks
+    are invalidated when their upload is retired or a part is rewritten. The hit, miss and eviction counters
+    are cumulative, for sizing max_bytes.
+    """
+
+    max_bytes: int = 64 * 1024 * 1024
+    num_bytes: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    chunks: "OrderedDict[Tuple[str, int], DataChunk]" = field(
+        default_factory=OrderedDict
+    )
+    sort_keys_by_upload_id: Dict[str, Set[int]] = field(default_factory=dict)
+    lock: Lock = field(default_factory=Lock)
+
+    def get(self, upload_id: str, sort_key: int) -> Optional[DataChunk]:
+        key = (upload_id, sort_key)
+        with self.lock:
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.chunks.move_to_end(key)
+            return chunk
+
+    def put(self, chunk: DataChunk):
+        num_bytes = len(chunk.data)
+        if num_bytes > self.max_bytes:
+            return
+        upload_id = str(chunk.upload_id)
+        with self.lock:
+            self._remove((upload_id, chunk.sort_key))
+            self.chunks[(upload_id, chunk.sort_key)] = chunk
+            self.sort_keys_by_upload_id.setdefault(upload_id, set()).add(chunk.sort_key)
+            self.num_bytes += num_bytes
+            while self.num_bytes > self.max_bytes:
+                key = next(iter(self.chunks))
+                self._remove(key)
+                self.evictions += 1
+
+    def invalidate(self, upload_id: str, part_number: Optional[int] = None):
+        """Remove the chunks of the upload given from the cache, optionally limited to a single part"""
+        upload_id = str(upload_id)
+        with self.lock:
+            for sort_key in list(self.sort_keys_by_upload_id.get(upload_id, ())):
+                key = (upload_id, sort_key)
+                if part_number is None or self.chunks[key].part_number == part_number:
+                    self._remove(key)
+
+    def _remove(self, key: Tuple[str, int]):
+        chunk = self.chunks.pop(key, None)
+        if chunk is None:
+            return
+        self.num_bytes -= len(chunk.data)
+        sort_keys = self.sort_keys_by_upload_id[key[0]]
+        sort_keys.discard(key[1])
+        if not sort_keys:
+            del self.sort_keys_by_upload_id[key[0]]
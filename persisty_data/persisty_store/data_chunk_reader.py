@@ -1,19 +1,52 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from io import RawIOBase
-from typing import Iterator, Optional
+from typing import Dict, Iterator, Optional, List, Tuple
 
+from persisty.attr.attr_filter import attr_eq, AttrFilter
+from persisty.attr.attr_filter_op import AttrFilterOp
+from persisty.errors import PersistyError
+from persisty.finder.store_meta_finder_abc import find_store_meta_by_name
+from persisty.search_order.search_order import SearchOrder
+from persisty.search_order.search_order_attr import SearchOrderAttr
+from persisty.store.store_abc import StoreABC
 from persisty.util import UNDEFINED
 
-from persisty_data.persisty_store.data_chunk import DataChunk
+from persisty_data.codec.chunk_codec_abc import decode_chunks
+from persisty_data.persisty_store.content_chunk_refs import ContentChunkRefs
+from persisty_data.persisty_store.data_chunk import DataChunk, get_sort_key
+from persisty_data.persisty_store.data_chunk_cache import DataChunkCache
+from persisty_data.persisty_store.prefetch_iterator import PrefetchIterator
 
 
+# pylint: disable=R0902
 @dataclass
 class DataChunkReader(RawIOBase):
-    chunks: Iterator[DataChunk]
+    """
+    Reader for the chunks of an upload. Chunks are loaded lazily starting from the current position, so seeking
+    (in any direction) only costs a query bounded by sort_key rather than a scan of every preceding chunk.
+    All chunks within a part are the same size, except for the last which may be shorter. Parts may have been
+    written with different chunk sizes - chunk_size is only a first guess, corrected by the size recorded on
+    the first chunk loaded from each part.
+    If prefetch_bytes is set, upcoming chunks are fetched in the background while the current chunk is read.
+    If a chunk_cache is set, chunks are read from it while present and added to it when loaded from the store.
+    """
+
+    upload_id: str
+    size_in_bytes: int
+    data_chunk_store: StoreABC[DataChunk] = field(
+        default_factory=lambda: find_store_meta_by_name("data_chunk").create_store()
+    )
+    chunk_size: int = 256 * 1024
+    prefetch_bytes: Optional[int] = None
+    content_chunk_refs: Optional[ContentChunkRefs] = None
+    chunk_cache: Optional[DataChunkCache] = None
+    chunks: Optional[Iterator[DataChunk]] = None
     current_chunk: Optional[DataChunk] = UNDEFINED
     offset_: int = 0
     position_: int = 0
+    part_starts: List[Tuple[int, int]] = field(default_factory=lambda: [(0, 0)])
+    part_chunk_sizes: Dict[int, int] = field(default_factory=dict)
 
     def __enter__(self):
         return self
@@ -21,25 +54,40 @@ class DataChunkReader(RawIOBase):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def close(self):
+        self._close_chunks()
+        super().close()
+
+    def _close_chunks(self):
+        if isinstance(self.chunks, PrefetchIterator):
+            self.chunks.close()
+        self.chunks = None
+
     def readinto(self, output):
-        if self.current_chunk is UNDEFINED:
-            self.current_chunk = next(self.chunks, None)
+        output = memoryview(output).cast("B")
         read_remaining = len(output)
         result = 0
-        while True:
+        while read_remaining:
+            if self.current_chunk is UNDEFINED:
+                self._load_chunks()
             if self.current_chunk is None:
                 return result
-            data = self.current_chunk.data
+            data = memoryview(self.current_chunk.data)
             length = min(read_remaining, len(data) - self.offset_)
-            output[:length] = data[self.offset_ : (self.offset_ + length)]
+            output[result : (result + length)] = data[
+                self.offset_ : (self.offset_ + length)
+            ]
             self.offset_ += length
             read_remaining -= length
             result += length
             self.position_ += length
-            if not read_remaining:
-                return result
-            self.current_chunk = next(self.chunks, None)
-            self.offset_ = 0
+            if self.offset_ >= len(data):
+                if self.position_ >= self.size_in_bytes:
+                    self.current_chunk = None  # Avoid looking for chunks past the end
+                else:
+                    self.current_chunk = next(self.chunks, None)
+                self.offset_ = 0
+        return result
 
     def readable(self):
         return True
@@ -48,30 +96,152 @@ class DataChunkReader(RawIOBase):
         return True
 
     def seek(self, __offset: int, __whence: int = os.SEEK_SET):
-        if __whence == os.SEEK_SET:  # absolute positioning
-            __whence = os.SEEK_CUR
-            __offset -= self.position_
-        if __whence != os.SEEK_CUR:
-            raise NotImplementedError()  # we do not support seeking relative to the end of the file
-        if __offset < 0:
-            if __offset + self.offset_ < 0:
-                # we do not support going back to previous chunks - in order to do this we would need
-                # to support restarting the stream from the beginning
-                raise NotImplementedError()
-            self.offset_ += __offset
-            self.position_ += __offset
-            return self.position_
-        while __offset:
-            if self.current_chunk is UNDEFINED:
-                self.current_chunk = next(self.chunks)
-            remaining_bytes_in_chunk = len(self.current_chunk.data) - self.offset_
-            if remaining_bytes_in_chunk < __offset:
-                __offset -= remaining_bytes_in_chunk
-                self.offset_ = 0
-                self.position_ += remaining_bytes_in_chunk
-                self.current_chunk = next(self.chunks)
+        if __whence == os.SEEK_SET:
+            position = __offset
+        elif __whence == os.SEEK_CUR:
+            position = self.position_ + __offset
+        elif __whence == os.SEEK_END:
+            position = self.size_in_bytes + __offset
+        else:
+            raise ValueError(f"invalid_whence:{__whence}")
+        if position < 0:
+            raise ValueError(f"negative_seek_position:{position}")
+        chunk = self.current_chunk
+        if chunk is not UNDEFINED and chunk is not None:
+            chunk_start = self.position_ - self.offset_
+            if chunk_start <= position < chunk_start + len(chunk.data):
+                # Still within the current chunk, so no query is required
+                self.offset_ = position - chunk_start
+                self.position_ = position
+                return position
+        self._close_chunks()
+        self.current_chunk = UNDEFINED
+        self.offset_ = 0
+        self.position_ = position
+        return position
+
+    # pylint: disable=R0912
+    def _load_chunks(self):
+        """
+        Load chunks starting from the current position. Part boundaries are discovered lazily (and remembered) so
+        a seek within a part is a single query, and a seek across parts is at most one query per part.
+        """
+        position = self.position_
+        self.offset_ = 0
+        if position >= self.size_in_bytes:
+            self.current_chunk = None
+            return
+        part_number, part_start = next(
+            p for p in reversed(self.part_starts) if p[1] <= position
+        )
+        while True:
+            chunk_size = self.part_chunk_sizes.get(part_number, self.chunk_size)
+            chunk_number = (position - part_start) // chunk_size
+            chunks = self._search_chunks(get_sort_key(part_number, chunk_number))
+            chunk = next(chunks, None)
+            if chunk is None:
+                self.current_chunk = None
+                return
+            if chunk.part_number == part_number:
+                if self._get_chunk_size(chunk) != chunk_size:
+                    continue  # Guessed wrong - retry with the size actually used
+                offset = position - part_start - chunk.chunk_number * chunk_size
+                if offset < 0:
+                    raise PersistyError(f"missing_data_chunk:{self.upload_id}")
+                if offset < len(chunk.data):
+                    if self.prefetch_bytes:
+                        chunks = PrefetchIterator(chunks, self.prefetch_bytes)
+                    self.chunks = chunks
+                    self.current_chunk = chunk
+                    self.offset_ = offset
+                    return
+                # The position lies beyond the end of this part
+                part_end = part_start + chunk.chunk_number * chunk_size
+                part_end += len(chunk.data)
+                chunk = next(chunks, None)
+                if chunk is None:
+                    self.current_chunk = None
+                    return
             else:
-                self.offset_ += __offset
-                self.position_ += __offset
-                __offset = 0
-        return self.position_
+                part_end = part_start + self._get_part_size(part_number)
+                if position < part_end:
+                    if self.part_chunk_sizes.get(part_number) == chunk_size:
+                        raise PersistyError(f"missing_data_chunk:{self.upload_id}")
+                    continue  # Chunks in this part are larger than guessed
+            part_number, part_start = chunk.part_number, part_end
+            if part_start > self.part_starts[-1][1]:
+                self.part_starts.append((part_number, part_start))
+
+    def _get_chunk_size(self, chunk: DataChunk) -> int:
+        """Get the size of chunks in the part of the chunk given, remembering it for later seeks"""
+        chunk_size = chunk.chunk_size or self.chunk_size
+        self.part_chunk_sizes[chunk.part_number] = chunk_size
+        return chunk_size
+
+    def _search_chunks(self, min_sort_key: int) -> Iterator[DataChunk]:
+        if self.chunk_cache:
+            return self._search_cached_chunks(min_sort_key)
+        return self._query_chunks(min_sort_key)
+
+    def _search_cached_chunks(self, sort_key: int) -> Iterator[DataChunk]:
+        """Yield chunks from the cache while they are contiguous, then query the store for the remainder"""
+        upload_id = str(self.upload_id)
+        while True:
+            chunk = self.chunk_cache.get(upload_id, sort_key)
+            if chunk is None:
+                break
+            yield chunk
+            sort_key = chunk.sort_key + 1
+            if len(chunk.data) < (chunk.chunk_size or self.chunk_size):
+                # A short chunk is the last in its part
+                sort_key = get_sort_key(chunk.part_number + 1, 0)
+        for chunk in self._query_chunks(sort_key):
+            self.chunk_cache.put(chunk)
+            yield chunk
+
+    def _query_chunks(self, min_sort_key: int) -> Iterator[DataChunk]:
+        chunks = self.data_chunk_store.search_all(
+            attr_eq("upload_id", str(self.upload_id))
+            & AttrFilter("sort_key", AttrFilterOp.gte, min_sort_key),
+            SearchOrder((SearchOrderAttr("sort_key"),)),
+        )
+        if self.content_chunk_refs:
+            chunks = self.content_chunk_refs.resolve(chunks)
+        chunks = decode_chunks(chunks)
+        return chunks
+
+    def get_part_sizes(self) -> List[int]:
+        """Get the size of each part in order, using one query for the first and last chunk of each part"""
+        part_sizes = []
+        min_sort_key = 0
+        while True:
+            result_set = self.data_chunk_store.search(
+                attr_eq("upload_id", str(self.upload_id))
+                & AttrFilter("sort_key", AttrFilterOp.gte, min_sort_key),
+                SearchOrder((SearchOrderAttr("sort_key"),)),
+                limit=1,
+            )
+            first_chunk = next(iter(result_set.results), None)
+            if not first_chunk:
+                return part_sizes
+            part_sizes.append(self._get_part_size(first_chunk.part_number))
+            min_sort_key = get_sort_key(first_chunk.part_number + 1, 0)
+
+    def _get_part_size(self, part_number: int) -> int:
+        """Get the size of a part by reading only its last chunk"""
+        result_set = self.data_chunk_store.search(
+            attr_eq("upload_id", str(self.upload_id))
+            & AttrFilter("sort_key", AttrFilterOp.lt, get_sort_key(part_number + 1, 0)),
+            SearchOrder((SearchOrderAttr("sort_key", True),)),
+            limit=1,
+        )
+        last_chunk = next(iter(result_set.results), None)
+        if last_chunk:
+            last_chunks = iter((last_chunk,))
+            if self.content_chunk_refs:
+                last_chunks = self.content_chunk_refs.resolve(last_chunks)
+            last_chunk = next(decode_chunks(last_chunks))
+        if not last_chunk or last_chunk.part_number != part_number:
+            return 0
+        chunk_size = self._get_chunk_size(last_chunk)
+        return last_chunk.chunk_number * chunk_size + len(last_chunk.data)
@@ -1,54 +1,121 @@
 from dataclasses import dataclass, field
 from io import RawIOBase
 from types import TracebackType
-from typing import Union
+from typing import Union, List, Optional
 
+from persisty.batch_edit import BatchEdit
+from persisty.errors import PersistyError
 from persisty.finder.store_meta_finder_abc import find_store_meta_by_name
 from persisty.store.store_abc import StoreABC
 
+from persisty_data.codec.chunk_codec_abc import ChunkCodecABC
+from persisty_data.persisty_store.content_chunk_refs import ContentChunkRefs
 from persisty_data.persisty_store.data_chunk import DataChunk, get_sort_key
 from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
 
 
+# pylint: disable=R0902
 @dataclass
 class DataChunkWriter(RawIOBase):
+    """
+    Writer which splits content into chunks. Chunks are gathered and stored in batches (Bounded by both
+    max_batch_chunks and max_batch_bytes) to reduce the number of round trips to the data chunk store.
+    If content_chunk_refs is set, chunk data is deduplicated by content hash.
+    If chunk_codec is set, chunks are encoded unless the first chunk shows that the content does not compress
+    to less than max_encoded_ratio of its size (e.g.: Most images), in which case data is stored as is.
+    """
+
     upload_part: PersistyUploadPart
     data_chunk_store: StoreABC[DataChunk] = field(
         default_factory=lambda: find_store_meta_by_name("data_chunk").create_store()
     )
     chunk_size: int = 256 * 1024
     max_num_chunks: int = 1024 * 1024 * 64
+    max_batch_chunks: int = 16
+    max_batch_bytes: int = 4 * 1024 * 1024
     buffer: bytearray = field(default_factory=bytearray)
     chunk_number: int = 0
+    batch: List[DataChunk] = field(default_factory=list)
+    batch_bytes: int = 0
+    content_chunk_refs: Optional[ContentChunkRefs] = None
+    chunk_codec: Optional[ChunkCodecABC] = None
+    max_encoded_ratio: float = 0.9
 
     def __enter__(self):
         return self
 
     def write(self, __b) -> Union[int, None]:
+        view = memoryview(__b).cast("B")
+        length = len(view)
         src_offset = 0
-        while src_offset < len(__b):
+        while src_offset < length:
+            if not self.buffer and length - src_offset >= self.chunk_size:
+                # A whole chunk is available, so copy it straight from the input without buffering
+                end = src_offset + self.chunk_size
+                self._create_chunk(bytes(view[src_offset:end]))
+                src_offset = end
+                continue
             num_bytes_to_copy = min(
-                self.chunk_size - len(self.buffer), len(__b) - src_offset
+                self.chunk_size - len(self.buffer), length - src_offset
             )
-            self.buffer.extend(__b[src_offset : src_offset + num_bytes_to_copy])
+            self.buffer += view[src_offset : src_offset + num_bytes_to_copy]
             src_offset += num_bytes_to_copy
             if len(self.buffer) == self.chunk_size:
-                self._create_chunk()
+                self._create_chunk(bytes(self.buffer))
+                self.buffer.clear()
         return src_offset
 
-    def _create_chunk(self):
-        data = bytes(self.buffer)
+    def _create_chunk(self, data: bytes):
+        codec = None
+        if self.chunk_codec:
+            encoded = self.chunk_codec.encode(data)
+            if len(encoded) <= len(data) * self.max_encoded_ratio:
+                data = encoded
+                codec = self.chunk_codec.name
+            elif not self.chunk_number:
+                # Incompressible content, so don't bother probing further chunks
+                self.chunk_codec = None
         data_chunk = DataChunk(
             upload_id=str(self.upload_part.upload_id),
             part_number=self.upload_part.part_number,
             chunk_number=self.chunk_number,
             sort_key=get_sort_key(self.upload_part.part_number, self.chunk_number),
             data=data,
+            codec=codec,
+            chunk_size=self.chunk_size,
         )
-        self.data_chunk_store.create(data_chunk)
-        self.buffer = bytearray()
+        self.batch.append(data_chunk)
+        self.batch_bytes += len(data)
         self.chunk_number += 1
         assert self.chunk_number <= self.max_num_chunks
+        if (
+            len(self.batch) >= self.max_batch_chunks
+            or self.batch_bytes >= self.max_batch_bytes
+        ):
+            self._flush_batch()
+
+    def _flush_batch(self):
+        if not self.batch:
+            return
+        if self.content_chunk_refs:
+            self.content_chunk_refs.acquire(self.batch)
+        for data_chunk in self.batch:
+            data_chunk.stored_size = len(data_chunk.data)
+        edits = [BatchEdit(create_item=data_chunk) for data_chunk in self.batch]
+        self.batch = []
+        self.batch_bytes = 0
+        for result in self.data_chunk_store.edit_all(edits):
+            if not result.success:
+                raise PersistyError(
+                    f"data_chunk_write_failed:{result.code}:{result.details}"
+                )
+
+    def flush(self):
+        """
+        Store any complete chunks. The partial chunk in the buffer is kept until more data arrives or the
+        writer is closed, as only the final chunk in a part may be shorter than chunk_size
+        """
+        self._flush_batch()
 
     def __exit__(
         self,
@@ -56,5 +123,13 @@ class DataChunkWriter(RawIOBase):
         exc_val: Union[BaseException, None],
         exc_tb: Union[TracebackType, None],
     ) -> None:
+        if exc_type:
+            # Content is incomplete, so there is no point storing anything still pending
+            self.buffer.clear()
+            self.batch = []
+            self.batch_bytes = 0
+            return
         if self.buffer:
-            self._create_chunk()
+            self._create_chunk(bytes(self.buffer))
+            self.buffer.clear()
+        self._flush_batch()
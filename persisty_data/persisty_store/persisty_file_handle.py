@@ -31,5 +31,8 @@ class PersistyFileHandle:
     content_type: Optional[str] = Attr(create_generator=ContentTypeGenerator())
     etag: str
     size_in_bytes: int
+    data: Optional[
+        bytes
+    ] = None  # Content of small files, stored inline rather than in chunks
     created_at: datetime
     updated_at: datetime
@@ -10,8 +10,14 @@ from persisty_data.persisty_store.data_chunk_writer import DataChunkWriter
 from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
 
 
+# pylint: disable=R0902
 @dataclass(kw_only=True)
 class PersistyFileHandleWriter(DataChunkWriter):
+    """
+    Writer for a file handle. Content no larger than inline_max_size (and smaller than a single chunk) is
+    stored in the file handle itself rather than in data chunks.
+    """
+
     store_name: str
     file_name: str
     content_type: Optional[str] = None
@@ -22,12 +28,12 @@ class PersistyFileHandleWriter(DataChunkWriter):
     )
     size_in_bytes: int = 0
     hash: hashlib.md5 = field(default_factory=hashlib.md5)
+    inline_max_size: int = 0
 
-    def _create_chunk(self):
-        print(f"Creating Chunk...{self}")
-        self.size_in_bytes += len(self.buffer)
-        self.hash.update(self.buffer)
-        super()._create_chunk()
+    def _create_chunk(self, data: bytes):
+        self.size_in_bytes += len(data)
+        self.hash.update(data)
+        super()._create_chunk(data)
 
     def __exit__(
         self,
@@ -35,20 +41,35 @@ class PersistyFileHandleWriter(DataChunkWriter):
         exc_val: Union[BaseException, None],
         exc_tb: Union[TracebackType, None],
     ) -> None:
+        data = None
+        if (
+            not exc_type
+            and self.inline_max_size
+            and not self.chunk_number
+            and len(self.buffer) <= self.inline_max_size
+        ):
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            self.size_in_bytes = len(data)
+            self.hash.update(data)
         super().__exit__(exc_type, exc_val, exc_tb)
+        if exc_type:
+            return
         key = f"{self.store_name}/{self.file_name}"
         file_handle = self.file_handle_store.read(key)
         updates = PersistyFileHandle(
             id=key,
             store_name=self.store_name,
             file_name=self.file_name,
-            upload_id=self.upload_part.upload_id,
+            upload_id=None if data is not None else self.upload_part.upload_id,
             content_type=self.content_type,
             etag=self.hash.hexdigest(),
             size_in_bytes=self.size_in_bytes,
+            data=data,
         )
         if file_handle:
             # noinspection PyProtectedMember
+            # Chunks of the content replaced are left for the collector
             self.file_handle_store._update(key, file_handle, updates)
         else:
             self.file_handle_store.create(updates)
@@ -1,25 +1,42 @@
 import hashlib
 from dataclasses import field, dataclass
-from io import IOBase
-from typing import Optional, Iterator
+from io import BytesIO, IOBase
+from typing import Optional, Iterator, Tuple, List
 from uuid import uuid4
 
 from persisty.attr.attr_filter import attr_eq
+from persisty.search_filter.search_filter_abc import SearchFilterABC
 from persisty.search_order.search_order import SearchOrder
 from persisty.search_order.search_order_attr import SearchOrderAttr
 from persisty.store.store_abc import StoreABC
 from persisty.store_meta import get_meta, StoreMeta
+from servey.action.action import Action, action, get_action
+from servey.trigger.fixed_rate_trigger import FixedRateTrigger
 
+from persisty_data.codec.chunk_codec_abc import decode_chunks
 from persisty_data.file_handle import FileHandle
+from persisty_data.file_store_abc import FileStoreABC
+from persisty_data.persisty_store.chunk_collector import (
+    ChunkCollector,
+    CollectionReport,
+)
+from persisty_data.persisty_store.content_chunk import ContentChunk
+from persisty_data.persisty_store.content_chunk_refs import (
+    ContentChunkRefs,
+    delete_data_chunks,
+)
 from persisty_data.persisty_store.data_chunk import DataChunk
+from persisty_data.persisty_store.data_chunk_cache import DataChunkCache
 from persisty_data.persisty_store.data_chunk_reader import DataChunkReader
-from persisty_data.persisty_store.data_chunk_writer import DataChunkWriter
 from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
 from persisty_data.persisty_store.persisty_file_handle_writer import (
     PersistyFileHandleWriter,
 )
 from persisty_data.persisty_store.persisty_file_store_abc import PersistyFileStoreABC
 from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+from persisty_data.persisty_store.persisty_upload_part_writer import (
+    PersistyUploadPartWriter,
+)
 
 
 @dataclass
@@ -27,10 +44,52 @@ class PersistyFileStore(PersistyFileStoreABC):
     data_chunk_store: StoreABC[DataChunk] = field(
         default_factory=get_meta(DataChunk).create_store
     )
+    prefetch_bytes: Optional[int] = None
+    content_chunk_store: Optional[StoreABC[ContentChunk]] = None
+    collect_interval: Optional[int] = None
+    chunk_cache: Optional[DataChunkCache] = None
 
     def get_persisty_store_meta(self) -> Iterator[StoreMeta]:
         yield from super().get_persisty_store_meta()
         yield self.data_chunk_store.get_meta()
+        if self.content_chunk_store:
+            yield self.content_chunk_store.get_meta()
+
+    def get_actions(self) -> Iterator[Action]:
+        yield from super().get_actions()
+        if self.collect_interval:
+            collector = self.create_chunk_collector()
+
+            @action(
+                name=f"{self.meta.name}_collect_chunks",
+                triggers=FixedRateTrigger(self.collect_interval),
+            )
+            def collect_chunks() -> CollectionReport:
+                return collector.collect()
+
+            yield get_action(collect_chunks)
+
+    def create_chunk_collector(self, **kwargs) -> ChunkCollector:
+        """Create a collector for chunks and upload parts orphaned by deletes in this store"""
+        return ChunkCollector(
+            file_handle_store=self.file_handle_store,
+            upload_handle_store=self.upload_handle_store,
+            upload_part_store=self.upload_part_store,
+            data_chunk_store=self.data_chunk_store,
+            content_chunk_refs=self._get_content_chunk_refs(),
+            chunk_cache=self.chunk_cache,
+            **kwargs,
+        )
+
+    def _get_content_chunk_refs(self) -> Optional[ContentChunkRefs]:
+        """Chunk content is deduplicated if a content chunk store is defined"""
+        if self.content_chunk_store:
+            return ContentChunkRefs(self.content_chunk_store)
+
+    def _delete_data_chunks(self, search_filter: SearchFilterABC[DataChunk]):
+        delete_data_chunks(
+            self.data_chunk_store, search_filter, self._get_content_chunk_refs()
+        )
 
     def content_write(
         self,
@@ -44,6 +103,12 @@ class PersistyFileStore(PersistyFileStoreABC):
                 id=uuid4(), upload_id=uuid4(), part_number=0
             ),
             content_type=content_type,
+            data_chunk_store=self.data_chunk_store,
+            file_handle_store=self.file_handle_store,
+            content_chunk_refs=self._get_content_chunk_refs(),
+            chunk_codec=self.meta.chunk_codec,
+            chunk_size=self.meta.chunk_size,
+            inline_max_size=min(self.meta.inline_max_size, self.meta.chunk_size),
         )
         return writer
 
@@ -52,27 +117,59 @@ class PersistyFileStore(PersistyFileStoreABC):
         part_id: str,
     ) -> Optional[IOBase]:
         """Create a writer to the upload within the store"""
-        upload_part = self.upload_part_store.read(part_id)
+        upload_part = self._get_upload_part_for_write(part_id)
         if not upload_part:
             return
-        self.data_chunk_store.delete_all(
-            (
-                attr_eq("upload_id", upload_part.upload_id)
-                & attr_eq("part_number", upload_part.part_number)
+        if upload_part.etag is not None:
+            # Clear the recorded digest in case the rewrite does not complete
+            self.upload_part_store.update(
+                PersistyUploadPart(id=upload_part.id, size_in_bytes=None, etag=None)
+            )
+        self._delete_data_chunks(
+            attr_eq("upload_id", str(upload_part.upload_id))
+            & attr_eq("part_number", upload_part.part_number)
+        )
+        if self.chunk_cache:
+            self.chunk_cache.invalidate(
+                str(upload_part.upload_id), upload_part.part_number
             )
+        writer = PersistyUploadPartWriter(
+            upload_part=upload_part,
+            upload_part_store=self.upload_part_store,
+            data_chunk_store=self.data_chunk_store,
+            content_chunk_refs=self._get_content_chunk_refs(),
+            chunk_codec=self.meta.chunk_codec,
+            chunk_size=self.meta.chunk_size,
         )
-        writer = DataChunkWriter(upload_part=upload_part)
         return writer
 
     def content_read(self, file_name: str) -> Optional[IOBase]:
         file_handle = self.file_handle_store.read(self._to_key(file_name))
         if file_handle:
-            chunks = self.data_chunk_store.search_all(
-                attr_eq("upload_id", file_handle.upload_id),
-                SearchOrder((SearchOrderAttr("sort_key"),)),
+            if file_handle.data is not None:
+                return BytesIO(file_handle.data)
+            return self._create_reader(
+                str(file_handle.upload_id), file_handle.size_in_bytes
+            )
+
+    def _create_reader(self, upload_id: str, size_in_bytes: int) -> DataChunkReader:
+        reader = DataChunkReader(
+            upload_id=upload_id,
+            size_in_bytes=size_in_bytes,
+            data_chunk_store=self.data_chunk_store,
+            chunk_size=self.meta.chunk_size,
+            prefetch_bytes=self.prefetch_bytes,
+            content_chunk_refs=self._get_content_chunk_refs(),
+            chunk_cache=self.chunk_cache,
+        )
+        return reader
+
+    def _get_part_sizes(self, file_handle: PersistyFileHandle) -> Optional[List[int]]:
+        if file_handle.upload_id:
+            reader = self._create_reader(
+                str(file_handle.upload_id), file_handle.size_in_bytes
             )
-            result = DataChunkReader(chunks)
-            return result
+            return reader.get_part_sizes()
 
     def file_delete(self, file_name: str) -> bool:
         key = self._to_key(file_name)
@@ -81,54 +178,86 @@ class PersistyFileStore(PersistyFileStoreABC):
             return False
         # pylint: disable=W0212
         # noinspection PyProtectedMember
+        # Chunks are left for the collector
         result = self.file_handle_store._delete(key, file_handle)
-        if result:
-            self.data_chunk_store.delete_all(
-                attr_eq("upload_id", file_handle.upload_id)
-            )
         return result
 
+    def file_copy(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        if destination_store not in (None, self):
+            return super().file_copy(
+                source_file_name, destination_file_name, destination_store
+            )
+        file_handle = self.file_handle_store.read(self._to_key(source_file_name))
+        if not file_handle:
+            return None
+        # The new handle shares the chunks of the source. Chunks are kept while any handle references their
+        # upload (See ChunkCollector), so no data is copied
+        file_handle = self._copy_file_handle(file_handle, destination_file_name)
+        return self._to_file_handle(file_handle)
+
     def upload_finish(self, upload_id: str) -> Optional[FileHandle]:
         upload_handle = self.upload_handle_store.read(upload_id)
         if not upload_handle or upload_handle.store_name != self.meta.name:
             return
         file_handle_id = f"{self.meta.name}/{upload_handle.file_name}"
         file_handle = self.file_handle_store.read(file_handle_id)
-        md5 = hashlib.md5()
-        size_in_bytes = 0
-        data_chunks = self.data_chunk_store.search_all(
-            attr_eq("upload_id", upload_id),
-            SearchOrder((SearchOrderAttr("sort_key"),)),
-        )
-        for data_chunk in data_chunks:
-            md5.update(data_chunk.data)
-            size_in_bytes += len(data_chunk.data)
+        size_in_bytes, etag = self._get_upload_size_and_etag(upload_id)
+        data = None
+        if self.meta.inline_max_size and size_in_bytes <= min(
+            self.meta.inline_max_size, self.meta.chunk_size
+        ):
+            # Small enough to move inline (as when written directly), saving a chunk query on every read
+            with self._create_reader(upload_id, size_in_bytes) as reader:
+                data = reader.read()
         new_file_handle = PersistyFileHandle(
             id=file_handle_id,
             store_name=self.meta.name,
             file_name=upload_handle.file_name,
-            upload_id=upload_handle.id,
+            upload_id=None if data is not None else upload_handle.id,
             content_type=upload_handle.content_type,
-            etag=md5.hexdigest(),
+            etag=etag,
             size_in_bytes=size_in_bytes,
+            data=data,
         )
         self.upload_handle_store.delete(str(upload_id))
         if file_handle:
-            old_upload_id = file_handle.upload_id
             # pylint: disable=W0212
             # noinspection PyProtectedMember
             file_handle = self.file_handle_store._update(
                 file_handle_id, file_handle, new_file_handle
             )
-            self.data_chunk_store.delete_all(attr_eq("upload_id", str(old_upload_id)))
         else:
             file_handle = self.file_handle_store.create(new_file_handle)
-        self.upload_part_store.delete_all(attr_eq("upload_id", upload_id))
+        self._delete_upload_parts(upload_id)
         return self._to_file_handle(file_handle)
 
+    def _digest_upload_part(
+        self, upload_part: PersistyUploadPart
+    ) -> Tuple[int, Optional[str]]:
+        md5 = hashlib.md5()
+        size_in_bytes = 0
+        data_chunks = self.data_chunk_store.search_all(
+            attr_eq("upload_id", str(upload_part.upload_id))
+            & attr_eq("part_number", upload_part.part_number),
+            SearchOrder((SearchOrderAttr("sort_key"),)),
+        )
+        content_chunk_refs = self._get_content_chunk_refs()
+        if content_chunk_refs:
+            data_chunks = content_chunk_refs.resolve(data_chunks)
+        for data_chunk in decode_chunks(data_chunks):
+            md5.update(data_chunk.data)
+            size_in_bytes += len(data_chunk.data)
+        return size_in_bytes, md5.hexdigest()
+
     def upload_delete(self, upload_id: str) -> bool:
         result = self.upload_handle_store.delete(upload_id)
         if result:
-            self.upload_part_store.delete_all(attr_eq("upload_id", upload_id))
-            self.data_chunk_store.delete_all(attr_eq("upload_id", upload_id))
+            self._delete_upload_parts(upload_id)
+            if self.chunk_cache:
+                self.chunk_cache.invalidate(upload_id)
         return result
@@ -1,14 +1,16 @@
+import hashlib
 import math
 import mimetypes
-from abc import ABC
+from abc import ABC, abstractmethod
 from dataclasses import field, dataclass
-from datetime import datetime
-from typing import Optional, List, Iterator
+from datetime import datetime, timezone
+from typing import Optional, List, Iterator, Tuple
 from uuid import uuid4
 
 from dateutil.relativedelta import relativedelta
 from persisty.attr.attr_filter import attr_eq
 from persisty.batch_edit import BatchEdit
+from persisty.errors import PersistyError
 from persisty.result_set import ResultSet
 from persisty.search_filter.exclude_all import EXCLUDE_ALL
 from persisty.search_filter.include_all import INCLUDE_ALL
@@ -17,14 +19,27 @@ from persisty.search_order.search_order import SearchOrder
 from persisty.search_order.search_order_attr import SearchOrderAttr
 from persisty.store.store_abc import StoreABC
 from persisty.store_meta import get_meta as get_stored_meta, StoreMeta
+from servey.action.action import Action, action, get_action
 from servey.security.authorizer.authorizer_factory_abc import get_default_authorizer
+from servey.trigger.fixed_rate_trigger import FixedRateTrigger
 
 from persisty_data.file_handle import FileHandle
 from persisty_data.file_store_abc import FileStoreABC, _Route
 from persisty_data.file_store_meta import FileStoreMeta
 from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
 from persisty_data.persisty_store.persisty_upload_handle import PersistyUploadHandle
-from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+from persisty_data.persisty_store.persisty_upload_part import (
+    MAX_PART_NUMBER,
+    PersistyUploadPart,
+    get_upload_etag,
+    get_upload_part_id,
+)
+from persisty_data.persisty_store.upload_part_token import (
+    create_upload_part_token,
+    parse_upload_part_token,
+)
+from persisty_data.persisty_store.scrubber import Scrubber, ScrubReport
+from persisty_data.persisty_store.upload_reaper import ReapReport, UploadReaper
 from persisty_data.routes import create_route_for_part_upload, create_route_for_download
 from persisty_data.stored_file_handle import (
     FileHandleSearchOrder,
@@ -34,6 +49,7 @@ from persisty_data.upload_handle import UploadHandle, UploadHandleResultSet
 from persisty_data.upload_part import UploadPart, UploadPartResultSet
 
 
+# pylint: disable=R0902
 @dataclass
 class PersistyFileStoreABC(FileStoreABC, ABC):
     meta: FileStoreMeta
@@ -48,10 +64,48 @@ class PersistyFileStoreABC(FileStoreABC, ABC):
     )
     download_url_pattern: str = "/data/{store_name}/{file_name}"
     upload_url_pattern: str = "/data/{store_name}/{part_id}"
+    reap_interval: Optional[int] = None
+    max_part_attempts: int = 10
+    virtual_upload_parts: bool = False
+    scrub_interval: Optional[int] = None
+    scrub_threads: int = 4
 
     def get_meta(self):
         return self.meta
 
+    def get_actions(self) -> Iterator[Action]:
+        yield from super().get_actions()
+        if self.reap_interval:
+            reaper = self.create_upload_reaper()
+
+            @action(
+                name=f"{self.meta.name}_reap_uploads",
+                triggers=FixedRateTrigger(self.reap_interval),
+            )
+            def reap_uploads() -> ReapReport:
+                return reaper.reap()
+
+            yield get_action(reap_uploads)
+        if self.scrub_interval:
+            scrubber = self.create_scrubber()
+
+            @action(
+                name=f"{self.meta.name}_scrub",
+                triggers=FixedRateTrigger(self.scrub_interval),
+            )
+            def scrub() -> ScrubReport:
+                return scrubber.scrub()
+
+            yield get_action(scrub)
+
+    def create_upload_reaper(self, **kwargs) -> UploadReaper:
+        """Create a reaper for expired uploads in this store"""
+        return UploadReaper(file_store=self, **kwargs)
+
+    def create_scrubber(self, **kwargs) -> Scrubber:
+        """Create a scrubber verifying the content of files in this store against their etags"""
+        return Scrubber(file_store=self, **kwargs)
+
     def get_persisty_store_meta(self) -> Iterator[StoreMeta]:
         yield from (
             self.file_handle_store.get_meta(),
@@ -95,6 +149,30 @@ class PersistyFileStoreABC(FileStoreABC, ABC):
                 updated_at=file_handle.updated_at,
             )
 
+    def _copy_file_handle(
+        self, file_handle: PersistyFileHandle, file_name: str, **kwargs
+    ) -> PersistyFileHandle:
+        """Create or replace the handle for the file name given, with the content of the handle given"""
+        key = self._to_key(file_name)
+        new_file_handle = PersistyFileHandle(
+            id=key,
+            store_name=self.meta.name,
+            file_name=file_name,
+            upload_id=file_handle.upload_id,
+            content_type=file_handle.content_type,
+            etag=file_handle.etag,
+            size_in_bytes=file_handle.size_in_bytes,
+            data=file_handle.data,
+        )
+        for name, value in kwargs.items():
+            setattr(new_file_handle, name, value)
+        existing = self.file_handle_store.read(key)
+        if existing:
+            # pylint: disable=W0212
+            # noinspection PyProtectedMember
+            return self.file_handle_store._update(key, existing, new_file_handle)
+        return self.file_handle_store.create(new_file_handle)
+
     def file_read_batch(self, file_names: List[str]) -> List[Optional[FileHandle]]:
         assert len(file_names) <= self.meta.batch_size
         file_names = [self._to_key(file_name) for file_name in file_names]
@@ -138,29 +216,34 @@ class PersistyFileStoreABC(FileStoreABC, ABC):
                 file_name = f"{id_}.{content_type.split('/')[-1]}"
         if not content_type:
             content_type = mimetypes.guess_type(file_name)[0]
+        number_of_parts = 1
+        if size_in_bytes:
+            assert size_in_bytes <= self.meta.max_file_size
+            number_of_parts = math.ceil(size_in_bytes / self.meta.max_part_size)
         upload_handle = PersistyUploadHandle(
             id=id_,
             store_name=self.meta.name,
             file_name=file_name,
             content_type=content_type,
-            expire_at=datetime.now()
+            expire_at=datetime.now(timezone.utc)
             + relativedelta(seconds=self.meta.upload_expire_in),
+            part_count=number_of_parts,
+            size_in_bytes=size_in_bytes,
         )
         upload_handle = self.upload_handle_store.create(upload_handle)
-        number_of_parts = 1
-        if size_in_bytes:
-            assert size_in_bytes <= self.meta.max_file_size
-            number_of_parts = math.ceil(size_in_bytes / self.meta.max_part_size)
-        edits = (
-            BatchEdit(
-                create_item=PersistyUploadPart(
-                    upload_id=upload_handle.id, part_number=part_number
+        if not self.virtual_upload_parts:
+            edits = (
+                BatchEdit(
+                    create_item=PersistyUploadPart(
+                        id=get_upload_part_id(upload_handle.id, part_number),
+                        upload_id=upload_handle.id,
+                        part_number=part_number,
+                    )
                 )
+                for part_number in range(number_of_parts)
             )
-            for part_number in range(number_of_parts)
-        )
-        upload_parts = self.upload_part_store.edit_all(edits)
-        sum(1 for _ in upload_parts)
+            upload_parts = self.upload_part_store.edit_all(edits)
+            sum(1 for _ in upload_parts)
         result = UploadHandle(
             id=str(upload_handle.id),
             store_name=upload_handle.store_name,
@@ -202,36 +285,141 @@ class PersistyFileStoreABC(FileStoreABC, ABC):
         result = self.upload_handle_store.count(attr_eq("store_name", self.meta.name))
         return result
 
-    def upload_part_create(self, upload_id: str) -> Optional[UploadPart]:
+    def upload_part_create(
+        self, upload_id: str, part_number: Optional[int] = None
+    ) -> Optional[UploadPart]:
         upload_handle = self.upload_handle_store.read(upload_id)
-        if upload_handle:
-            upload_part = PersistyUploadPart(upload_id=upload_handle.id)
-            upload_part = self.upload_part_store.create(upload_part)
-            if upload_part:
-                result = self._to_upload_part(upload_part)
-                return result
+        if not upload_handle:
+            return
+        if part_number is not None:
+            if not 1 <= part_number <= MAX_PART_NUMBER:
+                raise PersistyError(f"invalid_part_number:{part_number}")
+            part_number -= 1
+        if self.virtual_upload_parts:
+            upload_part = self._create_virtual_upload_part(upload_handle, part_number)
+        elif part_number is None:
+            upload_part = self._create_allocated_upload_part(upload_handle)
+        else:
+            upload_part, _ = self._create_upload_part(upload_id, part_number)
+        result = self._to_upload_part(upload_part)
+        return result
+
+    def _create_virtual_upload_part(
+        self, upload_handle: PersistyUploadHandle, part_number: Optional[int]
+    ) -> PersistyUploadPart:
+        """
+        Virtual parts are all those numbered below the part count of the upload, so creating one only advances
+        the counter (if required) - nothing is stored until the part receives data
+        """
+        for _ in range(self.max_part_attempts):
+            part_count = upload_handle.part_count or 0
+            new_part_number = part_count if part_number is None else part_number
+            if new_part_number >= MAX_PART_NUMBER:
+                raise PersistyError(f"too_many_parts:{upload_handle.id}")
+            if new_part_number < part_count:
+                break
+            updated = self.upload_handle_store.update(
+                PersistyUploadHandle(
+                    id=upload_handle.id, part_count=new_part_number + 1
+                ),
+                attr_eq("part_count", upload_handle.part_count),
+            )
+            if updated:
+                break
+            upload_handle = self.upload_handle_store.read(str(upload_handle.id))
+            if not upload_handle:
+                raise PersistyError("upload_not_found")
+        else:
+            raise PersistyError(f"upload_part_contention:{upload_handle.id}")
+        return PersistyUploadPart(
+            upload_id=str(upload_handle.id), part_number=new_part_number
+        )
+
+    def _create_allocated_upload_part(
+        self, upload_handle: PersistyUploadHandle
+    ) -> PersistyUploadPart:
+        """Create a part using the next number from the counter on the upload handle"""
+        for _ in range(self.max_part_attempts):
+            part_count = upload_handle.part_count or 0
+            if part_count >= MAX_PART_NUMBER:
+                raise PersistyError(f"too_many_parts:{upload_handle.id}")
+            # Compare and set, so concurrent creates always get distinct numbers
+            updated = self.upload_handle_store.update(
+                PersistyUploadHandle(id=upload_handle.id, part_count=part_count + 1),
+                attr_eq("part_count", upload_handle.part_count),
+            )
+            if updated:
+                upload_part, created = self._create_upload_part(
+                    str(upload_handle.id), part_count
+                )
+                if created:
+                    return upload_part
+                # The number was already declared by a client, so allocate another
+                upload_handle = updated
+            else:
+                upload_handle = self.upload_handle_store.read(str(upload_handle.id))
+                if not upload_handle:
+                    raise PersistyError("upload_not_found")
+        raise PersistyError(f"upload_part_contention:{upload_handle.id}")
+
+    def _create_upload_part(
+        self, upload_id: str, part_number: int
+    ) -> Tuple[PersistyUploadPart, bool]:
+        """Create the part given, or get the existing part if it has already been created"""
+        key = get_upload_part_id(upload_id, part_number)
+        try:
+            upload_part = self.upload_part_store.create(
+                PersistyUploadPart(id=key, upload_id=upload_id, part_number=part_number)
+            )
+            return upload_part, True
+        except PersistyError:
+            upload_part = self.upload_part_store.read(str(key))
+            if not upload_part:
+                raise
+            return upload_part, False
 
     def _to_upload_part(
         self, upload_part: Optional[PersistyUploadPart]
     ) -> Optional[UploadPart]:
         if upload_part:
+            part_id = str(upload_part.id)
+            if self.virtual_upload_parts:
+                part_id = create_upload_part_token(
+                    str(upload_part.upload_id), upload_part.part_number
+                )
             result = UploadPart(
-                id=str(upload_part.id),
+                id=part_id,
                 upload_id=upload_part.upload_id,
                 part_number=upload_part.part_number + 1,
                 upload_url=self.upload_url_pattern.format(
                     store_name=self.meta.name.replace("_", "-"),
-                    part_id=upload_part.id,
+                    part_id=part_id,
                 ),
             )
             return result
 
+    def _get_upload_part_for_write(self, part_id: str) -> Optional[PersistyUploadPart]:
+        """Get the part to write to. Virtual parts are stored the first time they are written"""
+        if not self.virtual_upload_parts:
+            return self.upload_part_store.read(part_id)
+        parsed = parse_upload_part_token(part_id)
+        if not parsed:
+            return None
+        upload_id, part_number = parsed
+        upload_handle = self.upload_handle_store.read(upload_id)
+        if not upload_handle or part_number >= (upload_handle.part_count or 0):
+            return None
+        upload_part, _ = self._create_upload_part(upload_id, part_number)
+        return upload_part
+
     def upload_part_search(
         self,
         upload_id__eq: str,
         page_key: Optional[str] = None,
         limit: Optional[int] = None,
     ) -> UploadPartResultSet:
+        if self.virtual_upload_parts:
+            return self._virtual_upload_part_search(upload_id__eq, page_key, limit)
         search_filter = attr_eq("upload_id", upload_id__eq)
         result = self.upload_part_store.search(
             search_filter,
@@ -245,7 +433,77 @@ class PersistyFileStoreABC(FileStoreABC, ABC):
         )
         return result
 
+    def _virtual_upload_part_search(
+        self,
+        upload_id: str,
+        page_key: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> UploadPartResultSet:
+        upload_handle = self.upload_handle_store.read(upload_id)
+        if not upload_handle:
+            return UploadPartResultSet(results=[])
+        start = int(page_key) if page_key else 0
+        end = start + (limit or self.upload_part_store.get_meta().batch_size)
+        end = min(end, upload_handle.part_count or 0)
+        results = [
+            self._to_upload_part(PersistyUploadPart(upload_id=upload_id, part_number=n))
+            for n in range(start, end)
+        ]
+        next_page_key = str(end) if end < (upload_handle.part_count or 0) else None
+        return UploadPartResultSet(results=results, next_page_key=next_page_key)
+
+    def _get_upload_size_and_etag(self, upload_id: str) -> Tuple[int, str]:
+        """
+        Get the size and etag of an upload from the sizes and digests of its parts recorded as each part was
+        written, so that finishing an upload does not require another pass over the data
+        """
+        upload_parts = self.upload_part_store.search_all(
+            attr_eq("upload_id", upload_id),
+            SearchOrder((SearchOrderAttr("part_number"),)),
+        )
+        size_in_bytes = 0
+        part_etags = []
+        for upload_part in upload_parts:
+            if upload_part.etag is None:
+                part_size_in_bytes, part_etag = self._digest_upload_part(upload_part)
+            else:
+                part_size_in_bytes, part_etag = (
+                    upload_part.size_in_bytes,
+                    upload_part.etag,
+                )
+            if part_size_in_bytes:
+                size_in_bytes += part_size_in_bytes
+                part_etags.append(part_etag)
+        if not part_etags:
+            return 0, hashlib.md5().hexdigest()
+        return size_in_bytes, get_upload_etag(part_etags)
+
+    @abstractmethod
+    def _digest_upload_part(
+        self, upload_part: PersistyUploadPart
+    ) -> Tuple[int, Optional[str]]:
+        """Get the size and md5 of a part which has no recorded etag (e.g.: it was never written)"""
+
+    def _get_part_sizes(self, file_handle: PersistyFileHandle) -> Optional[List[int]]:
+        """
+        Get the size of each part of a file finished from a multipart upload, or None if part boundaries were
+        not retained
+        """
+
+    def _delete_upload_parts(self, upload_id: str):
+        # StoreABC.delete_all does not consume the edits it creates, so nothing would be deleted
+        keys = [
+            str(p.id)
+            for p in self.upload_part_store.search_all(attr_eq("upload_id", upload_id))
+        ]
+        edits = (BatchEdit(delete_key=key) for key in keys)
+        for _ in self.upload_part_store.edit_all(edits):
+            pass
+
     def upload_part_count(self, upload_id__eq: str) -> int:
+        if self.virtual_upload_parts:
+            upload_handle = self.upload_handle_store.read(upload_id__eq)
+            return (upload_handle.part_count or 0) if upload_handle else 0
         search_filter = attr_eq("upload_id", upload_id__eq)
         result = self.upload_part_store.count(search_filter)
         return result
@@ -14,6 +14,7 @@ from persisty_data.generator.content_type_generator import ContentTypeGenerator
     indexes=(
         UniqueIndex(("store_name", "file_name")),
         PartitionSortIndex("store_name", "file_name"),
+        PartitionSortIndex("store_name", "expire_at"),  # Range scanned by the reaper
     ),
     store_security=INTERNAL_ONLY,
 )
@@ -29,5 +30,7 @@ class PersistyUploadHandle:
         create_generator=ContentTypeGenerator("file_name")
     )
     expire_at: datetime
+    part_count: int = 0  # Counter from which part numbers are allocated
+    size_in_bytes: Optional[int] = None  # Expected size, if declared when created
     created_at: datetime
     updated_at: datetime
@@ -1,14 +1,13 @@
+import hashlib
 from datetime import datetime
-from uuid import UUID
+from typing import Optional, List
+from uuid import UUID, uuid5, NAMESPACE_URL
 
-from persisty.attr.attr import Attr
 from persisty.impl.dynamodb.partition_sort_index import PartitionSortIndex
 from persisty.index.unique_index import UniqueIndex
 from persisty.security.store_security import INTERNAL_ONLY
 from persisty.stored import stored
 
-from persisty_data.generator.part_number_generator import PartNumberGenerator
-
 
 @stored(
     indexes=(
@@ -20,6 +19,32 @@ from persisty_data.generator.part_number_generator import PartNumberGenerator
 class PersistyUploadPart:
     id: UUID
     upload_id: str
-    part_number: int = Attr(create_generator=PartNumberGenerator("upload_id"))
+    part_number: int
+    size_in_bytes: Optional[int] = None  # Recorded when the part is written
+    etag: Optional[str] = None  # md5 of the part, recorded when the part is written
     created_at: datetime
     updated_at: datetime
+
+
+MAX_PART_NUMBER = 10_000  # Same as S3
+
+
+def get_upload_part_id(upload_id: str, part_number: int) -> UUID:
+    """
+    Ids of upload parts are derived from the upload and part number, so concurrent attempts to create the same
+    part collide on the key in any store rather than relying on the unique index being enforced
+    """
+    return uuid5(NAMESPACE_URL, f"persisty_upload_part/{upload_id}/{part_number}")
+
+
+def get_upload_etag(part_etags: List[str]) -> str:
+    """
+    Compose the etag for an upload from the md5 of each of its parts. Following the S3 convention, the etag of a
+    multipart upload is the md5 of the concatenated part digests, suffixed with the number of parts.
+    """
+    if len(part_etags) == 1:
+        return part_etags[0]
+    md5 = hashlib.md5()
+    for part_etag in part_etags:
+        md5.update(bytes.fromhex(part_etag))
+    return f"{md5.hexdigest()}-{len(part_etags)}"
@@ -0,0 +1,43 @@
+import hashlib
+from dataclasses import dataclass, field
+from types import TracebackType
+from typing import Union
+
+from persisty.store.store_abc import StoreABC
+from persisty.store_meta import get_meta
+
+from persisty_data.persisty_store.data_chunk_writer import DataChunkWriter
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+
+@dataclass(kw_only=True)
+class PersistyUploadPartWriter(DataChunkWriter):
+    """Writer for an upload part, which records the size and md5 of the part when done"""
+
+    upload_part_store: StoreABC[PersistyUploadPart] = field(
+        default_factory=get_meta(PersistyUploadPart).create_store
+    )
+    size_in_bytes: int = 0
+    hash: hashlib.md5 = field(default_factory=hashlib.md5)
+
+    def _create_chunk(self, data: bytes):
+        self.size_in_bytes += len(data)
+        self.hash.update(data)
+        super()._create_chunk(data)
+
+    def __exit__(
+        self,
+        exc_type: Union[type[BaseException], None],
+        exc_val: Union[BaseException, None],
+        exc_tb: Union[TracebackType, None],
+    ) -> None:
+        super().__exit__(exc_type, exc_val, exc_tb)
+        if exc_type:
+            return
+        self.upload_part_store.update(
+            PersistyUploadPart(
+                id=self.upload_part.id,
+                size_in_bytes=self.size_in_bytes,
+                etag=self.hash.hexdigest(),
+            )
+        )
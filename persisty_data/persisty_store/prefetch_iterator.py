@@ -0,0 +1,70 @@
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Condition, Thread
+from typing import Iterator, Optional, Deque
+
+from persisty_data.persisty_store.data_chunk import DataChunk
+
+
+# pylint: disable=R0902
+@dataclass
+class PrefetchIterator(Iterator[DataChunk]):
+    """
+    Iterator which consumes chunks from a source iterator in a background thread, keeping up to max_bytes of
+    upcoming chunks in memory so that the consumer does not wait on the data chunk store between pages.
+    """
+
+    source: Iterator[DataChunk]
+    max_bytes: int = 4 * 1024 * 1024
+    chunks: Deque[DataChunk] = field(default_factory=deque)
+    bytes_in_flight: int = 0
+    done: bool = False
+    closed: bool = False
+    error: Optional[BaseException] = None
+    condition: Condition = field(default_factory=Condition)
+    thread: Optional[Thread] = None
+
+    def __post_init__(self):
+        self.thread = Thread(target=self._fetch, daemon=True)
+        self.thread.start()
+
+    def _fetch(self):
+        try:
+            for chunk in self.source:
+                with self.condition:
+                    while self.bytes_in_flight >= self.max_bytes and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    self.chunks.append(chunk)
+                    self.bytes_in_flight += len(chunk.data)
+                    self.condition.notify_all()
+        # pylint: disable=W0718
+        except BaseException as exc:
+            with self.condition:
+                self.error = exc
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def __next__(self) -> DataChunk:
+        with self.condition:
+            while not self.chunks and not self.done:
+                self.condition.wait()
+            if self.chunks:
+                chunk = self.chunks.popleft()
+                self.bytes_in_flight -= len(chunk.data)
+                self.condition.notify_all()
+                return chunk
+            if self.error:
+                raise self.error
+            raise StopIteration()
+
+    def close(self):
+        """Stop fetching. The worker exits once any request to the store already in progress returns"""
+        with self.condition:
+            self.closed = True
+            self.chunks.clear()
+            self.bytes_in_flight = 0
+            self.condition.notify_all()
@@ -0,0 +1,151 @@
+"""
+Atomic reference counts for items in a store. Store updates with a precondition read the item and check the
+precondition before writing, so concurrent writers may both pass - counts here are instead changed with a single
+operation on the backend (An SQL UPDATE / DELETE with a WHERE clause, or a DynamoDB ADD / ConditionExpression).
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from decimal import Decimal
+from threading import Lock
+from typing import Optional
+
+from botocore.exceptions import ClientError
+from persisty.impl.dynamodb.dynamodb_table_store import DynamodbTableStore
+from persisty.impl.sqlalchemy.sqlalchemy_table_store import SqlalchemyTableStore
+from persisty.store.store_abc import StoreABC
+from persisty.store.wrapper_store_abc import WrapperStoreABC
+from sqlalchemy import and_, select
+
+_lock = Lock()
+
+
+class RefCounterABC(ABC):
+    @abstractmethod
+    def add(self, key: str, num_refs: int) -> Optional[int]:
+        """Add to (or subtract from) the count of the item with the key given. Returns None if there is no item"""
+
+    @abstractmethod
+    def delete_if_unreferenced(self, key: str) -> bool:
+        """Delete the item with the key given if its count is not positive"""
+
+
+@dataclass
+class LockingRefCounter(RefCounterABC):
+    """
+    Counter for stores without atomic operations (e.g.: The mem store). Operations are only atomic with respect
+    to other operations in this process, so these stores must have a single writer
+    """
+
+    store: StoreABC
+    attr_name: str = "ref_count"
+
+    def add(self, key: str, num_refs: int) -> Optional[int]:
+        with _lock:
+            item = self.store.read(key)
+            if item is None:
+                return None
+            setattr(item, self.attr_name, getattr(item, self.attr_name) + num_refs)
+            item = self.store.update(item)
+            return getattr(item, self.attr_name) if item else None
+
+    def delete_if_unreferenced(self, key: str) -> bool:
+        with _lock:
+            item = self.store.read(key)
+            if item is None or getattr(item, self.attr_name) > 0:
+                return False
+            # pylint: disable=W0212
+            # noinspection PyProtectedMember
+            return self.store._delete(key, item)
+
+
+@dataclass
+class SqlalchemyRefCounter(RefCounterABC):
+    store: SqlalchemyTableStore
+    attr_name: str = "ref_count"
+
+    def add(self, key: str, num_refs: int) -> Optional[int]:
+        table = self.store.table
+        column = table.c[self.attr_name]
+        where = self._key_where(key)
+        # The row is locked by the update until the transaction is committed, so the count read is ours
+        with self.store.engine.begin() as connection:
+            result = connection.execute(
+                table.update().where(where).values({column: column + num_refs})
+            )
+            if not result.rowcount:
+                return None
+            return connection.execute(select(column).where(where)).scalar()
+
+    def delete_if_unreferenced(self, key: str) -> bool:
+        table = self.store.table
+        where = and_(self._key_where(key), table.c[self.attr_name] <= 0)
+        with self.store.engine.begin() as connection:
+            return bool(connection.execute(table.delete().where(where)).rowcount)
+
+    def _key_where(self, key: str):
+        key_dict = self.store.meta.key_config.to_key_dict(key)
+        return and_(*(self.store.table.c[k] == v for k, v in key_dict.items()))
+
+
+@dataclass
+class DynamodbRefCounter(RefCounterABC):
+    store: DynamodbTableStore
+    attr_name: str = "ref_count"
+
+    def add(self, key: str, num_refs: int) -> Optional[int]:
+        # noinspection PyProtectedMember
+        # pylint: disable=W0212
+        table = self.store._dynamodb_table()
+        try:
+            response = table.update_item(
+                Key=self.store.meta.key_config.to_key_dict(key),
+                UpdateExpression="ADD #c :n",
+                ConditionExpression="attribute_exists(#k)",
+                ExpressionAttributeNames={
+                    "#c": self.attr_name,
+                    "#k": self.store.index.pk,
+                },
+                ExpressionAttributeValues={":n": Decimal(num_refs)},
+                ReturnValues="UPDATED_NEW",
+            )
+        except ClientError as exc:
+            if _is_condition_failure(exc):
+                return None
+            raise
+        return int(response["Attributes"][self.attr_name])
+
+    def delete_if_unreferenced(self, key: str) -> bool:
+        # noinspection PyProtectedMember
+        # pylint: disable=W0212
+        table = self.store._dynamodb_table()
+        try:
+            table.delete_item(
+                Key=self.store.meta.key_config.to_key_dict(key),
+                ConditionExpression="#c <= :z",
+                ExpressionAttributeNames={"#c": self.attr_name},
+                ExpressionAttributeValues={":z": Decimal(0)},
+            )
+            return True
+        except ClientError as exc:
+            if _is_condition_failure(exc):
+                return False
+            raise
+
+
+def get_ref_counter(store: StoreABC, attr_name: str = "ref_count") -> RefCounterABC:
+    """
+    Get a counter for the store given. Wrappers (validation, access control, triggers) are bypassed, as only
+    the count is changed
+    """
+    unwrapped = store
+    while isinstance(unwrapped, WrapperStoreABC):
+        unwrapped = unwrapped.get_store()
+    if isinstance(unwrapped, SqlalchemyTableStore):
+        return SqlalchemyRefCounter(unwrapped, attr_name)
+    if isinstance(unwrapped, DynamodbTableStore):
+        return DynamodbRefCounter(unwrapped, attr_name)
+    return LockingRefCounter(store, attr_name)
+
+
+def _is_condition_failure(exc: ClientError) -> bool:
+    return exc.response["Error"]["Code"] == "ConditionalCheckFailedException"
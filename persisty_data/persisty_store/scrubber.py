@@ -0,0 +1,187 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Optional, List, Tuple
+
+from persisty.attr.attr_filter import attr_eq, AttrFilter
+from persisty.attr.attr_filter_op import AttrFilterOp
+from persisty.search_order.search_order import SearchOrder
+from persisty.search_order.search_order_attr import SearchOrderAttr
+
+from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
+
+_PersistyFileStoreABC = (
+    "persisty_data.persisty_store.persisty_file_store_abc.PersistyFileStoreABC"
+)
+
+
+@dataclass
+class ScrubMismatch:
+    file_name: str
+    expected_etag: str
+    actual_etag: Optional[str]
+    error: Optional[str] = None  # Set if the content could not be read
+
+
+@dataclass
+class ScrubReport:
+    num_files: int = 0
+    num_bytes: int = 0
+    num_unverified: int = 0
+    seconds: float = 0
+    mismatches: List[ScrubMismatch] = field(default_factory=list)
+    checkpoint: Optional[str] = None
+
+    def get_throughput(self) -> float:
+        """Bytes per second verified"""
+        return self.num_bytes / max(self.seconds, 1e-9)
+
+
+@dataclass
+class RateLimiter:
+    """Limits the bytes per second consumed across all threads sharing this limiter"""
+
+    bytes_per_second: int
+    next_time: float = field(default_factory=time.monotonic)
+    lock: Lock = field(default_factory=Lock)
+
+    def consume(self, num_bytes: int):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + num_bytes / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+# pylint: disable=R0902
+@dataclass
+class Scrubber:
+    """
+    Detects bit rot and partial writes by streaming the content of each file in a store through md5, and
+    comparing the result with the etag recorded in its file handle. Files are verified in file_name order, in
+    batches of batch_size using a pool of num_threads (Defaulting to the scrub_threads of the store, as the best
+    concurrency depends on the backend). Reads across all threads are limited to max_bytes_per_second.
+
+    checkpoint holds the name of the last file in the last batch verified, and the next scrub resumes after it.
+    It is cleared once a pass over the store completes. If max_files is set, a scrub stops after that many files.
+
+    Multipart etags (Suffixed with the number of parts) can only be verified if the store can supply the size of
+    each part - files where it cannot are counted as unverified.
+    """
+
+    file_store: _PersistyFileStoreABC
+    max_bytes_per_second: Optional[int] = None
+    num_threads: Optional[int] = None
+    batch_size: int = 100
+    max_files: Optional[int] = None
+    checkpoint: Optional[str] = None
+    rate_limiter: Optional[RateLimiter] = None
+
+    def __post_init__(self):
+        if not self.num_threads:
+            self.num_threads = self.file_store.scrub_threads
+        if self.max_bytes_per_second and not self.rate_limiter:
+            self.rate_limiter = RateLimiter(self.max_bytes_per_second)
+
+    def scrub(self) -> ScrubReport:
+        report = ScrubReport()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            while self.max_files is None or report.num_files < self.max_files:
+                file_handles = self._next_batch(report.num_files)
+                results = executor.map(self._scrub_file, file_handles)
+                for file_handle, (num_bytes, etag, error) in zip(file_handles, results):
+                    report.num_files += 1
+                    report.num_bytes += num_bytes
+                    if error:
+                        report.mismatches.append(
+                            ScrubMismatch(
+                                file_handle.file_name, file_handle.etag, None, error
+                            )
+                        )
+                    elif etag is None:
+                        report.num_unverified += 1
+                    elif etag != _strip_etag(file_handle.etag):
+                        report.mismatches.append(
+                            ScrubMismatch(file_handle.file_name, file_handle.etag, etag)
+                        )
+                if len(file_handles) < self.batch_size:
+                    self.checkpoint = None
+                    break
+                # Only advanced once the whole batch is verified, so nothing is skipped on resume
+                self.checkpoint = file_handles[-1].file_name
+        report.seconds = time.perf_counter() - start
+        report.checkpoint = self.checkpoint
+        return report
+
+    def _next_batch(self, num_files: int) -> List[PersistyFileHandle]:
+        search_filter = attr_eq("store_name", self.file_store.get_meta().name)
+        if self.checkpoint is not None:
+            search_filter &= AttrFilter("file_name", AttrFilterOp.gt, self.checkpoint)
+        limit = self.batch_size
+        if self.max_files is not None:
+            limit = min(limit, self.max_files - num_files)
+        result_set = self.file_store.file_handle_store.search(
+            search_filter, SearchOrder((SearchOrderAttr("file_name"),)), limit=limit
+        )
+        return list(result_set.results)
+
+    def _scrub_file(
+        self, file_handle: PersistyFileHandle
+    ) -> Tuple[int, Optional[str], Optional[str]]:
+        """
+        Get the number of bytes read, the etag of the content (None if it could not be verified) and any error
+        reading it. Errors (e.g.: Missing chunks) are damage to report rather than a reason to stop the scrub
+        """
+        try:
+            num_bytes, etag = self._hash_file(file_handle)
+            return num_bytes, etag, None
+        # pylint: disable=W0718
+        except Exception as exc:
+            return 0, None, f"{type(exc).__name__}:{exc}"
+
+    def _hash_file(self, file_handle: PersistyFileHandle) -> Tuple[int, Optional[str]]:
+        """Get the number of bytes read and the etag of the content, or None if it could not be verified"""
+        part_sizes = [file_handle.size_in_bytes]
+        if "-" in _strip_etag(file_handle.etag):
+            # noinspection PyProtectedMember
+            # pylint: disable=W0212
+            part_sizes = self.file_store._get_part_sizes(file_handle)
+            if part_sizes is None:
+                return 0, None
+        reader = self.file_store.content_read(file_handle.file_name)
+        if reader is None:
+            return 0, ""  # The handle exists but the content does not
+        buffer_size = self.file_store.get_meta().stream_buffer_size
+        part_etags = []
+        num_bytes = 0
+        with reader:
+            for part_size in part_sizes:
+                md5 = hashlib.md5()
+                remaining = part_size
+                while remaining:
+                    buffer = reader.read(min(remaining, buffer_size))
+                    if not buffer:
+                        break
+                    if self.rate_limiter:
+                        self.rate_limiter.consume(len(buffer))
+                    md5.update(buffer)
+                    remaining -= len(buffer)
+                    num_bytes += len(buffer)
+                part_etags.append(md5.hexdigest())
+            if reader.read(1):
+                return num_bytes, ""  # Longer than recorded, so cannot match
+        if len(part_sizes) == 1 and "-" not in file_handle.etag:
+            return num_bytes, part_etags[0]
+        md5 = hashlib.md5()
+        for part_etag in part_etags:
+            md5.update(bytes.fromhex(part_etag))
+        return num_bytes, f"{md5.hexdigest()}-{len(part_etags)}"
+
+
+def _strip_etag(etag: str) -> str:
+    """S3 etags are quoted"""
+    return etag.strip('"')
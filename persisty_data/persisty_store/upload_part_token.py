@@ -0,0 +1,36 @@
+"""
+Signed tokens identifying a part of an upload, used as part ids when upload parts are virtual (i.e.: Derived
+from the upload handle rather than stored). The signature stops clients from forging tokens for parts outside
+those they were given. The key is taken from the same environment variable persisty uses.
+"""
+import base64
+import hashlib
+import hmac
+import os
+from typing import Optional, Tuple
+
+KEY_PARAM = "PERSISTY_SECRET_KEY"
+_KEY = os.environ.get(KEY_PARAM, "NOT_A_SECURE_KEY").encode("utf-8")
+_SIGNATURE_LENGTH = 16
+
+
+def _sign(message: str) -> str:
+    digest = hmac.new(_KEY, message.encode("utf-8"), hashlib.sha256).digest()
+    signature = base64.urlsafe_b64encode(digest[:_SIGNATURE_LENGTH])
+    return signature.decode("utf-8").rstrip("=")
+
+
+def create_upload_part_token(upload_id: str, part_number: int) -> str:
+    message = f"{upload_id}.{part_number}"
+    return f"{message}.{_sign(message)}"
+
+
+def parse_upload_part_token(token: str) -> Optional[Tuple[str, int]]:
+    """Get the upload_id and part_number from a token, or None if the token is not valid"""
+    message, _, signature = token.rpartition(".")
+    upload_id, _, part_number = message.rpartition(".")
+    if not upload_id or not part_number.isdigit():
+        return None
+    if not hmac.compare_digest(signature, _sign(message)):
+        return None
+    return upload_id, int(part_number)
@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from persisty.attr.attr_filter import attr_eq, AttrFilter
+from persisty.attr.attr_filter_op import AttrFilterOp
+from persisty.search_order.search_order import SearchOrder
+from persisty.search_order.search_order_attr import SearchOrderAttr
+
+_PersistyFileStoreABC = (
+    "persisty_data.persisty_store.persisty_file_store_abc.PersistyFileStoreABC"
+)
+
+
+@dataclass
+class ReapReport:
+    num_uploads: int = 0
+    num_bytes: int = 0
+
+
+@dataclass
+class UploadReaper:
+    """
+    Purges expired uploads from a file store, range scanning upload handles by expire_at in batches of at most
+    batch_size. Each upload is purged using the upload_delete of the store, so backend specific state (Data
+    chunks, part files, S3 multipart uploads) is cleaned up too. Bytes reclaimed are those recorded against
+    parts as they were written. Totals across all runs are kept in num_uploads and num_bytes.
+    """
+
+    file_store: _PersistyFileStoreABC
+    batch_size: int = 100
+    max_batches: Optional[int] = None
+    num_uploads: int = 0
+    num_bytes: int = 0
+
+    def reap(self) -> ReapReport:
+        report = ReapReport()
+        file_store = self.file_store
+        search_filter = attr_eq("store_name", file_store.get_meta().name) & AttrFilter(
+            "expire_at", AttrFilterOp.lt, datetime.now(timezone.utc)
+        )
+        search_order = SearchOrder((SearchOrderAttr("expire_at"),))
+        num_batches = 0
+        while self.max_batches is None or num_batches < self.max_batches:
+            num_batches += 1
+            # Purged uploads drop out of the results, so the first page is always the next batch
+            upload_handles = file_store.upload_handle_store.search(
+                search_filter, search_order, limit=self.batch_size
+            ).results
+            num_purged = 0
+            for upload_handle in upload_handles:
+                upload_id = str(upload_handle.id)
+                num_bytes = sum(
+                    p.size_in_bytes or 0
+                    for p in file_store.upload_part_store.search_all(
+                        attr_eq("upload_id", upload_id)
+                    )
+                )
+                if file_store.upload_delete(upload_id):
+                    num_purged += 1
+                    report.num_uploads += 1
+                    report.num_bytes += num_bytes
+            if not num_purged or len(upload_handles) < self.batch_size:
+                break
+        self.num_uploads += report.num_uploads
+        self.num_bytes += report.num_bytes
+        return report
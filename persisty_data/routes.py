@@ -1,6 +1,7 @@
 import dataclasses
+import mmap
 from email.utils import parsedate_to_datetime
-from typing import Mapping, Optional, Tuple, Iterator
+from typing import Mapping, Optional, Tuple, Iterator, Union
 
 import marshy
 from persisty.errors import PersistyError
@@ -8,6 +9,7 @@ from servey.security.authorizer.authorizer_abc import AuthorizerABC
 from starlette.requests import Request
 from starlette.responses import Response, StreamingResponse
 from starlette.routing import Route
+from starlette.types import Receive, Scope, Send
 
 from persisty_data.file_handle import FileHandle
 from persisty_data.file_store_abc import FileStoreABC
@@ -44,6 +46,7 @@ def create_route_for_part_upload(
     )
 
 
+# pylint: disable=R0911
 def file_handle_response(
     method: str,
     request_headers: Mapping[str, str],
@@ -85,35 +88,121 @@ def file_handle_response(
         http_headers["Content-Length"] = str(byte_range[1])
     else:
         http_headers["Content-Length"] = str(file_handle.size_in_bytes)
+    path = file_store.content_path(file_handle.file_name)
+    if path:
+        offset, count = byte_range or (0, file_handle.size_in_bytes)
+        return LocalFileResponse(
+            path=path,
+            offset=offset,
+            count=min(count, file_handle.size_in_bytes - offset),
+            whole_file=byte_range is None,
+            headers=http_headers,
+            buffer_size=file_store.get_meta().stream_buffer_size,
+        )
     response = StreamingResponse(
         status_code=200,
         headers=http_headers,
-        content=content_iterator(file_store, file_handle.file_name, byte_range),
+        content=content_iterator(
+            file_store,
+            file_handle.file_name,
+            byte_range,
+            file_store.get_meta().stream_buffer_size,
+        ),
     )
     return response
 
 
 def content_iterator(
-    file_store: FileStoreABC, file_name: str, byte_range: Optional[Tuple[int, int]]
-) -> Iterator[bytes]:
+    file_store: FileStoreABC,
+    file_name: str,
+    byte_range: Optional[Tuple[int, int]],
+    buffer_size: int = CHUNK_SIZE,
+) -> Iterator[Union[bytes, memoryview]]:
     to_read = byte_range[1] if byte_range else None
     with file_store.content_read(file_name) as reader:
         if byte_range:
             reader.seek(byte_range[0])
-        while True:
-            data = reader.read(CHUNK_SIZE)
+        readinto = getattr(reader, "readinto", None)
+        while to_read is None or to_read > 0:
+            size = buffer_size if to_read is None else min(buffer_size, to_read)
+            if readinto:
+                # Read straight into a buffer which is handed off, so range handling never copies data
+                buffer = bytearray(size)
+                num_read = readinto(buffer)
+                data = memoryview(buffer)[:num_read] if num_read else None
+            else:
+                data = reader.read(size)
             if not data:
                 return
             if to_read is not None:
-                if to_read > len(data):
-                    to_read -= len(data)
-                    yield data
-                else:
-                    data = data[:to_read]
-                    yield data
-                    return
-            else:
-                yield data
+                to_read -= len(data)
+            yield data
+
+
+class LocalFileResponse(Response):
+    """
+    Response for content in a file on the local filesystem. Servers supporting the ASGI zero copy send extension
+    transmit the file using sendfile, and servers supporting path send are given the path of whole files.
+    Otherwise the file is memory mapped, so content is sliced from the page cache without read calls.
+    """
+
+    # pylint: disable=W0231,R0913
+    def __init__(
+        self,
+        path: str,
+        *,
+        offset: int,
+        count: int,
+        whole_file: bool,
+        headers: Mapping[str, str],
+        buffer_size: int = CHUNK_SIZE,
+    ):
+        self.path = path
+        self.offset = offset
+        self.count = max(count, 0)
+        self.whole_file = whole_file
+        self.buffer_size = buffer_size
+        self.status_code = 200
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if "http.response.zerocopysend" in extensions and self.count:
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": self.offset,
+                        "count": self.count,
+                    }
+                )
+        elif "http.response.pathsend" in extensions and self.whole_file:
+            await send({"type": "http.response.pathsend", "path": self.path})
+        elif not self.count:
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            with open(self.path, "rb") as file, mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped:
+                end = min(self.offset + self.count, len(mapped))
+                for start in range(self.offset, end, self.buffer_size):
+                    stop = min(start + self.buffer_size, end)
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": mapped[start:stop],
+                            "more_body": stop < end,
+                        }
+                    )
 
 
 def parse_ranges(request: Request) -> Optional[Tuple[int, int]]:
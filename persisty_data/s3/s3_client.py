@@ -1,11 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Optional
+
 import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+# pylint: disable=R0902
+@dataclass(frozen=True)
+class S3ClientConfig:
+    """
+    Configuration for the S3 client of a store. Stores with equal configurations share a client (and so its
+    connection pool). max_pool_connections should be at least the number of threads making requests at once,
+    or requests queue for a connection.
+    """
+
+    endpoint_url: Optional[str] = None
+    region_name: Optional[str] = None
+    max_pool_connections: int = 50
+    connect_timeout: float = 5
+    read_timeout: float = 60
+    retry_mode: str = "standard"  # legacy, standard or adaptive
+    max_attempts: int = 3
+    addressing_style: str = "auto"  # auto, virtual or path
+
+    def create_client(self):
+        # Sessions are not thread safe, so each client gets its own rather than using the default session
+        session = boto3.session.Session()
+        return session.client(
+            "s3",
+            endpoint_url=self.endpoint_url,
+            region_name=self.region_name,
+            config=Config(
+                max_pool_connections=self.max_pool_connections,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                retries={"mode": self.retry_mode, "max_attempts": self.max_attempts},
+                s3={"addressing_style": self.addressing_style},
+            ),
+        )
+
+
+DEFAULT_S3_CLIENT_CONFIG = S3ClientConfig()
+_s3_clients: Dict[S3ClientConfig, object] = {}
+_lock = Lock()
+
+
+def get_s3_client(config: S3ClientConfig = DEFAULT_S3_CLIENT_CONFIG):
+    """Get the client for the configuration given, creating it on first use. Clients are thread safe"""
+    s3_client = _s3_clients.get(config)
+    if s3_client is None:
+        with _lock:
+            s3_client = _s3_clients.get(config)
+            if s3_client is None:
+                s3_client = _s3_clients[config] = config.create_client()
+    return s3_client
+
 
-_s3_client = None
+def warm_up_s3_client(
+    config: S3ClientConfig, bucket_name: str, num_connections: int = 1
+) -> bool:
+    """
+    Resolve credentials and open connections (including the TLS handshake) for a client up front, so the first
+    requests do not wait for them. Returns False if the bucket could not be reached - errors are left to be
+    raised by real requests
+    """
+    s3_client = get_s3_client(config)
+    num_connections = max(min(num_connections, config.max_pool_connections), 1)
 
+    def head_bucket(_) -> bool:
+        try:
+            s3_client.head_bucket(Bucket=bucket_name)
+            return True
+        except (BotoCoreError, ClientError):
+            return False
 
-# pylint: disable=W0603
-def get_s3_client():
-    global _s3_client
-    if not _s3_client:
-        _s3_client = boto3.client("s3")
-    return _s3_client
+    # Concurrent requests each hold a connection, which is returned to the pool after
+    with ThreadPoolExecutor(num_connections) as executor:
+        return all(list(executor.map(head_bucket, range(num_connections))))
@@ -11,6 +11,7 @@ from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
 from persisty_data.s3.s3_client import get_s3_client
 
 
+# pylint: disable=R0902
 @dataclass
 class S3ContentWriter(IOBase):
     """
@@ -23,6 +24,7 @@ class S3ContentWriter(IOBase):
     file_name: str
     content_type: Optional[str]
     file: Any = field(default_factory=SpooledTemporaryFile)
+    s3_client: Any = field(default_factory=get_s3_client)
     file_handle_store: StoreABC[PersistyFileHandle] = field(
         default_factory=get_meta(PersistyFileHandle).create_store
     )
@@ -44,7 +46,7 @@ class S3ContentWriter(IOBase):
         exc_tb: Union[TracebackType, None],
     ) -> None:
         self.file.seek(0)
-        response = get_s3_client().put_object(
+        response = self.s3_client.put_object(
             Body=self.file, Key=self.file_name, Bucket=self.bucket_name
         )
         key = f"{self.store_name}/{self.file_name}"
@@ -1,20 +1,28 @@
 from dataclasses import dataclass
 from io import IOBase
-from typing import Optional, Iterator
+from threading import Thread
+from typing import Optional, Iterator, List, Tuple
 
-from persisty.attr.attr_filter import attr_eq
 from persisty.batch_edit import BatchEdit
 
 from persisty_data.file_handle import FileHandle
+from persisty_data.file_store_abc import FileStoreABC
 from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
 from persisty_data.persisty_store.persisty_file_store_abc import PersistyFileStoreABC
 from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
-from persisty_data.s3.s3_client import get_s3_client
+from persisty_data.s3.s3_client import (
+    DEFAULT_S3_CLIENT_CONFIG,
+    S3ClientConfig,
+    get_s3_client,
+    warm_up_s3_client,
+)
 from persisty_data.s3.s3_content_writer import S3ContentWriter
 from persisty_data.s3.s3_upload_part_writer import S3UploadPartWriter
 from persisty_data.upload_part import UploadPart
 
 COPY_BUFFER_SIZE = 1024 * 1024
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = 1024 * 1024 * 1024
 _Route = "starlette.routing.Route"
 
 
@@ -23,10 +31,27 @@ class S3FileStore(PersistyFileStoreABC):
     bucket_name: str = None
     signed_download_urls: bool = False
     signed_upload_urls: bool = True
+    scrub_threads: int = 16  # Reads are bound by request latency rather than bandwidth
+    s3_client_config: S3ClientConfig = DEFAULT_S3_CLIENT_CONFIG
+    # Connections to open in the background on creation, so early requests do not wait for them
+    warm_up_connections: int = 0
 
     def __post_init__(self):
         if not self.bucket_name:
             self.bucket_name = self.meta.name
+        if self.warm_up_connections:
+            Thread(target=self.warm_up, daemon=True).start()
+
+    def get_s3_client(self):
+        return get_s3_client(self.s3_client_config)
+
+    def warm_up(self, num_connections: Optional[int] = None) -> bool:
+        """Resolve credentials and open connections to the bucket, returning False if it could not be reached"""
+        return warm_up_s3_client(
+            self.s3_client_config,
+            self.bucket_name,
+            num_connections or self.warm_up_connections or 1,
+        )
 
     def get_routes(self) -> Iterator[_Route]:
         # No routes because we don't want uploads going through the app server - they should go directly to S3.
@@ -43,13 +68,14 @@ class S3FileStore(PersistyFileStoreABC):
             file_name=file_name,
             file_handle_store=self.file_handle_store,
             content_type=content_type,
+            s3_client=self.get_s3_client(),
         )
 
     def upload_write(
         self,
         part_id: str,
     ) -> Optional[IOBase]:
-        upload_part = self.upload_part_store.read(part_id)
+        upload_part = self._get_upload_part_for_write(part_id)
         if not upload_part:
             return
         upload_handle = self.upload_handle_store.read(upload_part.upload_id)
@@ -60,10 +86,13 @@ class S3FileStore(PersistyFileStoreABC):
             file_name=upload_handle.file_name,
             upload_id=upload_part.upload_id,
             part_number=upload_part.part_number + 1,
+            s3_client=self.get_s3_client(),
         )
 
     def content_read(self, file_name: str) -> Optional[IOBase]:
-        response = get_s3_client().get_object(Bucket=self.bucket_name, Key=file_name)
+        response = self.get_s3_client().get_object(
+            Bucket=self.bucket_name, Key=file_name
+        )
         result = response.get("Body")
         return result
 
@@ -72,12 +101,47 @@ class S3FileStore(PersistyFileStoreABC):
     ) -> Optional[FileHandle]:
         result = super()._to_file_handle(file_handle)
         if result and self.signed_download_urls:
-            result.download_url = get_s3_client().generate_presigned_url(
+            result.download_url = self.get_s3_client().generate_presigned_url(
                 ClientMethod="get_object",
                 Params={"Bucket": self.bucket_name, "Key": file_handle.file_name},
             )
         return result
 
+    def _digest_upload_part(
+        self, upload_part: PersistyUploadPart
+    ) -> Tuple[int, Optional[str]]:
+        """Parts are uploaded directly to S3, which records the size and md5 of each"""
+        upload_handle = self.upload_handle_store.read(str(upload_part.upload_id))
+        if not upload_handle:
+            return 0, None
+        part_number = upload_part.part_number + 1
+        response = self.get_s3_client().list_parts(
+            Bucket=self.bucket_name,
+            Key=upload_handle.file_name,
+            UploadId=str(upload_part.upload_id),
+            PartNumberMarker=part_number - 1,
+            MaxParts=1,
+        )
+        for part in response.get("Parts") or ():
+            if part["PartNumber"] == part_number:
+                return part["Size"], part["ETag"].strip('"')
+        return 0, None  # Never uploaded
+
+    def _get_part_sizes(self, file_handle: PersistyFileHandle) -> Optional[List[int]]:
+        s3_client = self.get_s3_client()
+        part_sizes = []
+        part_number = 1
+        while True:
+            response = s3_client.head_object(
+                Bucket=self.bucket_name,
+                Key=file_handle.file_name,
+                PartNumber=part_number,
+            )
+            part_sizes.append(response["ContentLength"])
+            if part_number >= response.get("PartsCount", 1):
+                return part_sizes
+            part_number += 1
+
     def file_delete(self, file_name: str) -> bool:
         key = self._to_key(file_name)
         file_handle = self.file_handle_store.read(key)
@@ -88,20 +152,95 @@ class S3FileStore(PersistyFileStoreABC):
         result = self.file_handle_store._delete(key, file_handle)
         if not result:
             return False
-        response = get_s3_client().delete_object(Bucket=self.bucket_name, Key=file_name)
+        response = self.get_s3_client().delete_object(
+            Bucket=self.bucket_name, Key=file_name
+        )
         result = response["DeleteMarker"]
         return result
 
+    def file_copy(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        if destination_store not in (None, self):
+            return super().file_copy(
+                source_file_name, destination_file_name, destination_store
+            )
+        file_handle = self.file_handle_store.read(self._to_key(source_file_name))
+        if not file_handle:
+            return None
+        if destination_file_name != source_file_name:
+            self._copy_object(
+                source_file_name, destination_file_name, file_handle.size_in_bytes
+            )
+            response = self.get_s3_client().head_object(
+                Bucket=self.bucket_name, Key=destination_file_name
+            )
+            file_handle = self._copy_file_handle(
+                file_handle,
+                destination_file_name,
+                etag=response["ETag"],
+                size_in_bytes=response["ContentLength"],
+            )
+        return self._to_file_handle(file_handle)
+
+    def _copy_object(self, source_key: str, destination_key: str, size_in_bytes: int):
+        """Copy an object within S3, using a multipart copy for objects too large for copy_object"""
+        s3_client = self.get_s3_client()
+        copy_source = {"Bucket": self.bucket_name, "Key": source_key}
+        if size_in_bytes <= MAX_COPY_OBJECT_SIZE:
+            s3_client.copy_object(
+                Bucket=self.bucket_name, Key=destination_key, CopySource=copy_source
+            )
+            return
+        response = s3_client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=destination_key
+        )
+        upload_id = response["UploadId"]
+        try:
+            parts = []
+            for part_number, start in enumerate(
+                range(0, size_in_bytes, COPY_PART_SIZE), 1
+            ):
+                end = min(start + COPY_PART_SIZE, size_in_bytes) - 1
+                response = s3_client.upload_part_copy(
+                    Bucket=self.bucket_name,
+                    Key=destination_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    CopySource=copy_source,
+                    CopySourceRange=f"bytes={start}-{end}",
+                )
+                parts.append(
+                    {
+                        "ETag": response["CopyPartResult"]["ETag"],
+                        "PartNumber": part_number,
+                    }
+                )
+            s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=destination_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            s3_client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=destination_key, UploadId=upload_id
+            )
+            raise
+
     def upload_finish(self, upload_id: str) -> Optional[FileHandle]:
         upload_handle = self.upload_handle_store.read(upload_id)
         if not upload_handle or upload_handle.store_name != self.meta.name:
             return
-        get_s3_client().complete_multipart_upload(
+        self.get_s3_client().complete_multipart_upload(
             Bucket=self.bucket_name,
             Key=upload_handle.file_name,
             UploadId=upload_handle.id,
         )
-        response = get_s3_client().head_object(
+        response = self.get_s3_client().head_object(
             Bucket=self.bucket_name, Key=upload_handle.file_name
         )
 
@@ -135,8 +274,8 @@ class S3FileStore(PersistyFileStoreABC):
         # pylint: disable=W0212
         result = self.upload_handle_store._delete(upload_id, upload_handle)
         if result:
-            self.upload_part_store.delete_all(attr_eq("upload_id", upload_id))
-            get_s3_client().abort_multipart_upload(
+            self._delete_upload_parts(upload_id)
+            self.get_s3_client().abort_multipart_upload(
                 Bucket=self.bucket_name,
                 Key=upload_handle.file_name,
                 UploadId=upload_id,
@@ -150,7 +289,7 @@ class S3FileStore(PersistyFileStoreABC):
         result = super()._to_upload_part(upload_part)
         if result and self.signed_upload_urls:
             upload_handle = self.upload_handle_store.read(upload_part.upload_id)
-            result.upload_url = get_s3_client().generate_presigned_url(
+            result.upload_url = self.get_s3_client().generate_presigned_url(
                 ClientMethod="upload_part",
                 Params={
                     "Bucket": self.bucket_name,
@@ -180,7 +319,7 @@ class S3FileStore(PersistyFileStoreABC):
             yield BatchEdit(create_item=bucket_object)
 
     def get_all_bucket_objects(self):
-        s3_client = get_s3_client()
+        s3_client = self.get_s3_client()
         kwargs = {"Bucket": self.bucket_name}
         while True:
             response = s3_client.list_objects(**kwargs)
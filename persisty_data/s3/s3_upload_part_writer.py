@@ -19,6 +19,7 @@ class S3UploadPartWriter(IOBase):
     upload_id: str
     part_number: int
     file: Any = field(default_factory=SpooledTemporaryFile)
+    s3_client: Any = field(default_factory=get_s3_client)
 
     def __enter__(self):
         self.file.__enter__()
@@ -33,7 +34,7 @@ class S3UploadPartWriter(IOBase):
         exc_tb: Union[TracebackType, None],
     ) -> None:
         self.file.seek(0)
-        get_s3_client().upload_part(
+        self.s3_client.upload_part(
             Bucket=self.bucket_name,
             Key=self.file_name,
             UploadId=self.upload_id,
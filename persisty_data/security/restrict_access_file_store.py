@@ -22,6 +22,7 @@ from persisty_data.upload_handle import UploadHandleResultSet, UploadHandle
 from persisty_data.upload_part import UploadPartResultSet, UploadPart
 
 
+# pylint: disable=R0904
 @dataclasses.dataclass
 class RestrictAccessFileStore(FileStoreABC):
     file_store: FileStoreABC
@@ -60,7 +61,15 @@ class RestrictAccessFileStore(FileStoreABC):
         update_filter = store_access.update_filter
         if create_filter is INCLUDE_ALL and update_filter is INCLUDE_ALL:
             return self.content_write(file_name, content_type)
-        if create_filter is EXCLUDE_ALL and update_filter is EXCLUDE_ALL:
+        self._check_writable(file_name, content_type)
+        return self.file_store.content_write(file_name, content_type)
+
+    def _check_writable(self, file_name: str, content_type: Optional[str]):
+        store_access = self.store_access
+        if (
+            store_access.create_filter is EXCLUDE_ALL
+            and store_access.update_filter is EXCLUDE_ALL
+        ):
             raise PersistyError("forbidden")
         attrs = get_meta(StoredFileHandle).attrs
         file_handle = self.file_read(file_name)
@@ -73,7 +82,6 @@ class RestrictAccessFileStore(FileStoreABC):
             )
             if not store_access.create_filter.match(file_handle, attrs):
                 raise PersistyError("forbidden")
-        return self.file_store.content_write(file_name, content_type)
 
     def upload_write(self, part_id: str) -> Optional[IOBase]:
         # Security already handled by part_create methods
@@ -126,6 +134,45 @@ class RestrictAccessFileStore(FileStoreABC):
             return False
         return self.file_store.file_delete(file_name)
 
+    def file_copy(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        source_handle = self.file_read(source_file_name)
+        if not source_handle:
+            return None
+        if destination_store is self:
+            destination_store = None
+        if destination_store is None:
+            # Other stores check access themselves when written to
+            self._check_writable(destination_file_name, source_handle.content_type)
+        return self.file_store.file_copy(
+            source_file_name, destination_file_name, destination_store
+        )
+
+    def file_move(
+        self,
+        source_file_name: str,
+        destination_file_name: str,
+        destination_store: Optional[FileStoreABC] = None,
+    ) -> Optional[FileHandle]:
+        source_handle = self.file_read(source_file_name)
+        if not source_handle:
+            return None
+        attrs = get_meta(StoredFileHandle).attrs
+        if not self.store_access.delete_filter.match(source_handle, attrs):
+            raise PersistyError("forbidden")
+        if destination_store is self:
+            destination_store = None
+        if destination_store is None:
+            # Other stores check access themselves when written to
+            self._check_writable(destination_file_name, source_handle.content_type)
+        return self.file_store.file_move(
+            source_file_name, destination_file_name, destination_store
+        )
+
     def upload_create(
         self,
         file_name: Optional[str],
@@ -237,10 +284,12 @@ class RestrictAccessFileStore(FileStoreABC):
         if upload_handle:
             return self.file_store.upload_delete(upload_id)
 
-    def upload_part_create(self, upload_id: str) -> Optional[UploadPart]:
+    def upload_part_create(
+        self, upload_id: str, part_number: Optional[int] = None
+    ) -> Optional[UploadPart]:
         upload_handle = self.upload_read(upload_id)
         if upload_handle:
-            return self.file_store.upload_part_create(upload_id)
+            return self.file_store.upload_part_create(upload_id, part_number)
 
     def upload_part_search(
         self,
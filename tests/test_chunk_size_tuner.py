@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from persisty.errors import PersistyError
+from persisty.impl.mem.mem_store import MemStore
+from persisty.store_meta import get_meta
+
+from benchmarks.chunk_size_tuner import (
+    tune_chunk_size,
+    recommend_chunk_size,
+)
+from persisty_data.persisty_store.data_chunk import DataChunk
+
+
+class SizeLimitedMemStore(MemStore):
+    """Rejects chunks over a maximum size, as DynamoDB does for items over 400KB"""
+
+    max_item_size: int = 4096
+
+    def create(self, item):
+        if len(item.data) > self.max_item_size:
+            raise PersistyError("item_too_large")
+        return super().create(item)
+
+
+class TestChunkSizeTuner(TestCase):
+    def test_tune_chunk_size(self):
+        store = SizeLimitedMemStore(get_meta(DataChunk))
+        trials = tune_chunk_size(store, (1024, 4096, 8192), 32 * 1024)
+        self.assertEqual([1024, 4096, 8192], [t.chunk_size for t in trials])
+        self.assertIsNone(trials[0].error)
+        self.assertIsNone(trials[1].error)
+        self.assertIsNotNone(trials[2].error)
+        self.assertIn(recommend_chunk_size(trials), (1024, 4096))
+        # Trials clean up after themselves
+        self.assertEqual(0, store.count())
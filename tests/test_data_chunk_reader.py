@@ -0,0 +1,161 @@
+import os
+import tracemalloc
+from io import BufferedReader
+from unittest import TestCase
+
+from persisty.impl.mem.mem_store import MemStore
+from persisty.search_filter.include_all import INCLUDE_ALL
+from persisty.store_meta import get_meta
+
+from persisty_data.persisty_store.data_chunk import DataChunk
+from persisty_data.persisty_store.data_chunk_reader import DataChunkReader
+from persisty_data.persisty_store.data_chunk_writer import DataChunkWriter
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+
+class CountingMemStore(MemStore):
+    """Counts the chunks actually consumed by a reader"""
+
+    chunks_loaded: int = 0
+
+    def search_all(self, search_filter=INCLUDE_ALL, search_order=None):
+        for item in super().search_all(search_filter, search_order):
+            self.chunks_loaded += 1
+            yield item
+
+
+class TestDataChunkReader(TestCase):
+    def setUp(self):
+        self.store = CountingMemStore(get_meta(DataChunk))
+        # Three parts with short final chunks, so part boundaries are not aligned with chunks
+        self.part_sizes = (2500, 1700, 900)
+        self.content = bytes(i % 251 for i in range(sum(self.part_sizes)))
+        offset = 0
+        for part_number, part_size in enumerate(self.part_sizes):
+            upload_part = PersistyUploadPart(
+                upload_id="upload", part_number=part_number
+            )
+            with DataChunkWriter(
+                upload_part, data_chunk_store=self.store, chunk_size=1024
+            ) as writer:
+                writer.write(self.content[offset : offset + part_size])
+            offset += part_size
+
+    def reader(self):
+        return DataChunkReader(
+            upload_id="upload",
+            size_in_bytes=len(self.content),
+            data_chunk_store=self.store,
+            chunk_size=1024,
+        )
+
+    def test_read_all(self):
+        with self.reader() as reader:
+            self.assertEqual(self.content, reader.read())
+
+    def test_seek_set(self):
+        with self.reader() as reader:
+            for position in (0, 1023, 1024, 2499, 2500, 4199, 4200, 5099, 3000, 10):
+                reader.seek(position)
+                self.assertEqual(position, reader.tell())
+                self.assertEqual(
+                    self.content[position : position + 700], reader.read(700)
+                )
+
+    def test_seek_cur_and_end(self):
+        with self.reader() as reader:
+            reader.seek(-100, os.SEEK_END)
+            self.assertEqual(self.content[-100:], reader.read())
+            reader.seek(-3000, os.SEEK_CUR)
+            self.assertEqual(self.content[-3000:-2000], reader.read(1000))
+            reader.seek(50, os.SEEK_CUR)
+            self.assertEqual(self.content[-1950:-1900], reader.read(50))
+            self.assertEqual(b"", reader.read(0))
+            with self.assertRaises(ValueError):
+                reader.seek(-1)
+
+    def test_seek_past_end(self):
+        with self.reader() as reader:
+            reader.seek(len(self.content) + 10)
+            self.assertEqual(b"", reader.read(10))
+
+    def test_seek_end_does_not_load_earlier_chunks(self):
+        with self.reader() as reader:
+            self.store.chunks_loaded = 0
+            reader.seek(-10, os.SEEK_END)
+            self.assertEqual(self.content[-10:], reader.read())
+            # Locating the final part costs at most two single chunk queries per earlier part
+            self.assertLessEqual(
+                self.store.chunks_loaded, 2 * (len(self.part_sizes) - 1) + 1
+            )
+            # Part boundaries are remembered, so seeking there again is a single chunk
+            reader.seek(0)
+            self.store.chunks_loaded = 0
+            reader.seek(-20, os.SEEK_END)
+            self.assertEqual(self.content[-20:], reader.read())
+            self.assertEqual(1, self.store.chunks_loaded)
+
+    def test_buffered(self):
+        with BufferedReader(self.reader(), 512) as reader:
+            reader.seek(4000)
+            self.assertEqual(self.content[4000:4300], reader.read(300))
+            reader.seek(100)
+            self.assertEqual(self.content[100:200], reader.read(100))
+
+    def test_prefetch(self):
+        reader = self.reader()
+        reader.prefetch_bytes = 2048
+        with reader:
+            self.assertEqual(self.content[:3000], reader.read(3000))
+            reader.seek(100)
+            self.assertEqual(self.content[100:], reader.read())
+
+    def test_mixed_chunk_sizes(self):
+        # Parts written with chunk sizes smaller and larger than the reader expects
+        store = CountingMemStore(get_meta(DataChunk))
+        for part_number, chunk_size in enumerate((300, 1024, 2000)):
+            upload_part = PersistyUploadPart(upload_id="mixed", part_number=part_number)
+            with DataChunkWriter(
+                upload_part, data_chunk_store=store, chunk_size=chunk_size
+            ) as writer:
+                start = sum(self.part_sizes[:part_number])
+                writer.write(self.content[start : start + self.part_sizes[part_number]])
+        reader = DataChunkReader(
+            upload_id="mixed",
+            size_in_bytes=len(self.content),
+            data_chunk_store=store,
+            chunk_size=1024,
+        )
+        with reader:
+            self.assertEqual(self.content, reader.read())
+            for position in (5000, 0, 2499, 2500, 4199, 4200, 299, 300, 3000):
+                reader.seek(position)
+                self.assertEqual(
+                    self.content[position : position + 700], reader.read(700)
+                )
+
+    def test_readinto_does_not_copy_chunks(self):
+        store = MemStore(get_meta(DataChunk))
+        content = bytes(i % 251 for i in range(100_000))
+        upload_part = PersistyUploadPart(upload_id="large", part_number=0)
+        with DataChunkWriter(
+            upload_part, data_chunk_store=store, chunk_size=len(content)
+        ) as writer:
+            writer.write(content)
+        output = bytearray(90_000)
+        with DataChunkReader(
+            upload_id="large",
+            size_in_bytes=len(content),
+            data_chunk_store=store,
+            chunk_size=len(content),
+        ) as reader:
+            reader.read(1)  # Load the chunk
+            tracemalloc.start()
+            try:
+                self.assertEqual(len(output), reader.readinto(output))
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(content[1:90_001], output)
+        # Slicing the chunk would allocate a copy of the bytes read
+        self.assertLess(peak, 10_000)
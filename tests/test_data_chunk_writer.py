@@ -0,0 +1,80 @@
+import tracemalloc
+from unittest import TestCase
+
+from persisty.impl.mem.mem_store import MemStore
+from persisty.store_meta import get_meta
+
+from persisty_data.persisty_store.data_chunk import DataChunk
+from persisty_data.persisty_store.data_chunk_writer import DataChunkWriter
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+
+
+class BatchCountingMemStore(MemStore):
+    """Records the size of each batch edit"""
+
+    def __init__(self, meta):
+        super().__init__(meta)
+        self.batch_sizes = []
+
+    def edit_batch(self, edits):
+        self.batch_sizes.append(len(edits))
+        return super().edit_batch(edits)
+
+
+class TestDataChunkWriter(TestCase):
+    def writer(self, store, **kwargs):
+        upload_part = PersistyUploadPart(upload_id="upload", part_number=0)
+        return DataChunkWriter(
+            upload_part, data_chunk_store=store, chunk_size=10, **kwargs
+        )
+
+    def test_batched_by_count(self):
+        store = BatchCountingMemStore(get_meta(DataChunk))
+        with self.writer(store, max_batch_chunks=4) as writer:
+            writer.write(b"x" * 95)
+            self.assertEqual([4, 4], store.batch_sizes)
+        self.assertEqual([4, 4, 2], store.batch_sizes)
+        chunks = sorted(store.items.values(), key=lambda c: c.sort_key)
+        self.assertEqual(list(range(10)), [c.chunk_number for c in chunks])
+        self.assertEqual(5, len(chunks[-1].data))
+
+    def test_batched_by_bytes(self):
+        store = BatchCountingMemStore(get_meta(DataChunk))
+        with self.writer(store, max_batch_chunks=100, max_batch_bytes=30) as writer:
+            writer.write(b"x" * 70)
+        self.assertEqual([3, 3, 1], store.batch_sizes)
+
+    def test_flush_keeps_partial_chunk(self):
+        store = BatchCountingMemStore(get_meta(DataChunk))
+        with self.writer(store) as writer:
+            writer.write(b"x" * 25)
+            writer.flush()
+            self.assertEqual(2, len(store.items))
+            writer.write(b"x" * 5)
+        self.assertEqual(3, len(store.items))
+        self.assertTrue(all(len(c.data) == 10 for c in store.items.values()))
+
+    def test_pending_chunks_discarded_on_error(self):
+        store = BatchCountingMemStore(get_meta(DataChunk))
+        with self.assertRaises(ValueError):
+            with self.writer(store) as writer:
+                writer.write(b"x" * 25)
+                raise ValueError()
+        self.assertEqual(0, len(store.items))
+
+    def test_aligned_write_copies_once(self):
+        store = BatchCountingMemStore(get_meta(DataChunk))
+        content = bytes(100_000)
+        upload_part = PersistyUploadPart(upload_id="upload", part_number=0)
+        writer = DataChunkWriter(
+            upload_part, data_chunk_store=store, chunk_size=len(content)
+        )
+        tracemalloc.start()
+        try:
+            writer.write(content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # The only copy of the content should be the one held by the pending chunk
+        self.assertLess(peak, len(content) * 1.2)
+        self.assertEqual(content, writer.batch[0].data)
@@ -0,0 +1,416 @@
+import asyncio
+import errno
+import hashlib
+import os
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, current_thread
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from persisty.attr.attr_filter import AttrFilter
+from persisty.attr.attr_filter_op import AttrFilterOp
+from persisty.impl.mem.mem_store import MemStore
+from persisty.store_meta import get_meta
+
+from persisty_data.directory.directory_file_store import DirectoryFileStore
+from persisty_data.directory.directory_sync import get_shard
+from persisty_data.directory.durability import Durability, GroupSync
+from persisty_data.directory.migrate_layout import migrate_layout
+from persisty_data.file_store_meta import FileStoreMeta
+from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
+from persisty_data.persisty_store.persisty_upload_handle import PersistyUploadHandle
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+from persisty_data.routes import LocalFileResponse, file_handle_response
+
+
+class TestDirectoryFileStore(TestCase):
+    def setUp(self):
+        # pylint: disable=R1732
+        self.temp_dir = TemporaryDirectory()
+        self.file_store = self.create_file_store()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_file_store(self, **kwargs) -> DirectoryFileStore:
+        kwargs.setdefault("file_handle_store", MemStore(get_meta(PersistyFileHandle)))
+        return DirectoryFileStore(
+            meta=FileStoreMeta(name="test", max_part_size=300_000),
+            upload_handle_store=MemStore(get_meta(PersistyUploadHandle)),
+            upload_part_store=MemStore(get_meta(PersistyUploadPart)),
+            store_dir=Path(self.temp_dir.name, "store"),
+            upload_dir=Path(self.temp_dir.name, "upload"),
+            **kwargs,
+        )
+
+    def upload(self, file_name: str, content: bytes):
+        file_store = self.file_store
+        upload_handle = file_store.upload_create(file_name, None, len(content))
+        for upload_part in file_store.upload_part_search(upload_handle.id).results:
+            offset = (upload_part.part_number - 1) * 300_000
+            with file_store.upload_write(upload_part.id) as writer:
+                writer.write(content[offset : offset + 300_000])
+        return file_store.upload_finish(upload_handle.id)
+
+    def get_part_files(self):
+        upload_dir = Path(self.temp_dir.name, "upload")
+        return [p for p in upload_dir.rglob("*") if p.is_file()]
+
+    def test_upload(self):
+        content = bytes(i % 251 for i in range(700_000))
+        file_handle = self.upload("a.bin", content)
+        self.assertEqual(len(content), file_handle.size_in_bytes)
+        part_digests = b"".join(
+            hashlib.md5(content[i : i + 300_000]).digest()
+            for i in range(0, len(content), 300_000)
+        )
+        self.assertEqual(f"{hashlib.md5(part_digests).hexdigest()}-3", file_handle.etag)
+        with self.file_store.content_read("a.bin") as reader:
+            self.assertEqual(content, reader.read())
+        self.assertEqual([], self.get_part_files())
+
+    def test_single_part_upload(self):
+        content = b"single part"
+        file_handle = self.upload("a.txt", content)
+        self.assertEqual(hashlib.md5(content).hexdigest(), file_handle.etag)
+        self.assertEqual([], self.get_part_files())
+        with self.file_store.content_read("a.txt") as reader:
+            self.assertEqual(content, reader.read())
+
+    def test_single_part_upload_across_filesystems(self):
+        replace = os.replace
+        upload_dir = Path(self.temp_dir.name, "upload")
+
+        def cross_device_replace(source, destination):
+            if upload_dir in Path(source).parents:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            replace(source, destination)
+
+        content = b"single part"
+        with patch("os.replace", cross_device_replace):
+            file_handle = self.upload("a.txt", content)
+        self.assertEqual(hashlib.md5(content).hexdigest(), file_handle.etag)
+        self.assertEqual([], self.get_part_files())
+        with self.file_store.content_read("a.txt") as reader:
+            self.assertEqual(content, reader.read())
+
+    def test_reap(self):
+        file_store = self.file_store
+        upload_handle = file_store.upload_create("a.txt", None, None)
+        upload_part = file_store.upload_part_search(upload_handle.id).results[0]
+        with file_store.upload_write(upload_part.id) as writer:
+            writer.write(b"abandoned")
+        file_store.upload_handle_store.update(
+            PersistyUploadHandle(
+                id=upload_handle.id,
+                expire_at=datetime.now(timezone.utc) - timedelta(1),
+            )
+        )
+        report = file_store.create_upload_reaper().reap()
+        self.assertEqual((1, 9), (report.num_uploads, report.num_bytes))
+        self.assertEqual(0, file_store.upload_part_store.count())
+        self.assertFalse(Path(self.temp_dir.name, "upload", upload_handle.id).exists())
+
+    def test_virtual_upload_parts(self):
+        self.file_store = self.create_file_store(virtual_upload_parts=True)
+        content = bytes(i % 251 for i in range(700_000))
+        file_handle = self.upload("a.bin", content)
+        self.assertEqual(len(content), file_handle.size_in_bytes)
+        with self.file_store.content_read("a.bin") as reader:
+            self.assertEqual(content, reader.read())
+
+    def test_file_copy_and_move(self):
+        content = bytes(i % 251 for i in range(100_000))
+        with self.file_store.content_write("a.bin") as writer:
+            writer.write(content)
+        source = self.file_store.file_read("a.bin")
+        file_handle = self.file_store.file_copy("a.bin", "dir/b.bin")
+        self.assertEqual(source.etag, file_handle.etag)
+        with self.file_store.content_read("dir/b.bin") as reader:
+            self.assertEqual(content, reader.read())
+        self.file_store.file_move("a.bin", "c.bin")
+        self.assertIsNone(self.file_store.file_read("a.bin"))
+        self.assertFalse(Path(self.temp_dir.name, "store", "a.bin").exists())
+        with self.file_store.content_read("c.bin") as reader:
+            self.assertEqual(content, reader.read())
+
+    def test_scrub(self):
+        content = bytes(i % 251 for i in range(100_000))
+        with self.file_store.content_write("a.bin") as writer:
+            writer.write(content)
+        self.upload("b.bin", content * 4)
+        report = self.file_store.create_scrubber().scrub()
+        self.assertEqual((2, 1), (report.num_files, report.num_unverified))
+        self.assertEqual([], report.mismatches)
+        Path(self.temp_dir.name, "store", "a.bin").write_bytes(content[:-1])
+        report = self.file_store.create_scrubber().scrub()
+        self.assertEqual(["a.bin"], [m.file_name for m in report.mismatches])
+
+    def download(self, file_name: str, byte_range=None, extensions=None):
+        response = file_handle_response(
+            "get", {}, self.file_store, self.file_store.file_read(file_name), byte_range
+        )
+        self.assertIsInstance(response, LocalFileResponse)
+        messages = []
+
+        async def send(message):
+            if message["type"] == "http.response.zerocopysend":
+                message = {**message, "body": message["file"].read()}
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "extensions": extensions or {}}
+        asyncio.run(response(scope, None, send))
+        return messages
+
+    def test_download(self):
+        content = bytes(i % 251 for i in range(200_000))
+        with self.file_store.content_write("a.bin") as writer:
+            writer.write(content)
+        messages = self.download("a.bin")
+        self.assertEqual(content, b"".join(m.get("body", b"") for m in messages))
+        self.assertEqual(5, len(messages))  # Start, then 64KB buffers
+        messages = self.download("a.bin", (1000, 500))
+        self.assertEqual(content[1000:1500], messages[-1]["body"])
+        messages = self.download(
+            "a.bin", (1000, 500), {"http.response.zerocopysend": {}}
+        )
+        self.assertEqual(
+            (1000, 500, content),
+            (messages[-1]["offset"], messages[-1]["count"], messages[-1]["body"]),
+        )
+        messages = self.download("a.bin", None, {"http.response.pathsend": {}})
+        self.assertEqual(
+            str(Path(self.temp_dir.name, "store", "a.bin")), messages[-1]["path"]
+        )
+
+    def test_directory_sync(self):
+        file_store = self.file_store
+        for file_name in ("a.txt", "b.txt", "gone.txt"):
+            with file_store.content_write(file_name) as writer:
+                writer.write(file_name.encode())
+        store_dir = Path(self.temp_dir.name, "store")
+        (store_dir / "gone.txt").unlink()
+        (store_dir / "dir").mkdir()
+        (store_dir / "dir" / "new.txt").write_bytes(b"new")
+        (store_dir / "a.txt").write_bytes(b"A.txt")
+        # A handle stored after the last change is trusted without hashing
+        file_store.file_handle_store.items["test/b.txt"].updated_at += timedelta(1)
+        (store_dir / "b.txt").write_bytes(b"B.txt")
+        file_store.directory_sync()
+        file_handles = {
+            f.file_name: f for f in file_store.file_handle_store.search_all()
+        }
+        self.assertEqual(["a.txt", "b.txt", "dir/new.txt"], sorted(file_handles))
+        self.assertEqual(hashlib.md5(b"A.txt").hexdigest(), file_handles["a.txt"].etag)
+        self.assertEqual(hashlib.md5(b"b.txt").hexdigest(), file_handles["b.txt"].etag)
+        new_handle = file_handles["dir/new.txt"]
+        self.assertEqual(hashlib.md5(b"new").hexdigest(), new_handle.etag)
+        self.assertEqual(
+            ("text/plain", 3), (new_handle.content_type, new_handle.size_in_bytes)
+        )
+
+    def test_sharded_layout(self):
+        file_store = self.create_file_store(shard_depth=2)
+        with file_store.content_write("dir/a.txt") as writer:
+            writer.write(b"a")
+        shard = get_shard("dir/a.txt", 2)
+        self.assertEqual(5, len(shard))
+        store_dir = Path(self.temp_dir.name, "store")
+        self.assertTrue((store_dir / shard / "dir" / "a.txt").is_file())
+        with file_store.content_read("dir/a.txt") as reader:
+            self.assertEqual(b"a", reader.read())
+        (store_dir / get_shard("b.txt", 2)).mkdir(parents=True)
+        (store_dir / get_shard("b.txt", 2) / "b.txt").write_bytes(b"b")
+        (store_dir / "misplaced.txt").write_bytes(b"misplaced")
+        file_store.directory_sync()
+        file_names = sorted(
+            f.file_name for f in file_store.file_handle_store.search_all()
+        )
+        self.assertEqual(["b.txt", "dir/a.txt"], file_names)
+        (store_dir / shard / "dir" / "a.txt").unlink()
+        file_store.directory_sync()
+        file_names = [f.file_name for f in file_store.file_handle_store.search_all()]
+        self.assertEqual(["b.txt"], file_names)
+
+    def test_migrate_layout(self):
+        for file_name in ("a.txt", "dir/b.txt"):
+            with self.file_store.content_write(file_name) as writer:
+                writer.write(file_name.encode())
+        store_dir = Path(self.temp_dir.name, "store")
+        (store_dir / "c.txt").write_bytes(b"c.txt")  # No handle yet
+        file_store = self.create_file_store(
+            shard_depth=1, file_handle_store=self.file_store.file_handle_store
+        )
+        self.assertEqual(3, migrate_layout(file_store, 0))
+        self.assertFalse((store_dir / "dir").exists())
+        for file_name in ("a.txt", "dir/b.txt", "c.txt"):
+            self.assertTrue((store_dir / get_shard(file_name, 1) / file_name).is_file())
+            with file_store.content_read(file_name) as reader:
+                self.assertEqual(file_name.encode(), reader.read())
+        self.assertEqual(0, file_store.migrate_layout(0))
+
+    def test_atomic_write(self):
+        path = Path(self.temp_dir.name, "store", "a.txt")
+        with self.file_store.content_write("a.txt") as writer:
+            writer.write(b"first")
+        with self.file_store.content_write("a.txt") as writer:
+            writer.write(b"second")
+            self.assertEqual(b"first", path.read_bytes())
+        self.assertEqual(b"second", path.read_bytes())
+        with self.assertRaises(ValueError):
+            with self.file_store.content_write("a.txt") as writer:
+                writer.write(b"third")
+                raise ValueError()
+        self.assertEqual(b"second", path.read_bytes())
+        self.assertEqual(["a.txt"], [p.name for p in path.parent.iterdir()])
+        self.assertEqual(6, self.file_store.file_read("a.txt").size_in_bytes)
+
+    def test_group_sync(self):
+        file_store = self.create_file_store(
+            durability=Durability.DATA_AND_DIRECTORY, group_sync=GroupSync(window=0.1)
+        )
+
+        def write(file_name: str):
+            with file_store.content_write(file_name) as writer:
+                writer.write(file_name.encode())
+
+        with patch("persisty_data.directory.durability.sync_path") as sync_path:
+            with ThreadPoolExecutor(4) as executor:
+                list(executor.map(write, ("a.txt", "b.txt", "c.txt", "d.txt")))
+        synced = [c.args[0] for c in sync_path.call_args_list]
+        store_dir = Path(self.temp_dir.name, "store")
+        # Each file is synced before its rename, but the directory is only synced once per group
+        self.assertEqual(4, len([p for p in synced if p.parent == store_dir]))
+        self.assertLess(synced.count(store_dir), 4)
+        for file_name in ("a.txt", "b.txt", "c.txt", "d.txt"):
+            self.assertEqual(file_name.encode(), (store_dir / file_name).read_bytes())
+
+    def test_group_sync_hands_over_leadership(self):
+        group_sync = GroupSync(window=0.01)
+        synced_by = {}
+
+        def sync_path(path: Path):
+            synced_by[path] = current_thread()
+            if path == Path("a"):
+                # Another writer arrives while the leader is syncing
+                writer = Thread(target=group_sync.sync, args=(Path("b"),))
+                writer.start()
+                while len(group_sync.pending) < 1:
+                    time.sleep(0.001)
+                synced_by["writer"] = writer
+
+        with patch("persisty_data.directory.durability.sync_path", sync_path):
+            group_sync.sync(Path("a"))
+            # The first leader returns once its own batch is synced, rather than syncing for the other writer
+            self.assertNotIn(Path("b"), synced_by)
+            synced_by["writer"].join()
+        self.assertIs(synced_by["writer"], synced_by[Path("b")])
+        self.assertFalse(group_sync.leading)
+
+    def test_move_durability(self):
+        file_store = self.create_file_store(durability=Durability.DATA_AND_DIRECTORY)
+        with file_store.content_write("a.txt") as writer:
+            writer.write(b"a")
+        with patch("persisty_data.directory.durability.sync_path") as sync_path:
+            file_store.file_move("a.txt", "dir/b.txt")
+        store_dir = Path(self.temp_dir.name, "store")
+        synced = [c.args[0] for c in sync_path.call_args_list]
+        self.assertEqual([store_dir / "dir", store_dir], synced)
+
+    def test_preallocated_part(self):
+        file_store = self.file_store
+        upload_handle = file_store.upload_create("a.bin", None, 400_000)
+        upload_parts = file_store.upload_part_search(upload_handle.id).results
+        with file_store.upload_write(upload_parts[1].id) as writer:
+            self.assertEqual(100_000, os.fstat(writer.writer.fileno()).st_size)
+            writer.write(b"short")
+        self.assertEqual([5], [p.stat().st_size for p in self.get_part_files()])
+        file_handle = file_store.upload_finish(upload_handle.id)
+        self.assertEqual(5, file_handle.size_in_bytes)
+
+    @skipUnless(sys.platform == "linux", "inotify is linux only")
+    def test_directory_watcher(self):
+        file_store = self.file_store
+        with file_store.content_write("a.txt") as writer:
+            writer.write(b"a")
+        store_dir = Path(self.temp_dir.name, "store")
+        watcher = file_store.create_directory_watcher(debounce=0)
+        watcher.open()
+        try:
+            (store_dir / "a.txt").write_bytes(b"A")
+            (store_dir / "dir").mkdir()
+            (store_dir / "dir" / "b.txt").write_bytes(b"b")
+            self.assertEqual(2, watcher.poll())
+            self.assertEqual(
+                hashlib.md5(b"A").hexdigest(), file_store.file_read("a.txt").etag
+            )
+            self.assertEqual(1, file_store.file_read("dir/b.txt").size_in_bytes)
+            (store_dir / "dir").rename(Path(self.temp_dir.name, "moved"))
+            self.assertEqual(1, watcher.poll())
+            self.assertIsNone(file_store.file_read("dir/b.txt"))
+            (store_dir / "a.txt").unlink()
+            self.assertEqual(1, watcher.poll())
+            self.assertIsNone(file_store.file_read("a.txt"))
+            self.assertEqual(0, watcher.poll())
+        finally:
+            watcher.close()
+
+    def test_stat_metadata(self):
+        for use_xattrs in (True, False):
+            with self.subTest(use_xattrs=use_xattrs):
+                self.temp_dir.cleanup()
+                file_store = self.create_file_store(stat_metadata=True)
+                file_handle_store = file_store.file_handle_store
+                file_handle_store.use_xattrs = use_xattrs
+                for file_name in ("a.txt", "dir/b.txt", "dir/c.json", "other/d.txt"):
+                    with file_store.content_write(file_name, "text/x") as writer:
+                        writer.write(file_name.encode())
+                file_handle = file_store.file_read("dir/b.txt")
+                self.assertEqual(
+                    hashlib.md5(b"dir/b.txt").hexdigest(), file_handle.etag
+                )
+                self.assertEqual(
+                    ("text/x", 9), (file_handle.content_type, file_handle.size_in_bytes)
+                )
+                store_dir = Path(self.temp_dir.name, "store")
+                # Other processes' changes are picked up when next read
+                (store_dir / "dir" / "b.txt").write_bytes(b"changed")
+                (store_dir / "dir" / "e.txt").write_bytes(b"new")
+                file_handles = file_store.file_read_batch(["dir/b.txt", "dir/e.txt"])
+                self.assertEqual(
+                    [
+                        hashlib.md5(b"changed").hexdigest(),
+                        hashlib.md5(b"new").hexdigest(),
+                    ],
+                    [f.etag for f in file_handles],
+                )
+                self.assertEqual("text/x", file_handles[0].content_type)
+                self.assertEqual("text/plain", file_handles[1].content_type)
+                prefix_filter = AttrFilter("file_name", AttrFilterOp.startswith, "DIR/")
+                result_set = file_store.file_search(prefix_filter, limit=2)
+                self.assertEqual(
+                    ["dir/b.txt", "dir/c.json"],
+                    [f.file_name for f in result_set.results],
+                )
+                result_set = file_store.file_search(
+                    prefix_filter, page_key=result_set.next_page_key
+                )
+                self.assertEqual(
+                    ["dir/e.txt"], [f.file_name for f in result_set.results]
+                )
+                self.assertEqual(5, file_store.file_count())
+                file_store.file_move("a.txt", "moved.txt")
+                self.assertTrue(file_store.file_delete("dir/c.json"))
+                self.assertIsNone(file_store.file_read("dir/c.json"))
+                file_names = [f.file_name for f in file_handle_store.search_all()]
+                self.assertEqual(
+                    ["dir/b.txt", "dir/e.txt", "moved.txt", "other/d.txt"], file_names
+                )
+                self.assertEqual(
+                    "text/x", file_store.file_read("moved.txt").content_type
+                )
@@ -0,0 +1,462 @@
+import hashlib
+from datetime import datetime, timezone, timedelta
+import os
+from typing import Optional
+from unittest import TestCase
+
+from persisty.errors import PersistyError
+from persisty.impl.mem.mem_store import MemStore
+from persisty.store_meta import get_meta
+
+from persisty_data.codec.zlib_chunk_codec import ZlibChunkCodec
+from persisty_data.file_store_meta import FileStoreMeta
+from persisty_data.persisty_store.chunk_collector import CollectionReport
+from persisty_data.persisty_store.content_chunk import ContentChunk
+from persisty_data.persisty_store.content_chunk_refs import ContentChunkRefs
+from persisty_data.persisty_store.data_chunk import (
+    DataChunk,
+    get_data_chunk_key_store,
+)
+from persisty_data.persisty_store.data_chunk_cache import DataChunkCache
+from persisty_data.persisty_store.persisty_file_handle import PersistyFileHandle
+from persisty_data.persisty_store.persisty_file_store import PersistyFileStore
+from persisty_data.persisty_store.persisty_upload_handle import PersistyUploadHandle
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+from persisty_data.persisty_store.scrubber import ScrubMismatch
+from persisty_data.persisty_store.upload_reaper import ReapReport
+
+
+def create_file_store(meta: Optional[FileStoreMeta] = None, **kwargs):
+    return PersistyFileStore(
+        meta=meta or FileStoreMeta(name="test"),
+        file_handle_store=MemStore(get_meta(PersistyFileHandle)),
+        upload_handle_store=MemStore(get_meta(PersistyUploadHandle)),
+        upload_part_store=MemStore(get_meta(PersistyUploadPart)),
+        data_chunk_store=MemStore(get_meta(DataChunk)),
+        **kwargs,
+    )
+
+
+def write(file_store: PersistyFileStore, file_name: str, content: bytes):
+    with file_store.content_write(file_name) as writer:
+        writer.write(content)
+
+
+def collect(file_store: PersistyFileStore) -> CollectionReport:
+    collector = file_store.create_chunk_collector(min_age=0, batch_delay=0)
+    return collector.collect()
+
+
+def read(file_store: PersistyFileStore, file_name: str) -> bytes:
+    with file_store.content_read(file_name) as reader:
+        return reader.read()
+
+
+class TestPersistyFileStore(TestCase):
+    def test_write_read_delete(self):
+        file_store = create_file_store()
+        content = bytes(i % 251 for i in range(600_000))
+        write(file_store, "a.bin", content)
+        self.assertEqual(content, read(file_store, "a.bin"))
+        self.assertEqual(len(content), file_store.file_read("a.bin").size_in_bytes)
+        self.assertTrue(file_store.file_delete("a.bin"))
+        report = collect(file_store)
+        self.assertEqual(3, report.num_data_chunks)
+        self.assertEqual(len(content), report.num_bytes)
+        self.assertEqual(0, file_store.data_chunk_store.count())
+
+    def test_dedup(self):
+        content_chunk_store = MemStore(get_meta(ContentChunk))
+        file_store = create_file_store(content_chunk_store=content_chunk_store)
+        content = bytes(256 * 1024 * 2) + b"tail"
+        write(file_store, "a.bin", content)
+        write(file_store, "b.bin", content)
+        self.assertEqual(content, read(file_store, "a.bin"))
+        self.assertEqual(content, read(file_store, "b.bin"))
+        # Two identical full chunks and a tail, shared by both files
+        ref_counts = sorted(c.ref_count for c in content_chunk_store.items.values())
+        self.assertEqual([2, 4], ref_counts)
+        self.assertTrue(
+            all(c.data == b"" for c in file_store.data_chunk_store.items.values())
+        )
+
+        write(file_store, "a.bin", b"replaced")
+        self.assertEqual(b"replaced", read(file_store, "a.bin"))
+        collect(file_store)
+        ref_counts = sorted(c.ref_count for c in content_chunk_store.items.values())
+        self.assertEqual([1, 1, 2], ref_counts)
+
+        file_store.file_delete("a.bin")
+        file_store.file_delete("b.bin")
+        collect(file_store)
+        self.assertEqual(0, content_chunk_store.count())
+        self.assertEqual(0, file_store.data_chunk_store.count())
+
+    def test_release_racing_acquire(self):
+        content_chunk_refs = ContentChunkRefs(MemStore(get_meta(ContentChunk)))
+        content_chunk_refs.acquire([DataChunk(data=b"shared")])
+        content_hash = hashlib.sha256(b"shared").hexdigest()
+        update = content_chunk_refs.content_chunk_store.update
+
+        def update_then_acquire(*args, **kwargs):
+            # Another writer deduplicates the same content after the last reference is released
+            result = update(*args, **kwargs)
+            content_chunk_refs.content_chunk_store.update = update
+            content_chunk_refs.acquire([DataChunk(data=b"shared")])
+            return result
+
+        content_chunk_refs.content_chunk_store.update = update_then_acquire
+        self.assertEqual(0, content_chunk_refs.release([content_hash]))
+        content_chunk = content_chunk_refs.content_chunk_store.read(content_hash)
+        self.assertEqual((1, b"shared"), (content_chunk.ref_count, content_chunk.data))
+        self.assertEqual(6, content_chunk_refs.release([content_hash]))
+        self.assertIsNone(content_chunk_refs.content_chunk_store.read(content_hash))
+
+    def test_chunk_codec(self):
+        meta = FileStoreMeta(name="test", chunk_codec=ZlibChunkCodec())
+        file_store = create_file_store(meta)
+        content = b"compressible " * 50_000
+        write(file_store, "a.txt", content)
+        data_chunks = list(file_store.data_chunk_store.items.values())
+        self.assertTrue(all(c.codec == "zlib" for c in data_chunks))
+        self.assertLess(sum(len(c.data) for c in data_chunks), len(content) / 10)
+        self.assertEqual(content, read(file_store, "a.txt"))
+        with file_store.content_read("a.txt") as reader:
+            reader.seek(-100_000, os.SEEK_END)
+            self.assertEqual(content[-100_000:], reader.read())
+
+    def test_chunk_codec_skips_incompressible(self):
+        meta = FileStoreMeta(name="test", chunk_codec=ZlibChunkCodec())
+        file_store = create_file_store(meta)
+        content = os.urandom(600_000)
+        write(file_store, "a.jpg", content)
+        data_chunks = list(file_store.data_chunk_store.items.values())
+        self.assertTrue(all(c.codec is None for c in data_chunks))
+        self.assertEqual(content, read(file_store, "a.jpg"))
+
+    def test_upload(self):
+        file_store = create_file_store(
+            FileStoreMeta(name="test", max_part_size=300_000)
+        )
+        content = bytes(i % 251 for i in range(700_000))
+        upload_handle = file_store.upload_create("a.bin", None, len(content))
+        upload_parts = file_store.upload_part_search(upload_handle.id).results
+        self.assertEqual(3, len(upload_parts))
+        for upload_part in upload_parts:
+            offset = (upload_part.part_number - 1) * 300_000
+            with file_store.upload_write(upload_part.id) as writer:
+                writer.write(content[offset : offset + 300_000])
+        file_store.data_chunk_store = None  # Finishing should not need to read chunks
+        file_handle = file_store.upload_finish(upload_handle.id)
+        self.assertEqual(len(content), file_handle.size_in_bytes)
+        part_digests = b"".join(
+            hashlib.md5(content[i : i + 300_000]).digest()
+            for i in range(0, len(content), 300_000)
+        )
+        self.assertEqual(f"{hashlib.md5(part_digests).hexdigest()}-3", file_handle.etag)
+
+    def test_inline(self):
+        file_store = create_file_store(FileStoreMeta(name="test", inline_max_size=8192))
+        write(file_store, "a.txt", b"small")
+        self.assertEqual(0, file_store.data_chunk_store.count())
+        file_store.data_chunk_store = None  # Reading should not need to query chunks
+        self.assertEqual(b"small", read(file_store, "a.txt"))
+        file_handle = file_store.file_read("a.txt")
+        self.assertEqual(hashlib.md5(b"small").hexdigest(), file_handle.etag)
+        self.assertEqual(5, file_handle.size_in_bytes)
+
+    def test_inline_replaced_by_chunks(self):
+        file_store = create_file_store(FileStoreMeta(name="test", inline_max_size=8192))
+        write(file_store, "a.bin", b"small")
+        content = bytes(i % 251 for i in range(10_000))
+        write(file_store, "a.bin", content)
+        self.assertIsNone(file_store.file_handle_store.read("test/a.bin").data)
+        self.assertEqual(content, read(file_store, "a.bin"))
+        write(file_store, "a.bin", b"small again")
+        collect(file_store)
+        self.assertEqual(0, file_store.data_chunk_store.count())
+        self.assertEqual(b"small again", read(file_store, "a.bin"))
+        self.assertTrue(file_store.file_delete("a.bin"))
+
+    def test_upload_inline(self):
+        file_store = create_file_store(FileStoreMeta(name="test", inline_max_size=8192))
+        upload_handle = file_store.upload_create("a.txt", None, 5)
+        upload_part = file_store.upload_part_search(upload_handle.id).results[0]
+        with file_store.upload_write(upload_part.id) as writer:
+            writer.write(b"small")
+        file_store.upload_finish(upload_handle.id)
+        collect(file_store)
+        self.assertEqual(0, file_store.data_chunk_store.count())
+        self.assertEqual(b"small", file_store.file_handle_store.read("test/a.txt").data)
+        self.assertEqual(b"small", read(file_store, "a.txt"))
+
+    def test_upload_not_inline(self):
+        for meta, content in (
+            (FileStoreMeta(name="test"), b""),
+            (FileStoreMeta(name="test", inline_max_size=8192, chunk_size=4), b"small"),
+        ):
+            file_store = create_file_store(meta)
+            upload_handle = file_store.upload_create("a.txt", None, len(content))
+            upload_part = file_store.upload_part_search(upload_handle.id).results[0]
+            with file_store.upload_write(upload_part.id) as writer:
+                writer.write(content)
+            file_store.upload_finish(upload_handle.id)
+            file_handle = file_store.file_handle_store.read("test/a.txt")
+            self.assertIsNone(file_handle.data)
+            self.assertEqual(str(upload_handle.id), str(file_handle.upload_id))
+            self.assertEqual(content, read(file_store, "a.txt"))
+
+    def test_collect(self):
+        file_store = create_file_store()
+        write(file_store, "live.bin", b"live")
+        write(file_store, "deleted.bin", b"deleted")
+        upload_handle = file_store.upload_create("a.txt", None, 5)
+        upload_part = file_store.upload_part_search(upload_handle.id).results[0]
+        with file_store.upload_write(upload_part.id) as writer:
+            writer.write(b"in progress")
+        file_store.file_delete("deleted.bin")
+        # Nothing is collected until old enough, in case a write is still in progress
+        report = file_store.create_chunk_collector(batch_delay=0).collect()
+        self.assertEqual(CollectionReport(), report)
+        report = collect(file_store)
+        self.assertEqual(CollectionReport(1, 0, 7), report)
+        self.assertEqual(b"live", read(file_store, "live.bin"))
+        file_store.upload_finish(upload_handle.id)
+        self.assertEqual(0, file_store.upload_part_store.count())
+        report = collect(file_store)
+        self.assertEqual(CollectionReport(), report)
+        self.assertEqual(b"in progress", read(file_store, "a.txt"))
+
+    def test_collect_without_loading_data(self):
+        file_store = create_file_store()
+        write(file_store, "deleted.bin", b"deleted")
+        file_store.file_delete("deleted.bin")
+        key_store = get_data_chunk_key_store(file_store.data_chunk_store)
+        data_chunk = next(key_store.search_all())
+        self.assertFalse(hasattr(data_chunk, "data"))
+        self.assertEqual(7, data_chunk.stored_size)
+        collector = file_store.create_chunk_collector(min_age=0, batch_delay=0)
+        self.assertIsNot(file_store.data_chunk_store, collector.data_chunk_key_store)
+        self.assertEqual(CollectionReport(1, 0, 7), collector.collect())
+        self.assertEqual(0, file_store.data_chunk_store.count())
+
+    def test_reap(self):
+        file_store = create_file_store()
+        expired = file_store.upload_create("expired.txt", None, None)
+        active = file_store.upload_create("active.txt", None, None)
+        for upload_handle in (expired, active):
+            upload_part = file_store.upload_part_search(upload_handle.id).results[0]
+            with file_store.upload_write(upload_part.id) as writer:
+                writer.write(b"abandoned")
+        file_store.upload_handle_store.update(
+            PersistyUploadHandle(
+                id=expired.id, expire_at=datetime.now(timezone.utc) - timedelta(1)
+            )
+        )
+        reaper = file_store.create_upload_reaper(batch_size=1)
+        self.assertEqual(ReapReport(1, 9), reaper.reap())
+        self.assertEqual(ReapReport(), reaper.reap())
+        self.assertEqual((1, 9), (reaper.num_uploads, reaper.num_bytes))
+        self.assertIsNone(file_store.upload_read(expired.id))
+        self.assertIsNotNone(file_store.upload_read(active.id))
+        self.assertEqual(1, file_store.upload_part_store.count())
+        collect(file_store)
+        self.assertEqual(1, file_store.data_chunk_store.count())
+
+    def test_upload_part_create(self):
+        file_store = create_file_store()
+        upload_handle = file_store.upload_create("a.bin", None, None)
+        self.assertEqual(2, file_store.upload_part_create(upload_handle.id).part_number)
+        declared = file_store.upload_part_create(upload_handle.id, 4)
+        self.assertEqual(4, declared.part_number)
+        # Declaring the same part again is idempotent
+        self.assertEqual(declared, file_store.upload_part_create(upload_handle.id, 4))
+        self.assertEqual(3, file_store.upload_part_create(upload_handle.id).part_number)
+        # 4 was declared, so allocation skips it
+        self.assertEqual(5, file_store.upload_part_create(upload_handle.id).part_number)
+        part_numbers = [
+            p.part_number
+            for p in file_store.upload_part_search(upload_handle.id).results
+        ]
+        self.assertEqual([1, 2, 3, 4, 5], part_numbers)
+        with self.assertRaises(PersistyError):
+            file_store.upload_part_create(upload_handle.id, 0)
+
+    def test_virtual_upload_parts(self):
+        file_store = create_file_store(
+            FileStoreMeta(name="test", max_part_size=300_000),
+            virtual_upload_parts=True,
+        )
+        content = bytes(i % 251 for i in range(700_000))
+        upload_handle = file_store.upload_create("a.bin", None, len(content))
+        self.assertEqual(0, file_store.upload_part_store.count())
+        self.assertEqual(3, file_store.upload_part_count(upload_handle.id))
+        first_page = file_store.upload_part_search(upload_handle.id, limit=2)
+        second_page = file_store.upload_part_search(
+            upload_handle.id, first_page.next_page_key
+        )
+        self.assertIsNone(second_page.next_page_key)
+        upload_parts = first_page.results + second_page.results
+        self.assertEqual([1, 2, 3], [p.part_number for p in upload_parts])
+        for upload_part in upload_parts:
+            offset = (upload_part.part_number - 1) * 300_000
+            with file_store.upload_write(upload_part.id) as writer:
+                writer.write(content[offset : offset + 300_000])
+        self.assertEqual(3, file_store.upload_part_store.count())
+        forged = upload_parts[0].id.replace(".0.", ".3.")
+        self.assertIsNone(file_store.upload_write(forged))
+        file_store.upload_finish(upload_handle.id)
+        self.assertEqual(content, read(file_store, "a.bin"))
+
+    def test_virtual_upload_part_create(self):
+        file_store = create_file_store(virtual_upload_parts=True)
+        upload_handle = file_store.upload_create("a.bin", None, None)
+        self.assertEqual(2, file_store.upload_part_create(upload_handle.id).part_number)
+        declared = file_store.upload_part_create(upload_handle.id, 5)
+        self.assertEqual(5, declared.part_number)
+        self.assertEqual(declared, file_store.upload_part_create(upload_handle.id, 5))
+        self.assertEqual(5, file_store.upload_part_count(upload_handle.id))
+        self.assertEqual(0, file_store.upload_part_store.count())
+
+    def test_file_copy_and_move(self):
+        file_store = create_file_store()
+        content = bytes(i % 251 for i in range(600_000))
+        write(file_store, "a.bin", content)
+        num_chunks = file_store.data_chunk_store.count()
+        file_handle = file_store.file_copy("a.bin", "b.bin")
+        self.assertEqual("b.bin", file_handle.file_name)
+        self.assertEqual(num_chunks, file_store.data_chunk_store.count())
+        file_store.file_delete("a.bin")
+        collect(file_store)
+        self.assertEqual(content, read(file_store, "b.bin"))
+        file_store.file_move("b.bin", "c.bin")
+        self.assertIsNone(file_store.file_read("b.bin"))
+        self.assertEqual(content, read(file_store, "c.bin"))
+        self.assertIsNone(file_store.file_copy("missing.bin", "d.bin"))
+
+    def test_file_copy_between_stores(self):
+        source = create_file_store()
+        destination = create_file_store(FileStoreMeta(name="other"))
+        write(source, "a.bin", b"content")
+        file_handle = source.file_copy("a.bin", "b.bin", destination)
+        self.assertEqual(source.file_read("a.bin").etag, file_handle.etag)
+        self.assertEqual(b"content", read(destination, "b.bin"))
+
+    def test_scrub(self):
+        file_store = create_file_store(
+            FileStoreMeta(name="test", max_part_size=300_000)
+        )
+        content = bytes(i % 251 for i in range(700_000))
+        write(file_store, "a.bin", content)
+        upload_handle = file_store.upload_create("b.bin", None, len(content))
+        for upload_part in file_store.upload_part_search(upload_handle.id).results:
+            offset = (upload_part.part_number - 1) * 300_000
+            with file_store.upload_write(upload_part.id) as writer:
+                writer.write(content[offset : offset + 300_000])
+        file_store.upload_finish(upload_handle.id)
+        write(file_store, "c.bin", b"c")
+        report = file_store.create_scrubber().scrub()
+        self.assertEqual(
+            (3, len(content) * 2 + 1), (report.num_files, report.num_bytes)
+        )
+        self.assertEqual([], report.mismatches)
+        self.assertEqual(0, report.num_unverified)
+        file_handle = file_store.file_handle_store.read("test/b.bin")
+        data_chunk = next(
+            c
+            for c in file_store.data_chunk_store.items.values()
+            if c.upload_id == str(file_handle.upload_id)
+        )
+        file_store.data_chunk_store.update(
+            DataChunk(id=data_chunk.id, data=bytes(len(data_chunk.data)))
+        )
+        report = file_store.create_scrubber().scrub()
+        self.assertEqual(["b.bin"], [m.file_name for m in report.mismatches])
+
+    def test_scrub_missing_chunk(self):
+        file_store = create_file_store(
+            FileStoreMeta(name="test", max_part_size=300_000)
+        )
+        content = bytes(i % 251 for i in range(700_000))
+        for file_name in ("a.bin", "b.bin", "c.bin"):
+            write(file_store, file_name, content)
+        file_handle = file_store.file_handle_store.read("test/b.bin")
+        data_chunk = next(
+            c
+            for c in file_store.data_chunk_store.items.values()
+            if c.upload_id == str(file_handle.upload_id)
+        )
+        file_store.data_chunk_store.delete(data_chunk.id)
+        scrubber = file_store.create_scrubber(batch_size=1)
+        report = scrubber.scrub()
+        self.assertEqual(3, report.num_files)
+        self.assertEqual(["b.bin"], [m.file_name for m in report.mismatches])
+        self.assertIsNotNone(report.mismatches[0].error)
+        self.assertIsNone(report.checkpoint)
+
+    def test_scrub_resume(self):
+        file_store = create_file_store()
+        for file_name in ("a.txt", "b.txt", "c.txt"):
+            write(file_store, file_name, file_name.encode())
+        file_store.file_handle_store.update(
+            PersistyFileHandle(id="test/b.txt", etag=hashlib.md5(b"x").hexdigest())
+        )
+        scrubber = file_store.create_scrubber(
+            batch_size=1, max_files=2, max_bytes_per_second=1000
+        )
+        report = scrubber.scrub()
+        self.assertEqual((2, "b.txt"), (report.num_files, report.checkpoint))
+        self.assertEqual(
+            [
+                ScrubMismatch(
+                    "b.txt",
+                    hashlib.md5(b"x").hexdigest(),
+                    hashlib.md5(b"b.txt").hexdigest(),
+                )
+            ],
+            report.mismatches,
+        )
+        report = scrubber.scrub()
+        self.assertEqual((1, None), (report.num_files, report.checkpoint))
+        self.assertEqual([], report.mismatches)
+
+    def test_chunk_cache(self):
+        chunk_cache = DataChunkCache(max_bytes=600_000)
+        file_store = create_file_store(chunk_cache=chunk_cache)
+        content = bytes(i % 251 for i in range(600_000))
+        write(file_store, "a.bin", content)
+        self.assertEqual(content, read(file_store, "a.bin"))
+        self.assertEqual((0, 1), (chunk_cache.hits, chunk_cache.misses))
+        data_chunk_store = file_store.data_chunk_store
+        file_store.data_chunk_store = MemStore(get_meta(DataChunk))
+        self.assertEqual(content, read(file_store, "a.bin"))
+        with file_store.content_read("a.bin") as reader:
+            reader.seek(300_000)
+            self.assertEqual(content[300_000:], reader.read())
+        self.assertEqual((5, 1), (chunk_cache.hits, chunk_cache.misses))
+        file_store.data_chunk_store = data_chunk_store
+        write(file_store, "b.bin", content)
+        self.assertEqual(content, read(file_store, "b.bin"))
+        self.assertEqual(3, chunk_cache.evictions)
+        self.assertEqual(len(content), chunk_cache.num_bytes)
+
+    def test_chunk_cache_invalidate(self):
+        chunk_cache = DataChunkCache()
+        file_store = create_file_store(chunk_cache=chunk_cache)
+        upload_handle = file_store.upload_create("a.txt", None, None)
+        upload_part = file_store.upload_part_search(upload_handle.id).results[0]
+        with file_store.upload_write(upload_part.id) as writer:
+            writer.write(b"first")
+        # pylint: disable=W0212
+        with file_store._create_reader(str(upload_handle.id), 5) as reader:
+            self.assertEqual(b"first", reader.read())
+        self.assertEqual(5, chunk_cache.num_bytes)
+        with file_store.upload_write(upload_part.id) as writer:
+            writer.write(b"again")
+        self.assertEqual(0, chunk_cache.num_bytes)
+        file_store.upload_finish(upload_handle.id)
+        self.assertEqual(b"again", read(file_store, "a.txt"))
+        file_store.file_delete("a.txt")
+        collector = file_store.create_chunk_collector(min_age=0, batch_delay=0)
+        self.assertEqual(1, collector.collect().num_data_chunks)
+        self.assertEqual((0, {}), (chunk_cache.num_bytes, chunk_cache.chunks))
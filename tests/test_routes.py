@@ -0,0 +1,32 @@
+import tracemalloc
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from persisty_data.routes import content_iterator, CHUNK_SIZE
+
+
+class TestRoutes(TestCase):
+    def setUp(self):
+        self.content = bytes(i % 251 for i in range(CHUNK_SIZE * 3 + 100))
+        self.file_store = MagicMock()
+        self.file_store.content_read.side_effect = lambda _: BytesIO(self.content)
+
+    def test_content_iterator(self):
+        result = b"".join(content_iterator(self.file_store, "test", None))
+        self.assertEqual(self.content, result)
+
+    def test_content_iterator_range(self):
+        result = b"".join(content_iterator(self.file_store, "test", (100, 70_000)))
+        self.assertEqual(self.content[100:70_100], result)
+
+    def test_content_iterator_allocations(self):
+        tracemalloc.start()
+        try:
+            for data in content_iterator(self.file_store, "test", (10, CHUNK_SIZE)):
+                _, peak = tracemalloc.get_traced_memory()
+                # One buffer per chunk, with no copy made to honour the range
+                self.assertLess(peak, CHUNK_SIZE * 1.2)
+                self.assertIsInstance(data, memoryview)
+        finally:
+            tracemalloc.stop()
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from uuid import uuid4
+
+from botocore.stub import Stubber
+from persisty.impl.mem.mem_store import MemStore
+from persisty.store_meta import get_meta
+
+from persisty_data.file_store_meta import FileStoreMeta
+from persisty_data.persisty_store.persisty_upload_handle import PersistyUploadHandle
+from persisty_data.persisty_store.persisty_upload_part import PersistyUploadPart
+from persisty_data.s3.s3_client import S3ClientConfig, get_s3_client
+from persisty_data.s3.s3_file_store import S3FileStore
+
+
+class TestS3Client(TestCase):
+    def test_get_s3_client(self):
+        config = S3ClientConfig(
+            endpoint_url="http://localhost:9000",
+            region_name="us-east-1",
+            max_pool_connections=64,
+            addressing_style="path",
+        )
+        with ThreadPoolExecutor(8) as executor:
+            s3_clients = list(executor.map(lambda _: get_s3_client(config), range(8)))
+        self.assertEqual(1, len({id(c) for c in s3_clients}))
+        s3_client = s3_clients[0]
+        self.assertEqual("http://localhost:9000", s3_client.meta.endpoint_url)
+        self.assertEqual(64, s3_client.meta.config.max_pool_connections)
+        self.assertEqual("path", s3_client.meta.config.s3["addressing_style"])
+        self.assertIsNot(
+            s3_client, get_s3_client(S3ClientConfig(region_name="us-east-1"))
+        )
+
+    def test_digest_upload_part(self):
+        config = S3ClientConfig(region_name="us-east-1")
+        file_store = S3FileStore(
+            meta=FileStoreMeta(name="test"),
+            upload_handle_store=MemStore(get_meta(PersistyUploadHandle)),
+            upload_part_store=MemStore(get_meta(PersistyUploadPart)),
+            s3_client_config=config,
+        )
+        upload_handle = file_store.upload_handle_store.create(
+            PersistyUploadHandle(
+                id=str(uuid4()), store_name="test", file_name="a.bin", content_type=None
+            )
+        )
+        upload_part = PersistyUploadPart(upload_id=upload_handle.id, part_number=1)
+        with Stubber(get_s3_client(config)) as stubber:
+            stubber.add_response(
+                "list_parts",
+                {"Parts": [{"PartNumber": 2, "Size": 5, "ETag": '"abc"'}]},
+                {
+                    "Bucket": "test",
+                    "Key": "a.bin",
+                    "UploadId": str(upload_handle.id),
+                    "PartNumberMarker": 1,
+                    "MaxParts": 1,
+                },
+            )
+            # noinspection PyProtectedMember
+            # pylint: disable=W0212
+            self.assertEqual((5, "abc"), file_store._digest_upload_part(upload_part))